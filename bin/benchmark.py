@@ -0,0 +1,609 @@
+"""Benchmarks of the performance-critical parts of the pipeline.
+
+Each benchmark is a sub-command, e.g.::
+
+    python benchmark.py neighborhood --image ../data/test/117122/T1native.nii.gz
+
+Run ``python benchmark.py --help`` for the list of benchmarks.
+"""
+import argparse
+import concurrent.futures as futures
+import hashlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import warnings
+
+import joblib
+import numpy as np
+import SimpleITK as sitk
+import sklearn.ensemble as sk_ensemble
+
+try:
+    import mialab.data.structure as structure
+    import mialab.filtering.feature_extraction as fltr_feat
+    import mialab.filtering.preprocessing as fltr_prep
+    import mialab.utilities.compact_forest as compact_forest
+    import mialab.utilities.concurrency as concurrency
+    import mialab.utilities.feature_store as fstore
+    import mialab.utilities.file_access_utilities as futil
+    import mialab.utilities.multi_processor as mproc
+    import mialab.utilities.pipeline_utilities as putil
+    import mialab.utilities.prediction as prediction
+    import mialab.utilities.training as training
+except ImportError:
+    # Append the MIALab root directory to Python path
+    sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
+    import mialab.data.structure as structure
+    import mialab.filtering.feature_extraction as fltr_feat
+    import mialab.filtering.preprocessing as fltr_prep
+    import mialab.utilities.compact_forest as compact_forest
+    import mialab.utilities.concurrency as concurrency
+    import mialab.utilities.feature_store as fstore
+    import mialab.utilities.file_access_utilities as futil
+    import mialab.utilities.multi_processor as mproc
+    import mialab.utilities.pipeline_utilities as putil
+    import mialab.utilities.prediction as prediction
+    import mialab.utilities.training as training
+
+LOADING_KEYS = [structure.BrainImageTypes.T1w,
+                structure.BrainImageTypes.T2w,
+                structure.BrainImageTypes.GroundTruth,
+                structure.BrainImageTypes.BrainMask,
+                structure.BrainImageTypes.RegistrationTransform]
+
+
+def _crop(image: sitk.Image, size: int) -> sitk.Image:
+    """Crops a cube of edge length ``size`` from the center of an image."""
+    if size is None:
+        return image
+    center = [s // 2 for s in image.GetSize()]
+    start = [max(0, c - size // 2) for c in center]
+    stop = [min(s, st + size) for s, st in zip(image.GetSize(), start)]
+    return image[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+
+
+def _load_subject(data_dir: str, subject: str = None) -> tuple:
+    """Gets the identifier and the paths of a subject (the first one if ``subject`` is None) of a data directory."""
+    crawler = futil.FileSystemDataCrawler(data_dir, LOADING_KEYS, futil.BrainImageFilePathGenerator(),
+                                          futil.DataDirectoryFilter())
+    id_ = sorted(crawler.data)[0] if subject is None else subject
+    return id_, crawler.data[id_]
+
+
+def benchmark_neighborhood(args):
+    """Compares the backends of the NeighborhoodFeatureExtractor."""
+    image = sitk.Cast(sitk.ReadImage(args.image), sitk.sitkFloat32)
+    kernel = (args.kernel,) * 3
+
+    # the loop backend is way too slow for a full volume, therefore, we compare the backends on a crop
+    cropped = _crop(image, args.crop)
+    print('Image: {} (size {}), crop size {}'.format(args.image, image.GetSize(), cropped.GetSize()))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # the entropy is not defined for non-positive values
+
+        results = {}
+        for backend in ('loop', 'vectorized'):
+            extractor = fltr_feat.NeighborhoodFeatureExtractor(kernel, backend=backend)
+            start_time = timeit.default_timer()
+            results[backend] = sitk.GetArrayFromImage(extractor.execute(cropped))
+            elapsed = timeit.default_timer() - start_time
+            print(' {:<12} {:10.3f} s ({:.0f} voxels/s)'.format(backend, elapsed, cropped.GetNumberOfPixels() / elapsed))
+
+        loop, vectorized = results['loop'], results['vectorized']
+        print(' NaNs equal: {}, max. relative difference: {:.2e}'.format(
+            np.array_equal(np.isnan(loop), np.isnan(vectorized)),
+            np.nanmax(np.abs(loop - vectorized) / (1 + np.abs(loop)))))
+
+        moments = [fltr_feat.FIRST_ORDER_TEXTURE_FEATURES.index(f) for f in fltr_feat.MOMENT_FEATURES]
+        integral = sitk.GetArrayFromImage(
+            fltr_feat.NeighborhoodFeatureExtractor(kernel, backend='integral').execute(cropped))
+        print(' integral vs. vectorized moments, max. relative difference: {:.2e}'.format(
+            np.max(np.abs(vectorized[..., moments] - integral) / (1 + np.abs(vectorized[..., moments])))))
+
+        histogram = sitk.GetArrayFromImage(
+            fltr_feat.NeighborhoodFeatureExtractor(kernel, backend='histogram', bins=args.bins).execute(cropped))
+        cropped_arr = sitk.GetArrayFromImage(cropped)
+        print(' histogram vs. vectorized, max. absolute difference per feature '
+              '(percentile error bound {:.3f}):'.format((cropped_arr.max() - cropped_arr.min()) / (2 * args.bins)))
+        for idx, feature in enumerate(fltr_feat.FIRST_ORDER_TEXTURE_FEATURES):
+            print('  {:<16} {:.3e}'.format(feature, np.nanmax(np.abs(vectorized[..., idx] - histogram[..., idx]))))
+
+        for backend in ('vectorized', 'integral', 'histogram'):
+            extractor = fltr_feat.NeighborhoodFeatureExtractor(kernel, backend=backend, bins=args.bins)
+            start_time = timeit.default_timer()
+            extractor.execute(image)
+            print(' {} on full volume: {:.3f} s'.format(backend, timeit.default_timer() - start_time))
+
+
+def _legacy_generate_feature_matrix(self: putil.FeatureExtractor):
+    """The feature matrix assembly with masked arrays, concatenation and casting, which copies every feature
+    several times (for comparison)."""
+
+    def image_as_numpy_array(image: sitk.Image, mask: np.ndarray = None):
+        number_of_components = image.GetNumberOfComponentsPerPixel()
+        no_voxels = np.prod(image.GetSize())
+        image = sitk.GetArrayFromImage(image)
+
+        if mask is not None:
+            no_voxels = np.size(mask) - np.count_nonzero(mask)
+
+            if number_of_components == 1:
+                masked_image = np.ma.masked_array(image, mask=mask)
+            else:
+                vector_mask = np.expand_dims(mask, axis=3)
+                vector_mask = np.repeat(vector_mask, number_of_components, axis=3)
+                masked_image = np.ma.masked_array(image, mask=vector_mask)
+
+            image = masked_image[~masked_image.mask]
+
+        return image.reshape((no_voxels, number_of_components))
+
+    ground_truth = self.img.images[structure.BrainImageTypes.GroundTruth]
+    mask = None
+    if self.training:
+        mask = np.ones(ground_truth.GetSize()[::-1], dtype=bool)
+        mask.reshape(-1)[self._get_training_indices()] = False
+
+    data = np.concatenate([image_as_numpy_array(image, mask) for image in self.img.feature_images.values()], axis=1)
+    labels = image_as_numpy_array(ground_truth, mask)
+
+    self.img.feature_matrix = (data.astype(np.float32), labels.astype(np.int16))
+
+
+def _feature_matrix_run(id_: str, paths: dict, params: dict, legacy: bool) -> dict:
+    """Pre-processes a subject and measures the feature matrix assembly (runs in a fresh process)."""
+    import resource  # not available on Windows
+
+    generate_feature_matrix = _legacy_generate_feature_matrix if legacy else \
+        putil.FeatureExtractor._generate_feature_matrix
+    result = {}
+
+    def traced_generate_feature_matrix(self):
+        tracemalloc.start()
+        start_time = timeit.default_timer()
+        generate_feature_matrix(self)
+        result['assembly_time'] = timeit.default_timer() - start_time
+        result['assembly_peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    putil.FeatureExtractor._generate_feature_matrix = traced_generate_feature_matrix
+
+    img = putil.pre_process(id_, dict(paths), **params)
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    data, labels = img.feature_matrix
+    result['shape'] = data.shape
+    result['digest'] = hashlib.sha1(data.tobytes() + labels.tobytes()).hexdigest()
+    return result
+
+
+def benchmark_feature_matrix(args):
+    """Compares the memory of the feature matrix assembly with the legacy masked array assembly for a subject."""
+    id_, paths = _load_subject(args.data_dir, args.subject)
+    params = {'skullstrip_pre': True,
+              'normalization_pre': True,
+              'registration_pre': False,
+              'coordinates_feature': True,
+              'intensity_feature': True,
+              'gradient_intensity_feature': True,
+              'training': args.training}
+    print('Subject: {} (training {})'.format(id_, args.training))
+
+    results = {}
+    for legacy in (True, False):
+        # use a fresh process per run such that the peak RSS is not biased by the previous run
+        with futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results[legacy] = result = executor.submit(_feature_matrix_run, id_, paths, params, legacy).result()
+        print(' {:<10} feature matrix {}: assembly {:6.3f} s, assembly peak memory {:6.0f} MB, '
+              'process peak RSS {:6.0f} MB'.format('legacy' if legacy else 'current', result['shape'],
+                                                  result['assembly_time'], result['assembly_peak'] / 2 ** 20,
+                                                  result['peak_rss'] / 2 ** 20))
+
+    if args.training:
+        print(' (the training voxels are sampled randomly, therefore, the feature matrices differ)')
+    else:
+        print(' feature matrices equal: {}'.format(results[True]['digest'] == results[False]['digest']))
+
+
+def benchmark_glcm(args):
+    """Measures the runtime of the GLCM feature extractor per volume."""
+    image = sitk.Cast(sitk.ReadImage(args.image), sitk.sitkFloat32)
+    print('Image: {} (size {})'.format(args.image, image.GetSize()))
+
+    for levels in args.levels:
+        for kernel in args.kernels:
+            extractor = fltr_feat.GLCMFeatureExtractor((kernel,) * 3, levels, n_workers=args.n_workers)
+            start_time = timeit.default_timer()
+            extractor.execute(image)
+            elapsed = timeit.default_timer() - start_time
+            print(' {:3d} levels, kernel {:2d}: {:8.3f} s ({:.0f} voxels/s)'.format(
+                levels, kernel, elapsed, image.GetNumberOfPixels() / elapsed))
+
+
+def benchmark_registration(args):
+    """Compares the registration of the T1w and T2w images of a subject by separate resamplings with a single
+    resampling of a multi-component image."""
+    id_, paths = _load_subject(args.data_dir, args.subject)
+    atlas = sitk.ReadImage(args.atlas)
+    transform = sitk.ReadTransform(paths[structure.BrainImageTypes.RegistrationTransform])
+    images = [sitk.ReadImage(paths[key]) for key in (structure.BrainImageTypes.T1w, structure.BrainImageTypes.T2w)]
+    print('Subject: {} (size {}), atlas size {}'.format(id_, images[0].GetSize(), atlas.GetSize()))
+
+    registration = fltr_prep.ImageRegistration()
+    params = fltr_prep.ImageRegistrationParameters(atlas, transform)
+    results = {}
+    for name, fn in (('separate', lambda: [registration.execute(image, params) for image in images]),
+                     ('multi-component', lambda: fltr_prep.register_multi_component(images, atlas, transform))):
+        times = timeit.repeat(lambda: results.__setitem__(name, fn()), number=1, repeat=args.repeat)
+        print(' {:15s}: {:8.3f} s (best of {})'.format(name, min(times), args.repeat))
+    print(' differing voxels: {}'.format(sum(
+        np.count_nonzero(sitk.GetArrayViewFromImage(expected) != sitk.GetArrayViewFromImage(actual))
+        for expected, actual in zip(results['separate'], results['multi-component']))))
+
+
+class _PickledPreProcessingPickleHelper(mproc.PreProcessingPickleHelper):
+    shared_memory = False
+
+
+class _SharedPreProcessingPickleHelper(mproc.PreProcessingPickleHelper):
+    shared_memory = True
+
+
+def _transport_image(id_: str, size: tuple, no_features: int) -> structure.BrainImage:
+    """Creates a pre-processed image with a dense feature matrix, like the ones returned by pre_process."""
+    shape = size[::-1]
+    images = {structure.BrainImageTypes.T1w: sitk.GetImageFromArray(np.ones(shape, np.float32)),
+              structure.BrainImageTypes.T2w: sitk.GetImageFromArray(np.ones(shape, np.float32)),
+              structure.BrainImageTypes.GroundTruth: sitk.GetImageFromArray(np.ones(shape, np.uint8)),
+              structure.BrainImageTypes.BrainMask: sitk.GetImageFromArray(np.ones(shape, np.uint8))}
+    img = structure.BrainImage(id_, '', images, sitk.AffineTransform(3))
+    no_voxels = int(np.prod(size))
+    img.feature_matrix = (np.ones((no_voxels, no_features), np.float32), np.ones((no_voxels, 1), np.int16))
+    return img
+
+
+def _transport_nothing(id_: str, size: tuple, no_features: int):
+    _transport_image(id_, size, no_features)
+
+
+def benchmark_transport(args):
+    """Compares the throughput of the transport of pre-processed images from the worker processes by pickling and by
+    shared memory."""
+    size = tuple(args.size)
+    params = [(str(i), size, args.features) for i in range(args.subjects)]
+    img = _transport_image('', size, args.features)
+    no_bytes = args.subjects * (sum(sitk.GetArrayViewFromImage(image).nbytes for image in img.images.values()) +
+                                sum(array.nbytes for array in img.feature_matrix))
+    print('{} subjects of size {} with {} features: {:.0f} MB'.format(args.subjects, size, args.features,
+                                                                      no_bytes / 2 ** 20))
+
+    # the creation of the images in the workers is measured separately and subtracted
+    baseline = min(timeit.repeat(lambda: mproc.MultiProcessor.run(_transport_nothing, params), number=1,
+                                 repeat=args.repeat))
+    print(' {:13s}: {:8.3f} s'.format('no transport', baseline))
+    for name, helper in (('pickle', _PickledPreProcessingPickleHelper),
+                         ('shared memory', _SharedPreProcessingPickleHelper)):
+        elapsed = min(timeit.repeat(lambda: mproc.MultiProcessor.run(_transport_image, params, None, helper),
+                                    number=1, repeat=args.repeat))
+        print(' {:13s}: {:8.3f} s, transport {:8.3f} s ({:.0f} MB/s)'.format(
+            name, elapsed, elapsed - baseline, no_bytes / 2 ** 20 / max(elapsed - baseline, 1e-9)))
+
+
+def benchmark_execution(args):
+    """Measures the pre-processing of a batch with the execution policies and reports the fastest one."""
+    crawler = futil.FileSystemDataCrawler(args.data_dir, LOADING_KEYS, futil.BrainImageFilePathGenerator(),
+                                          futil.DataDirectoryFilter())
+    data = {id_: crawler.data[id_] for id_ in sorted(crawler.data)[:args.subjects]}
+    putil.load_atlas_images(args.data_atlas_dir)
+    params = {'skullstrip_pre': True, 'normalization_pre': True, 'registration_pre': False,
+              'coordinates_feature': True, 'intensity_feature': True, 'gradient_intensity_feature': True,
+              'training': False, 'brain_mask_inference': True}
+
+    n_cpus = concurrency.get_number_of_cpus()
+    n_workers = sorted({w for w in (1, 2, 4, 8, 16, 32, 64) if w < n_cpus} | {n_cpus})
+    print('{} subjects, {} CPUs'.format(len(data), n_cpus))
+
+    results = []
+    for backend in ('process', 'thread'):
+        for workers in n_workers:
+            policy = concurrency.ExecutionPolicy(backend, workers, n_cpus)
+            params['n_threads'] = policy.stage_threads
+            with policy.worker_pool(putil.load_atlas_images, (args.data_atlas_dir,)) as pool:
+                start_time = timeit.default_timer()
+                putil.pre_process_batch(data, params, multi_process=True, pool=pool)
+                elapsed = timeit.default_timer() - start_time
+            results.append((elapsed, policy))
+            print(' {:7s} backend, {:2d} workers x {:2d} threads: {:8.3f} s'.format(
+                backend, workers, policy.threads_per_worker, elapsed))
+
+    elapsed, policy = min(results, key=lambda result: result[0])
+    print('Best: {} backend with {} workers x {} threads ({:.3f} s), i.e. main.py --backend {}'.format(
+        policy.backend, policy.n_workers, policy.threads_per_worker, elapsed, policy.backend))
+
+
+def benchmark_prediction(args):
+    """Compares the prediction by predict and predict_proba with the single-pass chunked prediction engine of the forest
+    and of compact forests."""
+    id_, paths = _load_subject(args.data_dir, args.subject)
+    params = {'skullstrip_pre': True, 'normalization_pre': True, 'registration_pre': False,
+              'coordinates_feature': True, 'intensity_feature': True, 'gradient_intensity_feature': True}
+    putil.load_atlas_images(args.data_atlas_dir)
+    img = putil.pre_process(id_, dict(paths), training=True, **params)
+    forest = sk_ensemble.RandomForestClassifier(n_estimators=args.trees, max_depth=30, n_jobs=1, random_state=0)
+    forest.fit(img.feature_matrix[0], img.feature_matrix[1].ravel())
+    img = putil.pre_process(id_, dict(paths), training=False, brain_mask_inference=True, **params)
+    features = img.feature_matrix[0]
+    print('Subject: {}, {} voxels, {} trees'.format(id_, features.shape[0], args.trees))
+
+    def run(name: str, fn):
+        tracemalloc.start()
+        start_time = timeit.default_timer()
+        labels, probabilities = fn()
+        elapsed = timeit.default_timer() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(' {:40s}: {:8.3f} s ({:9.0f} voxels/s), peak memory {:6.0f} MB'.format(
+            name, elapsed, features.shape[0] / elapsed, peak / 2 ** 20))
+        return labels, probabilities
+
+    # the size and the loading time of the models, the compact forests are memory-mapped
+    models = {'forest': forest}
+    with tempfile.TemporaryDirectory() as model_dir:
+        path = os.path.join(model_dir, 'forest.joblib')
+        joblib.dump(forest, path)
+        load_time = min(timeit.repeat(lambda: joblib.load(path), number=1, repeat=3))
+        print(' {:40s}: {:8.3f} MB, loaded in {:8.3f} s'.format('forest (joblib)', os.path.getsize(path) / 2 ** 20,
+                                                                load_time))
+        for quantization in (None, 8):
+            name = 'compact forest{}'.format(', {} bit'.format(quantization) if quantization else '')
+            path = os.path.join(model_dir, str(quantization))
+            compact_forest.CompactForest.from_forest(forest, quantization).save(path)
+            load_time = min(timeit.repeat(lambda: compact_forest.CompactForest.load(path), number=1, repeat=3))
+            models[name] = compact_forest.CompactForest.load(path, mmap_mode=None)
+            print(' {:40s}: {:8.3f} MB, loaded in {:8.3f} s'.format(
+                name, sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)) / 2 ** 20, load_time))
+
+    reference = run('predict + predict_proba', lambda: (forest.predict(features), forest.predict_proba(features)))
+    for name, model in models.items():
+        for n_jobs in sorted({1, args.n_jobs}):
+            engine = prediction.PredictionEngine(model, args.chunk_size, n_jobs)
+            labels, probabilities = run('engine, {}, {} threads'.format(name, n_jobs),
+                                        lambda: engine.predict(features))
+            print(' {:40s}  labels equal: {}, max. probability difference: {:.1e}'.format(
+                '', np.array_equal(labels, reference[0]), np.abs(probabilities - reference[1]).max()))
+
+
+def _training_run(train_dir: str, test_dir: str, trees: int, subjects_per_chunk: int = None) -> dict:
+    """Fits a forest on a feature store and evaluates it on another one (runs in a fresh process)."""
+    import resource  # not available on Windows
+
+    train_store = fstore.FeatureStore.open(train_dir)
+    test_store = fstore.FeatureStore.open(test_dir)
+    forest = sk_ensemble.RandomForestClassifier(max_features=train_store.no_features, n_estimators=trees,
+                                                max_depth=30, n_jobs=1, random_state=0)
+    start_time = timeit.default_timer()
+    if subjects_per_chunk is None:
+        forest.fit(train_store.data, train_store.labels)
+    else:
+        training.fit_incremental(forest, train_store, subjects_per_chunk)
+    result = {'time': timeit.default_timer() - start_time}
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    labels, _ = prediction.PredictionEngine(forest).predict(test_store.data)
+    truth = test_store.labels
+    result['accuracy'] = np.mean(labels == truth)
+    result['dice'] = {int(label): 2 * np.sum((labels == label) & (truth == label)) /
+                      max(np.sum(labels == label) + np.sum(truth == label), 1)
+                      for label in np.unique(truth) if label != 0}
+    return result
+
+
+def benchmark_training(args):
+    """Compares the incremental training over chunks of subjects with the training on all subjects at once."""
+    crawler = futil.FileSystemDataCrawler(args.data_dir, LOADING_KEYS, futil.BrainImageFilePathGenerator(),
+                                          futil.DataDirectoryFilter())
+    crawler_test = futil.FileSystemDataCrawler(args.data_test_dir, LOADING_KEYS, futil.BrainImageFilePathGenerator(),
+                                               futil.DataDirectoryFilter())
+    putil.load_atlas_images(args.data_atlas_dir)
+    params = {'skullstrip_pre': True, 'normalization_pre': True, 'registration_pre': False,
+              'coordinates_feature': True, 'intensity_feature': True, 'gradient_intensity_feature': True,
+              'sparse_training': True, 'brain_mask_inference': True}
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        train_dir = os.path.join(store_dir, 'train')
+        test_dir = os.path.join(store_dir, 'test')
+        for directory, data, training_ in ((train_dir, crawler.data, True), (test_dir, crawler_test.data, False)):
+            with fstore.FeatureStore(directory) as store:
+                for img in putil.pre_process_batch_iter(data, dict(params, training=training_)):
+                    store.append(img.id_, *img.feature_matrix)
+        train_store = fstore.FeatureStore.open(train_dir)
+        print('{} training subjects ({} rows), {} test subjects, {} trees'.format(
+            len(train_store.ids()), train_store.no_rows, len(crawler_test.data), args.trees))
+        del train_store
+
+        for subjects_per_chunk in [None] + args.subjects_per_chunk:
+            # use a fresh process per run such that the peak RSS is not biased by the previous run
+            with futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(_training_run, train_dir, test_dir, args.trees, subjects_per_chunk).result()
+            name = 'all subjects' if subjects_per_chunk is None else '{} subjects per chunk'.format(subjects_per_chunk)
+            print(' {:24s}: {:8.3f} s, peak RSS {:6.0f} MB, accuracy {:.4f}, Dice {}'.format(
+                name, result['time'], result['peak_rss'] / 2 ** 20, result['accuracy'],
+                ' '.join('{}: {:.3f}'.format(label, dice) for label, dice in result['dice'].items())))
+
+
+def benchmark_tiling(args):
+    """Compares the tiled execution of the NeighborhoodFeatureExtractor with a single tile."""
+    image = sitk.Cast(sitk.ReadImage(args.image), sitk.sitkFloat32)
+    kernel = (args.kernel,) * 3
+    print('Image: {} (size {}), backend {}'.format(args.image, image.GetSize(), args.backend))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # the entropy is not defined for non-positive values
+
+        results = {}
+        for tile_size, n_workers in ((None, 1), (args.tile_size, 1), (args.tile_size, args.n_workers)):
+            extractor = fltr_feat.NeighborhoodFeatureExtractor(kernel, backend=args.backend, tile_size=tile_size,
+                                                               n_workers=n_workers)
+            tracemalloc.start()
+            start_time = timeit.default_timer()
+            results[(tile_size, n_workers)] = sitk.GetArrayFromImage(extractor.execute(image))
+            elapsed = timeit.default_timer() - start_time
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(' tile size {!s:>5}, {} workers: {:8.3f} s, peak memory {:6.0f} MB'.format(
+                tile_size, n_workers, elapsed, peak / 2 ** 20))
+
+        single = results[(None, 1)]
+        print(' bit for bit equal to the single tile: {}'.format(
+            all(np.array_equal(single, result, equal_nan=True) for result in results.values())))
+
+
+if __name__ == "__main__":
+    """The program's entry point."""
+
+    script_dir = os.path.dirname(sys.argv[0])
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the performance-critical parts of the pipeline')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    parser_neighborhood = subparsers.add_parser('neighborhood', help='Neighborhood feature extraction backends.')
+    parser_neighborhood.add_argument(
+        '--image',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test/117122/T1native.nii.gz')),
+        help='The image to extract the features from.'
+    )
+    parser_neighborhood.add_argument('--kernel', type=int, default=3, help='The kernel size.')
+    parser_neighborhood.add_argument('--crop', type=int, default=40, help='Crop size for the comparison.')
+    parser_neighborhood.add_argument('--bins', type=int, default=64, help='Bins of the histogram backend.')
+    parser_neighborhood.set_defaults(func=benchmark_neighborhood)
+
+    parser_tiling = subparsers.add_parser('tiling', help='Tiled neighborhood feature extraction.')
+    parser_tiling.add_argument(
+        '--image',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test/117122/T1native.nii.gz')),
+        help='The image to extract the features from.'
+    )
+    parser_tiling.add_argument('--kernel', type=int, default=3, help='The kernel size.')
+    parser_tiling.add_argument('--backend', type=str, default='vectorized', help='The backend.')
+    parser_tiling.add_argument('--tile_size', type=int, default=16, help='The number of z-slices per tile.')
+    parser_tiling.add_argument('--n_workers', type=int, default=os.cpu_count(), help='The number of threads.')
+    parser_tiling.set_defaults(func=benchmark_tiling)
+
+    parser_glcm = subparsers.add_parser('glcm', help='GLCM feature extraction runtime.')
+    parser_glcm.add_argument(
+        '--image',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test/117122/T1native.nii.gz')),
+        help='The image to extract the features from.'
+    )
+    parser_glcm.add_argument('--levels', type=int, nargs='+', default=[8, 16], help='The numbers of gray levels.')
+    parser_glcm.add_argument('--kernels', type=int, nargs='+', default=[3, 5, 9], help='The kernel sizes.')
+    parser_glcm.add_argument('--n_workers', type=int, default=1, help='The number of threads.')
+    parser_glcm.set_defaults(func=benchmark_glcm)
+
+    parser_registration = subparsers.add_parser('registration', help='Registration by a multi-component image.')
+    parser_registration.add_argument(
+        '--data_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test')),
+        help='The directory with the subjects.'
+    )
+    parser_registration.add_argument('--subject', type=str, default=None, help='The subject (default: first).')
+    parser_registration.add_argument(
+        '--atlas',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/atlas/mni_icbm152_t1_tal_nlin_sym_09a_mask.nii.gz')),
+        help='The atlas image defining the output grid.'
+    )
+    parser_registration.add_argument('--repeat', type=int, default=3, help='The number of repetitions.')
+    parser_registration.set_defaults(func=benchmark_registration)
+
+    parser_transport = subparsers.add_parser('transport', help='Transport of images between processes.')
+    parser_transport.add_argument('--size', type=int, nargs=3, default=[181, 217, 181], help='The image size.')
+    parser_transport.add_argument('--features', type=int, default=7, help='The number of features.')
+    parser_transport.add_argument('--subjects', type=int, default=4, help='The number of subjects.')
+    parser_transport.add_argument('--repeat', type=int, default=3, help='The number of repetitions.')
+    parser_transport.set_defaults(func=benchmark_transport)
+
+    parser_execution = subparsers.add_parser('execution', help='Backends and numbers of workers and threads.')
+    parser_execution.add_argument(
+        '--data_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test')),
+        help='The directory with the subjects.'
+    )
+    parser_execution.add_argument(
+        '--data_atlas_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/atlas')),
+        help='Directory with atlas data.'
+    )
+    parser_execution.add_argument('--subjects', type=int, default=8, help='The number of subjects.')
+    parser_execution.set_defaults(func=benchmark_execution)
+
+    parser_feature_matrix = subparsers.add_parser('feature_matrix', help='Memory of the feature matrix assembly.')
+    parser_feature_matrix.add_argument(
+        '--data_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test')),
+        help='The directory with the subjects.'
+    )
+    parser_feature_matrix.add_argument('--subject', type=str, default=None, help='The subject (default: first).')
+    parser_feature_matrix.add_argument('--training', action='store_true', help='Assemble the training voxels only.')
+    parser_feature_matrix.set_defaults(func=benchmark_feature_matrix)
+
+    parser_prediction = subparsers.add_parser('prediction', help='Single-pass chunked prediction.')
+    parser_prediction.add_argument(
+        '--data_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test')),
+        help='The directory with the subjects.'
+    )
+    parser_prediction.add_argument(
+        '--data_atlas_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/atlas')),
+        help='Directory with atlas data.'
+    )
+    parser_prediction.add_argument('--subject', type=str, default=None, help='The subject (default: first).')
+    parser_prediction.add_argument('--trees', type=int, default=100, help='The number of trees.')
+    parser_prediction.add_argument('--chunk_size', type=int, default=65536, help='The number of rows per chunk.')
+    parser_prediction.add_argument('--n_jobs', type=int, default=os.cpu_count(), help='The number of threads.')
+    parser_prediction.set_defaults(func=benchmark_prediction)
+
+    parser_training = subparsers.add_parser('training', help='Incremental training over chunks of subjects.')
+    parser_training.add_argument(
+        '--data_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/train')),
+        help='The directory with the training subjects.'
+    )
+    parser_training.add_argument(
+        '--data_test_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test')),
+        help='The directory with the test subjects.'
+    )
+    parser_training.add_argument(
+        '--data_atlas_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/atlas')),
+        help='Directory with atlas data.'
+    )
+    parser_training.add_argument('--trees', type=int, default=100, help='The number of trees.')
+    parser_training.add_argument('--subjects_per_chunk', type=int, nargs='+', default=[1, 5],
+                                 help='The numbers of subjects per chunk to compare.')
+    parser_training.set_defaults(func=benchmark_training)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -6,25 +6,35 @@ import argparse
 import datetime
 import os
 import sys
+import tempfile
 import timeit
 import warnings
 
 import SimpleITK as sitk
 import sklearn.ensemble as sk_ensemble
 import numpy as np
-import pymia.data.conversion as conversion
 import pymia.evaluation.writer as writer
 
 try:
     import mialab.data.structure as structure
+    import mialab.utilities.compact_forest as compact_forest
+    import mialab.utilities.concurrency as concurrency
+    import mialab.utilities.feature_store as fstore
     import mialab.utilities.file_access_utilities as futil
+    import mialab.utilities.model_registry as model_registry
     import mialab.utilities.pipeline_utilities as putil
+    import mialab.utilities.training as training
 except ImportError:
     # Append the MIALab root directory to Python path
     sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
     import mialab.data.structure as structure
+    import mialab.utilities.compact_forest as compact_forest
+    import mialab.utilities.concurrency as concurrency
+    import mialab.utilities.feature_store as fstore
     import mialab.utilities.file_access_utilities as futil
+    import mialab.utilities.model_registry as model_registry
     import mialab.utilities.pipeline_utilities as putil
+    import mialab.utilities.training as training
 
 LOADING_KEYS = [structure.BrainImageTypes.T1w,
                 structure.BrainImageTypes.T2w,
@@ -33,7 +43,10 @@ LOADING_KEYS = [structure.BrainImageTypes.T1w,
                 structure.BrainImageTypes.RegistrationTransform]  # the list of data we will load
 
 
-def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_dir: str):
+def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_dir: str, cache_dir: str = None,
+         memory_budget: int = None, backend: str = 'process', compact_model: bool = False, quantization: int = None,
+         model_dir: str = './mia-models', model: str = None, train_only: bool = False,
+         subjects_per_chunk: int = None):
     """Brain tissue segmentation using decision forests.
 
     The main routine executes the medical image analysis pipeline:
@@ -46,39 +59,92 @@ def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_di
         - Segmentation using the decision forest classifier model on unseen images
         - Post-processing of the segmentation
         - Evaluation of the segmentation
+
+    The trained model is stored in a registry, such that the model building is skipped if the training data and
+    parameters did not change, or if a model is given.
     """
 
     # load atlas images
     putil.load_atlas_images(data_atlas_dir)
 
-    print('-' * 5, 'Training...')
-
-    # crawl the training image directories
-    crawler = futil.FileSystemDataCrawler(data_train_dir,
-                                          LOADING_KEYS,
-                                          futil.BrainImageFilePathGenerator(),
-                                          futil.DataDirectoryFilter())
+    # crawl the training and testing image directories
+    crawler_test = futil.FileSystemDataCrawler(data_test_dir,
+                                               LOADING_KEYS,
+                                               futil.BrainImageFilePathGenerator(),
+                                               futil.DataDirectoryFilter())
     pre_process_params = {'skullstrip_pre': True,
                           'normalization_pre': True,
                           'registration_pre': False,
                           'coordinates_feature': True,
                           'intensity_feature': True,
-                          'gradient_intensity_feature': True}
-
-    # load images for training and pre-process
-    images = putil.pre_process_batch(crawler.data, pre_process_params, multi_process=False)
-
-    # generate feature matrix and label vector
-    data_train = np.concatenate([img.feature_matrix[0] for img in images])
-    labels_train = np.concatenate([img.feature_matrix[1] for img in images]).squeeze()
-
-    forest = sk_ensemble.RandomForestClassifier(max_features=images[0].feature_matrix[0].shape[1],
-                                                n_estimators=100,
-                                                max_depth=30)
-
-    start_time = timeit.default_timer()
-    forest.fit(data_train, labels_train)
-    print(' Time elapsed:', timeit.default_timer() - start_time, 's')
+                          'gradient_intensity_feature': True,
+                          'sparse_training': True,
+                          'brain_mask_inference': True,
+                          'cache_dir': cache_dir}
+
+    # look up the model in the registry, which is keyed by the training data, the parameters, and the hyperparameters
+    registry = model_registry.ModelRegistry(model_dir)
+    if model is not None:
+        model_key = registry.find(model)
+        data_train = {}
+    else:
+        crawler_train = futil.FileSystemDataCrawler(data_train_dir,
+                                                    LOADING_KEYS,
+                                                    futil.BrainImageFilePathGenerator(),
+                                                    futil.DataDirectoryFilter())
+        data_train = crawler_train.data
+        forest_params = {'max_features': putil.FeatureExtractor(None, **pre_process_params).get_number_of_features(),
+                         'n_estimators': 100,
+                         'max_depth': 30}
+        hyperparameters = dict(forest_params, subjects_per_chunk=subjects_per_chunk)
+        # the atlas is an input of the registration
+        model_key = registry.key(data_train, pre_process_params, hyperparameters,
+                                 putil.atlas_identity(pre_process_params))
+    forest = registry.load(model_key, pre_process_params)
+    if forest is not None:
+        print('Loaded model', model_key)
+        data_train = {}  # no training
+
+    if forest is None:
+        print('-' * 5, 'Training...')
+
+        # plan the number of worker processes within the memory budget from the image headers
+        plan_train = concurrency.plan(data_train, pre_process_params, memory_budget)
+        # divide the CPUs among the workers, the CPUs of a worker are divided among the stages of a subject running in
+        # parallel and the threads of their filters
+        policy = concurrency.ExecutionPolicy(backend, plan_train.n_workers)
+        pre_process_params['n_threads'] = policy.stage_threads
+        print(plan_train)
+        print(policy)
+
+        # the workers are shared by the pre-processing of the training images and load the atlas images once
+        with policy.worker_pool(putil.load_atlas_images, (data_atlas_dir,)) as pool:
+            with tempfile.TemporaryDirectory() as feature_store_dir:
+                # load images for training and pre-process, the largest first, and collect the feature matrices and
+                # label vectors in a memory-mapped store as soon as they are pre-processed instead of concatenating them
+                with fstore.FeatureStore(feature_store_dir) as feature_store:
+                    for img in putil.pre_process_batch_iter(plan_train.ordered(data_train), pre_process_params,
+                                                            multi_process=True, pool=pool):
+                        feature_store.append(img.id_, *img.feature_matrix)
+                        # free up memory, the iterator still references the image until the next one is received
+                        img.feature_matrix = None
+
+                forest = sk_ensemble.RandomForestClassifier(**forest_params, n_jobs=policy.n_cpus)
+
+                start_time = timeit.default_timer()
+                if subjects_per_chunk is None:
+                    forest.fit(feature_store.data, feature_store.labels)
+                else:
+                    # grow the forest over chunks of subjects, such that the memory is bounded by a chunk
+                    training.fit_incremental(forest, feature_store, subjects_per_chunk)
+                print(' Time elapsed:', timeit.default_timer() - start_time, 's')
+                del feature_store  # release the memory-mapped files before the directory is removed
+
+        registry.store(model_key, forest, data_train, pre_process_params, hyperparameters)
+        print('Stored model', model_key)
+
+    if train_only:
+        return
 
     # create a result directory with timestamp
     t = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
@@ -90,49 +156,54 @@ def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_di
     # initialize evaluator
     evaluator = putil.init_evaluator(result_dir)
 
-    # crawl the training image directories
-    crawler = futil.FileSystemDataCrawler(data_test_dir,
-                                          LOADING_KEYS,
-                                          futil.BrainImageFilePathGenerator(),
-                                          futil.DataDirectoryFilter())
-
-    # load images for testing and pre-process
     pre_process_params['training'] = False
-    images_test = putil.pre_process_batch(crawler.data, pre_process_params, multi_process=False)
-
+    forest.set_params(n_jobs=1)  # the workers predict in parallel, each in chunks on its threads
+    test_model = forest
+    if compact_model:
+        test_model = compact_forest.CompactForest.from_forest(forest, quantization)
+        print(test_model)
+    putil.set_model(test_model)
+
+    # plan the testing workers, which additionally hold the model and the prediction buffers
+    model_size = test_model.nbytes if compact_model else os.path.getsize(registry.path(model_key))
+    plan_test = concurrency.plan(crawler_test.data, pre_process_params, memory_budget, model_size=model_size,
+                                 no_classes=len(forest.classes_))
+    policy = concurrency.ExecutionPolicy(backend, plan_test.n_workers)
+    pre_process_params['n_threads'] = policy.stage_threads
+    print(plan_test)
+    print(policy)
+
+    images_test = []
     images_prediction = []
     images_probabilities = []
 
-    for img in images_test:
-        print('-' * 10, 'Testing', img.id_)
-
-        start_time = timeit.default_timer()
-        predictions = forest.predict(img.feature_matrix[0])
-        probabilities = forest.predict_proba(img.feature_matrix[0])
-        print(' Time elapsed:', timeit.default_timer() - start_time, 's')
-
-        # convert prediction and probabilities back to SimpleITK images
-        image_prediction = conversion.NumpySimpleITKImageBridge.convert(predictions.astype(np.uint8),
-                                                                        img.image_properties)
-        image_probabilities = conversion.NumpySimpleITKImageBridge.convert(probabilities, img.image_properties)
-
-        # evaluate segmentation without post-processing
-        evaluator.evaluate(image_prediction, img.images[structure.BrainImageTypes.GroundTruth], img.id_)
-
-        images_prediction.append(image_prediction)
-        images_probabilities.append(image_probabilities)
-
-    # post-process segmentation and evaluate with post-processing
-    post_process_params = {'simple_post': False}
-    images_post_processed = putil.post_process_batch(images_test, images_prediction, images_probabilities,
-                                                     post_process_params, multi_process=True)
+    # the workers are started after setting the model, such that they inherit it copy-on-write instead of each loading
+    # a copy, and are shared by the pre-processing, prediction, and post-processing of the testing images
+    with policy.worker_pool(putil.load_atlas_images, (data_atlas_dir,)) as pool:
+        # load images for testing, pre-process, and predict them in parallel, and evaluate each image as soon as it is
+        # predicted
+        predict_params = {'n_jobs': policy.threads_per_worker}
+        for img, image_prediction, image_probabilities in putil.pre_process_and_predict_batch_iter(
+                plan_test.ordered(crawler_test.data), pre_process_params, predict_params,
+                multi_process=True, pool=pool):
+            # evaluate segmentation without post-processing
+            evaluator.evaluate(image_prediction, img.images[structure.BrainImageTypes.GroundTruth], img.id_)
+            sitk.WriteImage(image_prediction, os.path.join(result_dir, img.id_ + '_SEG.mha'), True)
+
+            images_test.append(img)
+            images_prediction.append(image_prediction)
+            images_probabilities.append(image_probabilities)
+
+        # post-process segmentation and evaluate with post-processing
+        post_process_params = {'simple_post': False}
+        images_post_processed = putil.post_process_batch(images_test, images_prediction, images_probabilities,
+                                                         post_process_params, multi_process=True, pool=pool)
 
     for i, img in enumerate(images_test):
         evaluator.evaluate(images_post_processed[i], img.images[structure.BrainImageTypes.GroundTruth],
                            img.id_ + '-PP')
 
         # save results
-        sitk.WriteImage(images_prediction[i], os.path.join(result_dir, images_test[i].id_ + '_SEG.mha'), True)
         sitk.WriteImage(images_post_processed[i], os.path.join(result_dir, images_test[i].id_ + '_SEG-PP.mha'), False)
 
     # use two writers to report the results
@@ -189,5 +260,73 @@ if __name__ == "__main__":
         help='Directory with testing data.'
     )
 
+    parser.add_argument(
+        '--cache_dir',
+        type=str,
+        default=None,
+        help='Directory to cache the pre-processed images in (see manage_cache.py). No caching if not given.'
+    )
+
+    parser.add_argument(
+        '--memory_budget',
+        type=float,
+        default=None,
+        help='Memory budget in GB for choosing the number of worker processes. Defaults to the memory of the SLURM job '
+             'or 80 %% of the physical memory.'
+    )
+
+    parser.add_argument(
+        '--backend',
+        type=str,
+        default='process',
+        choices=['process', 'thread'],
+        help='Backend of the parallel pre- and post-processing (see benchmark.py execution for the best one).'
+    )
+
+    parser.add_argument(
+        '--compact_model',
+        action='store_true',
+        help='Predict by a compact forest of contiguous arrays, which takes less memory but predicts slower, since it '
+             'is traversed by NumPy instead of compiled code (see benchmark.py prediction).'
+    )
+
+    parser.add_argument(
+        '--quantization',
+        type=int,
+        default=None,
+        choices=[8, 16],
+        help='Number of bits of the leaf probabilities of the compact forest. Float32 if not given.'
+    )
+
+    parser.add_argument(
+        '--model_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, './mia-models')),
+        help='Directory of the model registry.'
+    )
+
+    parser.add_argument(
+        '--model',
+        type=str,
+        default=None,
+        help='Key (or a unique prefix) of a model in the registry to test without training.'
+    )
+
+    parser.add_argument(
+        '--train_only',
+        action='store_true',
+        help='Train the model and store it in the registry without testing.'
+    )
+
+    parser.add_argument(
+        '--subjects_per_chunk',
+        type=int,
+        default=None,
+        help='Train the forest incrementally over chunks of this many subjects, such that the memory is bounded by a '
+             'chunk (see benchmark.py training for the accuracy). Trains on all subjects at once if not given.'
+    )
+
     args = parser.parse_args()
-    main(args.result_dir, args.data_atlas_dir, args.data_train_dir, args.data_test_dir)
+    main(args.result_dir, args.data_atlas_dir, args.data_train_dir, args.data_test_dir, args.cache_dir,
+         int(args.memory_budget * 2 ** 30) if args.memory_budget is not None else None, args.backend,
+         args.compact_model, args.quantization, args.model_dir, args.model, args.train_only, args.subjects_per_chunk)
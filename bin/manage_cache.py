@@ -0,0 +1,81 @@
+"""Inspects and purges the cache of pre-processed images (see ``--cache_dir`` of main.py).
+
+Examples::
+
+    python manage_cache.py list --cache_dir ./mia-cache
+    python manage_cache.py purge --cache_dir ./mia-cache --max_size 2000
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+try:
+    import mialab.utilities.cache as cache
+except ImportError:
+    # Append the MIALab root directory to Python path
+    sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
+    import mialab.utilities.cache as cache
+
+
+def list_entries(preprocessing_cache: cache.PreProcessingCache, args):
+    """Lists the entries from the least to the most recently used."""
+    entries = preprocessing_cache.entries()
+    for entry in entries:
+        print('{}  {:<10} {:10.1f} MB  last used {}'.format(
+            entry['key'][:16], entry['id'], entry['size'] / 2 ** 20,
+            datetime.datetime.fromtimestamp(entry['last_used']).strftime('%Y-%m-%d %H:%M:%S')))
+    print('{} entries, {:.1f} MB'.format(len(entries), sum(entry['size'] for entry in entries) / 2 ** 20))
+
+
+def purge(preprocessing_cache: cache.PreProcessingCache, args):
+    """Removes all entries, the least recently used entries exceeding a size, or the entries unused for some days."""
+    if args.all:
+        preprocessing_cache.clear()
+        print('Removed all entries')
+        return
+
+    removed = []
+    if args.older_than is not None:
+        threshold = time.time() - args.older_than * 24 * 60 * 60
+        for entry in preprocessing_cache.entries():
+            if entry['last_used'] < threshold:
+                preprocessing_cache.remove(entry['key'])
+                removed.append(entry)
+    if args.max_size is not None:
+        removed.extend(preprocessing_cache.evict(int(args.max_size * 2 ** 20)))
+
+    print('Removed {} entries ({:.1f} MB)'.format(len(removed), sum(entry['size'] for entry in removed) / 2 ** 20))
+
+
+if __name__ == "__main__":
+    """The program's entry point."""
+
+    script_dir = os.path.dirname(sys.argv[0])
+
+    parser = argparse.ArgumentParser(description='Inspects and purges the cache of pre-processed images')
+    parser.add_argument(
+        '--cache_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, './mia-cache')),
+        help='The cache directory.'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    parser_list = subparsers.add_parser('list', help='List the entries from the least to the most recently used.')
+    parser_list.set_defaults(func=list_entries)
+
+    parser_purge = subparsers.add_parser('purge', help='Remove entries.')
+    parser_purge.add_argument('--all', action='store_true', help='Remove all entries.')
+    parser_purge.add_argument('--max_size', type=float, default=None,
+                              help='Remove the least recently used entries until the cache size is at most this (MB).')
+    parser_purge.add_argument('--older_than', type=float, default=None,
+                              help='Remove the entries not used for this number of days.')
+    parser_purge.set_defaults(func=purge)
+
+    args = parser.parse_args()
+    if not os.path.isdir(args.cache_dir):
+        parser.error('cache directory {} does not exist'.format(args.cache_dir))
+    args.func(cache.PreProcessingCache(args.cache_dir), args)
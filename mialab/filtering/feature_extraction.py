@@ -1,7 +1,10 @@
 """The feature extraction module contains classes for feature extraction."""
+import concurrent.futures as futures
+import functools
 import sys
 
 import numpy as np
+import pymia.data.conversion as conversion
 import pymia.filtering.filter as fltr
 import SimpleITK as sitk
 
@@ -22,7 +25,7 @@ class AtlasCoordinates(fltr.Filter):
 
         Returns:
             sitk.Image: The atlas coordinates image
-            (a vector image with 3 components, which represent the physical x, y, z coordinates in mm).
+            (a float32 vector image with 3 components, which represent the physical x, y, z coordinates in mm).
 
         Raises:
             ValueError: If image is not 3-D.
@@ -31,30 +34,35 @@ class AtlasCoordinates(fltr.Filter):
         if image.GetDimension() != 3:
             raise ValueError('image needs to be 3-D')
 
-        x, y, z = image.GetSize()
+        # the coordinates only depend on the image geometry, which is mostly shared among the images
+        # (e.g. all registered images are on the atlas grid). The copy shares the cached buffer until it is modified
+        return sitk.Image(_atlas_coordinates_image(conversion.ImageProperties(image)))
 
-        # create matrix with homogenous indices in axis 3
-        coords = np.zeros((x, y, z, 4))
-        coords[..., 0] = np.arange(x)[:, np.newaxis, np.newaxis]
-        coords[..., 1] = np.arange(y)[np.newaxis, :, np.newaxis]
-        coords[..., 2] = np.arange(z)[np.newaxis, np.newaxis, :]
-        coords[..., 3] = 1
+    @staticmethod
+    def execute_at(image: sitk.Image, indices: np.ndarray) -> np.ndarray:
+        """Calculates the atlas coordinates of some voxels only.
 
-        # reshape such that each voxel is one row
-        lin_coords = np.reshape(coords, [coords.shape[0] * coords.shape[1] * coords.shape[2], 4])
+        Args:
+            image (sitk.Image): The image.
+            indices (np.ndarray): The flat indices of the voxels into the image array (see sitk.GetArrayFromImage).
 
-        # generate transformation matrix
-        tmp_mat = image.GetDirection() + image.GetOrigin()
-        tfm = np.reshape(tmp_mat, [3, 4], order='F')
-        tfm = np.vstack((tfm, [0, 0, 0, 1]))
+        Returns:
+            np.ndarray: The atlas coordinates of shape (number of voxels, 3), equal to the ones of :meth:`execute`.
+
+        Raises:
+            ValueError: If image is not 3-D.
+        """
 
-        atlas_coords = (tfm @ np.transpose(lin_coords))[0:3, :]
-        atlas_coords = np.reshape(np.transpose(atlas_coords), [z, y, x, 3], 'F')
+        if image.GetDimension() != 3:
+            raise ValueError('image needs to be 3-D')
 
-        img_out = sitk.GetImageFromArray(atlas_coords)
-        img_out.CopyInformation(image)
+        z, y, x = np.unravel_index(indices, image.GetSize()[::-1])
+        direction = np.reshape(image.GetDirection(), (3, 3))
 
-        return img_out
+        # the same transformation (and order of summation) as in execute,
+        # i.e. the index (x, y, z) multiplied by the direction from the right
+        return (np.asarray(image.GetOrigin()) + z[:, np.newaxis] * direction[2] + y[:, np.newaxis] * direction[1]) + \
+            x[:, np.newaxis] * direction[0]
 
     def __str__(self):
         """Gets a printable string representation.
@@ -66,6 +74,89 @@ class AtlasCoordinates(fltr.Filter):
             .format(self=self)
 
 
+@functools.lru_cache(maxsize=2)
+def _atlas_coordinates_image(image_properties: conversion.ImageProperties) -> sitk.Image:
+    """Calculates the atlas coordinates image of an image geometry (see :meth:`AtlasCoordinates.execute`).
+
+    The results are cached by the geometry, the returned image must therefore not be modified.
+
+    Args:
+        image_properties (conversion.ImageProperties): The image properties.
+
+    Returns:
+        sitk.Image: The atlas coordinates image.
+    """
+    x, y, z = image_properties.size
+    origin = np.asarray(image_properties.origin)
+    direction = np.reshape(image_properties.direction, (3, 3))
+
+    # the physical coordinates are the origin plus the index (x, y, z) multiplied by the direction from the right.
+    # Sum the (small) z and y contributions first, such that the full image is written once with a single rounding
+    zy = (origin + np.arange(z)[:, np.newaxis] * direction[2])[:, np.newaxis, :] + \
+        (np.arange(y)[:, np.newaxis] * direction[1])[np.newaxis, :, :]
+    atlas_coords = np.empty((z, y, x, 3), dtype=np.float32)
+    np.add(zy[:, :, np.newaxis, :], np.arange(x)[:, np.newaxis] * direction[0], out=atlas_coords)
+
+    img_out = sitk.GetImageFromArray(atlas_coords)
+    img_out.SetOrigin(image_properties.origin)
+    img_out.SetSpacing(image_properties.spacing)
+    img_out.SetDirection(image_properties.direction)
+
+    return img_out
+
+
+def gradient_magnitude_at(image: sitk.Image, indices: np.ndarray) -> np.ndarray:
+    """Calculates the gradient magnitude of some voxels only.
+
+    Uses central differences like ``sitk.GradientMagnitude``, i.e. the image spacing is considered and the image is
+    extended by replicating its border voxels.
+
+    Args:
+        image (sitk.Image): The image.
+        indices (np.ndarray): The flat indices of the voxels into the image array (see sitk.GetArrayFromImage).
+
+    Returns:
+        np.ndarray: The gradient magnitude of each voxel.
+
+    Raises:
+        ValueError: If image is not 3-D.
+    """
+
+    if image.GetDimension() != 3:
+        raise ValueError('image needs to be 3-D')
+
+    img_arr = sitk.GetArrayViewFromImage(image)
+    voxel = np.unravel_index(indices, img_arr.shape)
+    spacing = image.GetSpacing()[::-1]
+
+    squared_sum = np.zeros(len(indices), dtype=np.float64)
+    for axis in range(3):
+        upper = list(voxel)
+        upper[axis] = np.minimum(voxel[axis] + 1, img_arr.shape[axis] - 1)
+        lower = list(voxel)
+        lower[axis] = np.maximum(voxel[axis] - 1, 0)
+        derivative = (img_arr[tuple(upper)].astype(np.float64) - img_arr[tuple(lower)]) / (2 * spacing[axis])
+        squared_sum += derivative * derivative
+
+    return np.sqrt(squared_sum)
+
+
+FIRST_ORDER_TEXTURE_FEATURES = ('mean', 'variance', 'sigma', 'skewness', 'kurtosis', 'entropy', 'energy', 'snr',
+                                 'min', 'max', 'range', 'percentile10th', 'percentile25th', 'percentile50th',
+                                 'percentile75th', 'percentile90th')
+"""The names of the features calculated by :func:`first_order_texture_features_function` (in this order)."""
+
+MOMENT_FEATURES = ('mean', 'variance', 'sigma', 'skewness', 'kurtosis', 'energy', 'snr')
+"""The first-order texture features derivable from local sums of powers of the intensities."""
+
+MIN_MAX_FEATURES = ('min', 'max', 'range')
+"""The first-order texture features derivable from a running minimum and maximum."""
+
+HISTOGRAM_FEATURES = ('entropy', 'percentile10th', 'percentile25th', 'percentile50th', 'percentile75th',
+                      'percentile90th')
+"""The first-order texture features approximated from local histograms."""
+
+
 def first_order_texture_features_function(values):
     """Calculates first-order texture features.
 
@@ -121,16 +212,452 @@ def first_order_texture_features_function(values):
                      ])
 
 
+def first_order_texture_features_vectorized(windows: np.ndarray, num_values: int = None) -> np.ndarray:
+    """Calculates first-order texture features for many windows at once.
+
+    This is the vectorized counterpart of :func:`first_order_texture_features_function`, which computes the same
+    features for each row of ``windows``.
+
+    Args:
+        windows (np.ndarray): The values of the windows, where each row holds the values of one window.
+        num_values (int): The number of values used for the skewness and kurtosis normalization.
+            :func:`first_order_texture_features_function` uses ``len(values)``, which is the first dimension of the
+            window it is called with. Defaults to the number of columns of ``windows``.
+
+    Returns:
+        np.array: An array of shape (number of windows, 16) containing the first-order texture features in the order
+        of :func:`first_order_texture_features_function`.
+    """
+    eps = sys.float_info.epsilon  # to avoid division by zero
+
+    windows = np.asarray(windows, dtype=np.float64)
+    if num_values is None:
+        num_values = windows.shape[1]
+
+    features = np.empty((windows.shape[0], 16), dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.mean(windows, axis=1)
+        centered = windows - mean[:, np.newaxis]
+        centered_2 = centered * centered  # multiplications are much faster than np.power
+        variance = np.mean(centered_2, axis=1)
+        std = np.sqrt(variance)
+        features[:, 0] = mean
+        features[:, 1] = variance
+        features[:, 2] = std
+        features[:, 3] = np.sqrt(num_values * (num_values - 1)) / np.float64(num_values - 2) * \
+            np.sum(centered_2 * centered, axis=1) / (num_values * std ** 3 + eps)  # adjusted Fisher-Pearson coeff.
+        features[:, 4] = np.sum(centered_2 * centered_2, axis=1) / (num_values * std ** 4 + eps)  # kurtosis
+        del centered, centered_2
+
+        p = windows / (np.sum(windows, axis=1) + eps)[:, np.newaxis]
+        features[:, 5] = np.sum(-p * np.log2(p), axis=1)  # entropy
+        features[:, 6] = np.sum(p * p, axis=1)  # energy (intensity histogram uniformity)
+        del p
+
+        features[:, 7] = np.where(std != 0, mean / std, 0)  # snr
+
+    # min, max and the percentiles are all read from the sorted windows
+    sorted_windows = np.sort(windows, axis=1)
+    features[:, 8] = sorted_windows[:, 0]
+    features[:, 9] = sorted_windows[:, -1]
+    features[:, 10] = features[:, 9] - features[:, 8]
+    for idx, q in enumerate((10, 25, 50, 75, 90)):
+        features[:, 11 + idx] = _percentile_of_sorted(sorted_windows, q)
+
+    return features
+
+
+def _percentile_of_sorted(sorted_values: np.ndarray, q: float) -> np.ndarray:
+    """Gets the q-th percentile of each row of row-wise sorted values using linear interpolation like np.percentile.
+
+    Args:
+        sorted_values (np.ndarray): The values, sorted along axis 1.
+        q (float): The percentile in [0, 100].
+
+    Returns:
+        np.ndarray: The percentile of each row.
+    """
+    position = q / 100 * (sorted_values.shape[1] - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, sorted_values.shape[1] - 1)
+    t = position - lower
+
+    a = sorted_values[:, lower]
+    b = sorted_values[:, upper]
+    diff = b - a
+    # same interpolation as np.percentile, which is exact at both ends
+    return b - diff * (1 - t) if t >= 0.5 else a + diff * t
+
+
+_DIRECT_BOX_SUM_MAX_SIZE = 8  # the window size up to which _box_sum adds shifted arrays instead of cumulative sums
+
+
+def _box_sum(arr: np.ndarray, size: int, axis: int, dtype=np.float64, direct: bool = None,
+             origin: int = None) -> np.ndarray:
+    """Sums the values in windows of ``size`` along an axis using a cumulative sum (one dimension of an integral image).
+
+    Integer sums are exact as long as the window sums fit into ``dtype``, since the cumulative sums may wrap around.
+
+    If ``origin`` is given, the cumulative sums restart at the indices ``i``, for which ``origin + i`` is a multiple of
+    ``size``, and a window is the sum of the suffix of a block and the prefix of the next block. The rounding of a
+    window sum then only depends on the position ``origin + i``, i.e. not on where the array starts.
+
+    Args:
+        arr (np.ndarray): The array.
+        size (int): The window size.
+        axis (int): The axis.
+        dtype (np.dtype): The data type of the sums.
+        direct (bool): Whether to add the shifted arrays instead of using the cumulative sum.
+            Defaults to True for windows up to a size of 8.
+        origin (int): The position of the first element along ``axis``, e.g. in the whole image. None for a single
+            cumulative sum.
+
+    Returns:
+        np.ndarray: The window sums, where the window at index i covers the indices i to i + size - 1
+        (the output is ``size - 1`` elements shorter along ``axis``).
+    """
+    arr = np.moveaxis(arr, axis, 0)
+    out = np.empty((arr.shape[0] - size + 1,) + arr.shape[1:], dtype=dtype)
+
+    if direct is None:
+        direct = size <= _DIRECT_BOX_SUM_MAX_SIZE
+    if direct:
+        # adding the shifted arrays is faster than the cumulative sum for small windows
+        out[...] = arr[:out.shape[0]]
+        for offset in range(1, size):
+            out += arr[offset:offset + out.shape[0]]
+    elif origin is None:
+        cumsum = np.cumsum(arr, axis=0, dtype=dtype)
+        out[0] = cumsum[size - 1]
+        np.subtract(cumsum[size:], cumsum[:-size], out=out[1:])
+    else:
+        # pad with zeros to whole blocks, which does not change the rounding of the sums
+        before = origin % size
+        blocks = np.zeros((before + arr.shape[0] + (-(origin + arr.shape[0])) % size,) + arr.shape[1:], dtype=dtype)
+        blocks[before:before + arr.shape[0]] = arr
+        blocks = blocks.reshape((-1, size) + arr.shape[1:])
+        prefix = np.cumsum(blocks, axis=1, dtype=dtype).reshape((-1,) + arr.shape[1:])
+        suffix = np.cumsum(blocks[:, ::-1], axis=1, dtype=dtype)[:, ::-1].reshape((-1,) + arr.shape[1:])
+        suffix[::size] = 0  # a window starting at a block is the whole block, i.e. its last prefix
+        np.add(suffix[before:before + out.shape[0]], prefix[before + size - 1:before + size - 1 + out.shape[0]],
+               out=out)
+    return np.moveaxis(out, 0, axis)
+
+
+def _window_sum(arr: np.ndarray, window_shape: tuple, dtype=np.float64, z_origin: int = 0) -> np.ndarray:
+    """Sums the values of all windows of a 3-D array with separable box sums.
+
+    The cumulative sums of the first axis restart at the multiples of the window size of the z-coordinate in the
+    image (see :func:`_box_sum`), such that the sums of a z-slab of an image do not depend on where the slab starts
+    (see the tiling of :class:`NeighborhoodFeatureExtractor`).
+
+    Args:
+        arr (np.ndarray): The 3-D array.
+        window_shape (tuple): The window shape (z, y, x).
+        dtype (np.dtype): The data type of the sums.
+        z_origin (int): The z-coordinate of the first slice of the array in the image.
+
+    Returns:
+        np.ndarray: The window sums.
+    """
+    for axis, size in enumerate(window_shape):
+        arr = _box_sum(arr, size, axis, dtype, origin=z_origin if axis == 0 else None)
+    return arr
+
+
+def running_min_max(img_arr_padded: np.ndarray, window_shape: tuple, shape: tuple) -> tuple:
+    """Calculates the exact minimum and maximum of all windows with separable running minimum and maximum filters.
+
+    Args:
+        img_arr_padded (np.ndarray): The padded 3-D image array.
+        window_shape (tuple): The window shape (z, y, x).
+        shape (tuple): The shape (z, y, x) of the output, i.e. windows starting outside are ignored.
+
+    Returns:
+        tuple of np.ndarray: The minimum and the maximum of each window.
+    """
+    minimum = img_arr_padded
+    maximum = img_arr_padded
+    for axis, size in enumerate(window_shape):
+        minimum = np.lib.stride_tricks.sliding_window_view(minimum, size, axis=axis).min(axis=-1)
+        maximum = np.lib.stride_tricks.sliding_window_view(maximum, size, axis=axis).max(axis=-1)
+
+    crop = tuple(slice(0, s) for s in shape)
+    return minimum[crop], maximum[crop]
+
+
+def first_order_histogram_features(img_arr_padded: np.ndarray, window_shape: tuple, shape: tuple,
+                                   features: tuple = HISTOGRAM_FEATURES, bins: int = 64,
+                                   value_range: tuple = None, z_origin: int = 0) -> np.ndarray:
+    """Approximates the entropy and percentile features of all windows from local histograms.
+
+    The intensities are quantized into ``bins`` bins of equal width :math:`w = (max - min) / bins` spanning the
+    intensity range of the image. The local histograms are counted with running sums per bin, i.e. each window's
+    histogram is the one of its neighbor updated by the values entering and leaving the window. The percentiles are
+    read from the cumulative local histograms. The entropy only needs sums over the local histograms, which are
+    window sums of the per-voxel bin values.
+
+    Error bounds with respect to :func:`first_order_texture_features_function`:
+
+    - The percentiles are interpolated between bin centers and deviate at most :math:`w / 2` from the exact values.
+    - The entropy is evaluated at the bin centers. The error vanishes with :math:`w` but is not bounded strictly,
+      since the entropy terms are not Lipschitz continuous close to zero. For the same reason, windows with values
+      close to zero may differ in whether the entropy is defined.
+
+    Args:
+        img_arr_padded (np.ndarray): The padded 3-D image array.
+        window_shape (tuple): The window shape (z, y, x).
+        shape (tuple): The shape (z, y, x) of the output, i.e. windows starting outside are ignored.
+        features (tuple of str): The features to calculate, a subset of :const:`HISTOGRAM_FEATURES`.
+        bins (int): The number of bins.
+        value_range (tuple of float): The intensity range (min, max) spanned by the bins.
+            Defaults to the intensity range of ``img_arr_padded``.
+        z_origin (int): The z-coordinate of the first slice of the array in the image (see :func:`_window_sum`).
+
+    Returns:
+        np.ndarray: An array of shape ``shape + (len(features),)`` with the features in the order of ``features``.
+    """
+    unknown = [f for f in features if f not in HISTOGRAM_FEATURES]
+    if unknown:
+        raise ValueError('features {} cannot be approximated from histograms'.format(unknown))
+    if bins < 1:
+        raise ValueError('bins must be positive')
+
+    eps = sys.float_info.epsilon  # to avoid division by zero
+    window_size = int(np.prod(window_shape))
+    crop = tuple(slice(0, s) for s in shape)
+
+    if value_range is None:
+        value_range = (float(np.min(img_arr_padded)), float(np.max(img_arr_padded)))
+    min_value = value_range[0]
+    width = (value_range[1] - min_value) / bins
+    if width == 0:
+        width = 1.0
+    quantized = np.clip(np.floor((img_arr_padded - min_value) / width), 0, bins - 1).astype(np.int32)
+    centers = min_value + (np.arange(bins) + 0.5) * width
+
+    # the sorted positions of the values needed for the percentiles, see np.percentile
+    percentiles = {f: float(f[len('percentile'):-len('th')]) for f in features if f.startswith('percentile')}
+    ranks = set()
+    for q in percentiles.values():
+        position = q / 100 * (window_size - 1)
+        ranks.add(int(np.floor(position)))
+        if position != np.floor(position):
+            ranks.add(min(int(np.floor(position)) + 1, window_size - 1))
+    # the index of the bin holding the value at a sorted position equals the number of bins with a cumulative count
+    # smaller or equal the position
+    count_dtype = np.int16 if window_size <= np.iinfo(np.int16).max else np.int32
+    bin_dtype = np.int16 if bins <= np.iinfo(np.int16).max else np.int32
+    bin_at_rank = {rank: np.zeros(shape, dtype=bin_dtype) for rank in ranks}
+
+    if 'entropy' in features:
+        # with p = c / s, the entropy -sum(p * log2(p)) of a window with sum s and values c equals
+        # -(sum(c * log2|c|) - log2|s| * sum(c)) / s if all p are positive; otherwise, it is not defined (NaN).
+        # evaluated at the bin centers, the sums over the window's histogram are window sums of per-voxel values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c_log_c = np.where(centers != 0, centers * np.log2(np.abs(centers)), 0)
+        c_log_c_sums = _window_sum(c_log_c[quantized], window_shape, z_origin=z_origin)[crop]
+        c_sums = _window_sum(centers[quantized], window_shape, z_origin=z_origin)[crop]
+        positive_counts = _window_sum(centers[quantized] > 0, window_shape, count_dtype, z_origin)[crop]
+        negative_counts = _window_sum(centers[quantized] < 0, window_shape, count_dtype, z_origin)[crop]
+
+        window_sums = _window_sum(img_arr_padded, window_shape, z_origin=z_origin)[crop] + eps
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy = -(c_log_c_sums - np.log2(np.abs(window_sums)) * c_sums) / window_sums
+        defined = ((window_sums > 0) & (positive_counts == window_size)) | \
+                  ((window_sums < 0) & (negative_counts == window_size))
+        entropy[~defined] = np.nan
+        del c_log_c_sums, c_sums, positive_counts, negative_counts, window_sums, defined
+
+    if ranks:
+        cumulative_count = np.zeros(shape, dtype=count_dtype)
+        for bin_ in range(bins):
+            indicator = quantized == bin_
+            if indicator.any():
+                cumulative_count += _window_sum(indicator, window_shape, count_dtype, z_origin)[crop]
+            for rank, bin_idx in bin_at_rank.items():
+                bin_idx += cumulative_count <= rank
+
+    out = np.zeros(tuple(shape) + (len(features),), dtype=np.float32)
+    for idx, feature in enumerate(features):
+        if feature == 'entropy':
+            out[..., idx] = entropy
+        else:
+            position = percentiles[feature] / 100 * (window_size - 1)
+            lower = int(np.floor(position))
+            t = position - lower
+            a = centers[bin_at_rank[lower]]
+            if t == 0:
+                out[..., idx] = a
+            else:
+                b = centers[bin_at_rank[min(lower + 1, window_size - 1)]]
+                out[..., idx] = a + (b - a) * t
+
+    return out
+
+
+def first_order_moment_features_integral(img_arr_padded: np.ndarray, window_shape: tuple, shape: tuple,
+                                         features: tuple = MOMENT_FEATURES, num_values: int = None,
+                                         shift: float = None, z_origin: int = 0) -> np.ndarray:
+    """Calculates first-order moment features of all windows from local sums of powers of the intensities.
+
+    The local sums are calculated with separable cumulative sums, i.e. an integral image, such that the costs per
+    voxel are independent of the window size. The features are the same as the ones of
+    :func:`first_order_texture_features_function`.
+
+    Args:
+        img_arr_padded (np.ndarray): The padded 3-D image array.
+        window_shape (tuple): The window shape (z, y, x).
+        shape (tuple): The shape (z, y, x) of the output, i.e. windows starting outside are ignored.
+        features (tuple of str): The features to calculate, a subset of :const:`MOMENT_FEATURES`.
+            Only the powers needed by these features are summed.
+        num_values (int): The number of values used for the skewness and kurtosis normalization
+            (see :func:`first_order_texture_features_vectorized`). Defaults to the window size.
+        shift (float): The value subtracted from the intensities before summing their powers. Defaults to the mean
+            intensity.
+        z_origin (int): The z-coordinate of the first slice of the array in the image (see :func:`_window_sum`).
+
+    Returns:
+        np.ndarray: An array of shape ``shape + (len(features),)`` with the features in the order of ``features``.
+    """
+    unknown = [f for f in features if f not in MOMENT_FEATURES]
+    if unknown:
+        raise ValueError('features {} cannot be calculated from moments'.format(unknown))
+
+    eps = sys.float_info.epsilon  # to avoid division by zero
+    window_size = int(np.prod(window_shape))
+    if num_values is None:
+        num_values = window_size
+
+    max_power = 1
+    if {'variance', 'sigma', 'snr', 'energy'} & set(features):
+        max_power = 2
+    if 'skewness' in features:
+        max_power = 3
+    if 'kurtosis' in features:
+        max_power = 4
+
+    # sum powers of the intensities relative to the mean intensity to reduce the cancellation of the central moments
+    if shift is None:
+        shift = float(np.mean(img_arr_padded))
+    values = img_arr_padded.astype(np.float64) - shift
+    crop = tuple(slice(0, s) for s in shape)
+    sums = [None]
+    power = values
+    for p in range(1, max_power + 1):
+        if p > 1:
+            power = power * values
+        sums.append(_window_sum(power, window_shape, z_origin=z_origin)[crop])
+    del values, power
+
+    out = np.zeros(tuple(shape) + (len(features),), dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums[1] / window_size  # the mean of the shifted values
+        if max_power >= 2:
+            variance = np.maximum(sums[2] / window_size - mean * mean, 0)
+            std = np.sqrt(variance)
+
+        for idx, feature in enumerate(features):
+            if feature == 'mean':
+                out[..., idx] = mean + shift
+            elif feature == 'variance':
+                out[..., idx] = variance
+            elif feature == 'sigma':
+                out[..., idx] = std
+            elif feature == 'skewness':
+                central_3 = sums[3] - 3 * mean * sums[2] + 2 * window_size * mean ** 3
+                out[..., idx] = np.sqrt(num_values * (num_values - 1)) / np.float64(num_values - 2) * central_3 / \
+                    (num_values * std ** 3 + eps)
+            elif feature == 'kurtosis':
+                central_4 = sums[4] - 4 * mean * sums[3] + 6 * mean * mean * sums[2] - 3 * window_size * mean ** 4
+                out[..., idx] = central_4 / (num_values * std ** 4 + eps)
+            elif feature == 'energy':
+                # sum of the squared unshifted values divided by the squared sum of the unshifted values
+                sum_1 = sums[1] + window_size * shift
+                sum_2 = sums[2] + 2 * shift * sums[1] + window_size * shift * shift
+                out[..., idx] = sum_2 / (sum_1 + eps) ** 2
+            elif feature == 'snr':
+                out[..., idx] = np.where(std != 0, (mean + shift) / std, 0)
+
+    return out
+
+
 class NeighborhoodFeatureExtractor(fltr.Filter):
-    """Represents a feature extractor filter, which works on a neighborhood."""
+    """Represents a feature extractor filter, which works on a neighborhood.
+
+    The neighborhood of a voxel is the window of size ``kernel`` starting at the voxel, where the image is padded
+    symmetrically at its upper borders.
+    Four backends are available:
+
+    - ``'loop'``: calls ``function_`` once per voxel (works with any function).
+    - ``'vectorized'``: computes the features of all windows of a few z-slices in a couple of array operations using
+      a strided window view (only for :func:`first_order_texture_features_function`).
+    - ``'integral'``: computes the :const:`MOMENT_FEATURES` from integral images of the powers of the intensities
+      (see :func:`first_order_moment_features_integral`). The costs are independent of the kernel size.
+    - ``'histogram'``: an approximate mode for all first-order texture features. The moments are calculated like the
+      ``'integral'`` backend, the minimum, maximum, and range exactly by :func:`running_min_max`, and the entropy and
+      percentiles are approximated from local histograms (see :func:`first_order_histogram_features` for the error
+      bounds). The costs are independent of the kernel size but grow linearly with the number of bins.
 
-    def __init__(self, kernel=(3, 3, 3), function_=first_order_texture_features_function):
-        """Initializes a new instance of the NeighborhoodFeatureExtractor class."""
+    The image is processed in tiles of ``tile_size`` z-slices, each padded with the halo its windows need, such that
+    the temporary arrays are bounded by the tile size instead of the image size. The tiles can be processed in parallel
+    and write their features directly into the preallocated output. The features do not depend on the tiling.
+    """
+
+    BACKENDS = ('loop', 'vectorized', 'integral', 'histogram')
+
+    def __init__(self, kernel=(3, 3, 3), function_=first_order_texture_features_function, backend: str = None,
+                 features: tuple = None, bins: int = 64, tile_size: int = 32, n_workers: int = 1,
+                 chunk_size: int = 2 ** 22):
+        """Initializes a new instance of the NeighborhoodFeatureExtractor class.
+
+        Args:
+            kernel (tuple of int): The neighborhood size in x, y, z direction.
+            function_ (callable): The function to calculate the features of a neighborhood.
+            backend (str): The backend, i.e. ``'loop'``, ``'vectorized'``, ``'integral'``, or ``'histogram'``.
+                Defaults to ``'vectorized'`` if ``function_`` is :func:`first_order_texture_features_function`;
+                otherwise, ``'loop'``.
+            features (tuple of str): The names of the features to emit (see :const:`FIRST_ORDER_TEXTURE_FEATURES`).
+                Defaults to all features of the backend. Not supported for custom functions.
+            bins (int): The number of histogram bins of the ``'histogram'`` backend.
+            tile_size (int): The number of z-slices per tile. None processes the image as a single tile.
+            n_workers (int): The number of threads processing the tiles.
+            chunk_size (int): The approximate number of window values the vectorized backend processes at once.
+                Bounds the size of temporary arrays.
+
+        Raises:
+            ValueError: If the backend is unknown or does not support the function or features.
+        """
         super().__init__()
         self.neighborhood_radius = 3
         self.kernel = kernel
         self.function = function_
 
+        if backend is None:
+            backend = 'vectorized' if function_ is first_order_texture_features_function else 'loop'
+        if backend not in self.BACKENDS:
+            raise ValueError('backend must be one of {}'.format(self.BACKENDS))
+        if backend != 'loop' and function_ is not first_order_texture_features_function:
+            raise ValueError('backend {} only supports first_order_texture_features_function'.format(backend))
+
+        if features is not None and function_ is not first_order_texture_features_function:
+            raise ValueError('features can only be selected for first_order_texture_features_function')
+        supported_features = MOMENT_FEATURES if backend == 'integral' else FIRST_ORDER_TEXTURE_FEATURES
+        if features is None and function_ is first_order_texture_features_function:
+            features = supported_features
+        if features is not None:
+            features = tuple(features)
+            if len(features) == 0 or any(f not in supported_features for f in features):
+                raise ValueError('features must be a non-empty subset of {}'.format(supported_features))
+
+        self.backend = backend
+        self.features = features
+        self.bins = bins
+        self.tile_size = tile_size
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+
     def execute(self, image: sitk.Image, params: fltr.FilterParams = None) -> sitk.Image:
         """Executes a neighborhood feature extractor on an image.
 
@@ -139,7 +666,7 @@ class NeighborhoodFeatureExtractor(fltr.Filter):
             params (fltr.FilterParams): The parameters (unused).
 
         Returns:
-            sitk.Image: The normalized image.
+            sitk.Image: The feature image, a vector image if more than one feature is calculated.
 
         Raises:
             ValueError: If image is not 3-D.
@@ -148,28 +675,236 @@ class NeighborhoodFeatureExtractor(fltr.Filter):
         if image.GetDimension() != 3:
             raise ValueError('image needs to be 3-D')
 
+        img_arr = sitk.GetArrayViewFromImage(image)
+        z = img_arr.shape[0]
+
+        number_of_components = self._get_number_of_components()
+        img_out_arr = np.zeros(img_arr.shape + ((number_of_components,) if number_of_components > 1 else ()),
+                               dtype=np.float32)
+
+        # statistics of the whole image such that the tiles are processed identically
+        statistics = {}
+        if self.backend in ('integral', 'histogram'):
+            statistics['shift'] = float(np.mean(img_arr))
+            statistics['value_range'] = (float(np.min(img_arr)), float(np.max(img_arr)))
+
+        tile_size = z if self.tile_size is None else self.tile_size
+        tiles = [(start, min(start + tile_size, z)) for start in range(0, z, tile_size)]
+
+        def execute_tile(tile):
+            start, stop = tile
+            tile_arr_padded = self._pad_tile(img_arr, start, stop)
+            tile_out_arr = self._execute_padded(tile_arr_padded, (stop - start,) + img_arr.shape[1:], statistics,
+                                                start)
+            img_out_arr[start:stop] = tile_out_arr.reshape(img_out_arr[start:stop].shape)
+
+        if self.n_workers > 1 and len(tiles) > 1:
+            # numpy releases the GIL for the heavy lifting, therefore, threads are sufficient
+            with futures.ThreadPoolExecutor(self.n_workers) as executor:
+                list(executor.map(execute_tile, tiles))  # list() to raise possible exceptions
+        else:
+            for tile in tiles:
+                execute_tile(tile)
+
+        img_out = sitk.GetImageFromArray(img_out_arr, isVector=img_out_arr.ndim == 4)
+        img_out.CopyInformation(image)
+
+        return img_out
+
+    def execute_at(self, image: sitk.Image, indices: np.ndarray) -> np.ndarray:
+        """Calculates the features of the neighborhoods of some voxels only.
+
+        The costs scale with the number of voxels instead of the image size. The features equal the ones of
+        :meth:`execute` up to rounding, where the ``'histogram'`` backend quantizes the intensities the same way.
+
+        Args:
+            image (sitk.Image): The image.
+            indices (np.ndarray): The flat indices of the voxels into the image array (see sitk.GetArrayFromImage).
+
+        Returns:
+            np.ndarray: The features of shape (number of voxels, number of features).
+
+        Raises:
+            ValueError: If image is not 3-D.
+        """
+
+        if image.GetDimension() != 3:
+            raise ValueError('image needs to be 3-D')
+
+        img_arr = sitk.GetArrayViewFromImage(image)
+        window_shape = (self.kernel[2], self.kernel[1], self.kernel[0])
+        window_size = int(np.prod(window_shape))
+        indices = np.asarray(indices)
+
+        statistics = {}
+        if self.backend == 'histogram':
+            statistics['value_range'] = (float(np.min(img_arr)), float(np.max(img_arr)))
+
+        out = np.zeros((len(indices), self._get_number_of_components()), dtype=np.float32)
+        voxels_per_chunk = max(1, self.chunk_size // window_size)
+        for start in range(0, len(indices), voxels_per_chunk):
+            stop = min(start + voxels_per_chunk, len(indices))
+            windows = self._gather_windows(img_arr, indices[start:stop])
+
+            if self.function is not first_order_texture_features_function:
+                out[start:stop] = np.array([self.function(window) for window in windows]).reshape((stop - start, -1))
+                continue
+
+            # len(values) of a window passed to the function is its size in z direction
+            features = first_order_texture_features_vectorized(windows.reshape((stop - start, window_size)),
+                                                               num_values=window_shape[0])
+            if self.backend == 'histogram':
+                self._approximate_at(windows.reshape((stop - start, window_size)), features, statistics)
+            out[start:stop] = features[:, [FIRST_ORDER_TEXTURE_FEATURES.index(f) for f in self.features]]
+
+        return out
+
+    def _gather_windows(self, img_arr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        """Gathers the windows of some voxels from the symmetrically padded image.
+
+        Args:
+            img_arr (np.ndarray): The image array.
+            indices (np.ndarray): The flat indices of the voxels into the image array.
+
+        Returns:
+            np.ndarray: The windows of shape (number of voxels, kernel z, kernel y, kernel x).
+        """
+        voxel = np.unravel_index(indices, img_arr.shape)
+        window_indices = []
+        for axis, size in enumerate((self.kernel[2], self.kernel[1], self.kernel[0])):
+            # the indices np.pad would take the padded values from
+            padded_indices = np.pad(np.arange(img_arr.shape[axis]), (0, size), 'symmetric')
+            window_indices.append(padded_indices[voxel[axis][:, np.newaxis] + np.arange(size)])
+
+        return img_arr[window_indices[0][:, :, np.newaxis, np.newaxis],
+                       window_indices[1][:, np.newaxis, :, np.newaxis],
+                       window_indices[2][:, np.newaxis, np.newaxis, :]]
+
+    def _approximate_at(self, windows: np.ndarray, features: np.ndarray, statistics: dict):
+        """Replaces the entropy and percentiles by the approximations of :func:`first_order_histogram_features`.
+
+        Args:
+            windows (np.ndarray): The windows, where each row holds the values of one window.
+            features (np.ndarray): The exact features of the windows, which are modified in place.
+            statistics (dict): Statistics of the whole image.
+        """
+        eps = sys.float_info.epsilon  # to avoid division by zero
+
+        min_value = statistics['value_range'][0]
+        width = (statistics['value_range'][1] - min_value) / self.bins
+        if width == 0:
+            width = 1.0
+        quantized = np.clip(np.floor((windows - min_value) / width), 0, self.bins - 1)
+        centers = np.sort(min_value + (quantized + 0.5) * width, axis=1)
+
+        for feature in HISTOGRAM_FEATURES[1:]:
+            features[:, FIRST_ORDER_TEXTURE_FEATURES.index(feature)] = \
+                _percentile_of_sorted(centers, float(feature[len('percentile'):-len('th')]))
+
+        window_sums = np.sum(windows, axis=1, dtype=np.float64) + eps
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c_log_c = np.where(centers != 0, centers * np.log2(np.abs(centers)), 0)
+            entropy = -(np.sum(c_log_c, axis=1) - np.log2(np.abs(window_sums)) * np.sum(centers, axis=1)) / \
+                window_sums
+        defined = ((window_sums > 0) & np.all(centers > 0, axis=1)) | ((window_sums < 0) & np.all(centers < 0, axis=1))
+        entropy[~defined] = np.nan
+        features[:, FIRST_ORDER_TEXTURE_FEATURES.index('entropy')] = entropy
+
+    def _get_number_of_components(self) -> int:
+        """Gets the number of features per voxel.
+
+        Returns:
+            int: The number of features, where 1 means a scalar feature image.
+
+        Raises:
+            ValueError: If the function returns neither a scalar nor a 1-D np.ndarray with at least two elements.
+        """
+        if self.features is not None:
+            return len(self.features)
+
         # test the function and get the output dimension for later reshaping
         function_output = self.function(np.array([1, 2, 3]))
         if np.isscalar(function_output):
-            img_out = sitk.Image(image.GetSize(), sitk.sitkFloat32)
+            return 1
         elif not isinstance(function_output, np.ndarray):
             raise ValueError('function must return a scalar or a 1-D np.ndarray')
         elif function_output.ndim > 1:
             raise ValueError('function must return a scalar or a 1-D np.ndarray')
         elif function_output.shape[0] <= 1:
             raise ValueError('function must return a scalar or a 1-D np.ndarray with at least two elements')
+        return function_output.shape[0]
+
+    def _pad_tile(self, img_arr: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """Gets the z-slices of a tile including the halo needed by its windows, padded like the whole image would be.
+
+        Args:
+            img_arr (np.ndarray): The image array.
+            start (int): The first z-slice of the tile.
+            stop (int): The z-slice after the last z-slice of the tile.
+
+        Returns:
+            np.ndarray: The padded array of the tile.
+        """
+        z_offset = self.kernel[2]
+        y_offset = self.kernel[1]
+        x_offset = self.kernel[0]
+
+        # the slices np.pad would use when padding the whole image symmetrically
+        z_indices = np.pad(np.arange(img_arr.shape[0]), (0, z_offset), 'symmetric')[start:stop + z_offset]
+        return np.pad(img_arr[z_indices], ((0, 0), (0, y_offset), (0, x_offset)), 'symmetric')
+
+    def _execute_padded(self, img_arr_padded: np.ndarray, shape: tuple, statistics: dict,
+                        z_origin: int = 0) -> np.ndarray:
+        """Calculates the features of all windows of a padded array with the backend.
+
+        Args:
+            img_arr_padded (np.ndarray): The padded image array.
+            shape (tuple): The shape (z, y, x) of the unpadded image array.
+            statistics (dict): Statistics of the whole image.
+            z_origin (int): The z-coordinate of the first slice of the array in the image.
+
+        Returns:
+            np.ndarray: The feature array.
+        """
+        window_shape = (self.kernel[2], self.kernel[1], self.kernel[0])
+
+        if self.backend == 'integral':
+            return first_order_moment_features_integral(img_arr_padded, window_shape, shape, self.features,
+                                                        num_values=window_shape[0], shift=statistics['shift'],
+                                                        z_origin=z_origin)
+        elif self.backend == 'histogram':
+            return self._execute_histogram(img_arr_padded, shape, statistics, z_origin)
+
+        if self.backend == 'vectorized':
+            img_out_arr = self._execute_vectorized(img_arr_padded, shape)
         else:
-            img_out = sitk.Image(image.GetSize(), sitk.sitkVectorFloat32, function_output.shape[0])
+            img_out_arr = self._execute_loop(img_arr_padded, shape)
+
+        if self.features is not None and self.features != FIRST_ORDER_TEXTURE_FEATURES:
+            img_out_arr = img_out_arr[..., [FIRST_ORDER_TEXTURE_FEATURES.index(f) for f in self.features]]
+        return img_out_arr
 
-        img_out_arr = sitk.GetArrayFromImage(img_out)
-        img_arr = sitk.GetArrayFromImage(image)
-        z, y, x = img_arr.shape
+    def _execute_loop(self, img_arr_padded: np.ndarray, shape: tuple) -> np.ndarray:
+        """Calculates the features by calling the function once per voxel.
 
+        Args:
+            img_arr_padded (np.ndarray): The padded image array.
+            shape (tuple): The shape (z, y, x) of the unpadded image array.
+
+        Returns:
+            np.ndarray: The feature array.
+        """
+        if self.function is first_order_texture_features_function:
+            number_of_components = len(FIRST_ORDER_TEXTURE_FEATURES)
+        else:
+            number_of_components = self._get_number_of_components()
+        img_out_arr = np.zeros(shape + ((number_of_components,) if number_of_components > 1 else ()),
+                               dtype=np.float32)
+
+        z, y, x = shape
         z_offset = self.kernel[2]
         y_offset = self.kernel[1]
         x_offset = self.kernel[0]
-        pad = ((0, z_offset), (0, y_offset), (0, x_offset))
-        img_arr_padded = np.pad(img_arr, pad, 'symmetric')
 
         for xx in range(x):
             for yy in range(y):
@@ -178,18 +913,548 @@ class NeighborhoodFeatureExtractor(fltr.Filter):
                     val = self.function(img_arr_padded[zz:zz + z_offset, yy:yy + y_offset, xx:xx + x_offset])
                     img_out_arr[zz, yy, xx] = val
 
-        img_out = sitk.GetImageFromArray(img_out_arr)
+        return img_out_arr
+
+    def _execute_vectorized(self, img_arr_padded: np.ndarray, shape: tuple) -> np.ndarray:
+        """Calculates the first-order texture features of all voxels using a strided window view.
+
+        Args:
+            img_arr_padded (np.ndarray): The padded image array.
+            shape (tuple): The shape (z, y, x) of the unpadded image array.
+
+        Returns:
+            np.ndarray: The feature array.
+        """
+        z, y, x = shape
+        window_shape = (self.kernel[2], self.kernel[1], self.kernel[0])
+        windows = np.lib.stride_tricks.sliding_window_view(img_arr_padded, window_shape)[:z, :y, :x]
+
+        img_out_arr = np.zeros(shape + (16,), dtype=np.float32)
+
+        # process a few z-slices at a time to bound the size of the copied windows
+        slices_per_chunk = max(1, self.chunk_size // (y * x * int(np.prod(window_shape))))
+        for z_start in range(0, z, slices_per_chunk):
+            z_stop = min(z_start + slices_per_chunk, z)
+            chunk = windows[z_start:z_stop].reshape((-1, int(np.prod(window_shape))))
+            # len(values) of a window passed to the function is its size in z direction
+            features = first_order_texture_features_vectorized(chunk, num_values=window_shape[0])
+            img_out_arr[z_start:z_stop] = features.reshape((z_stop - z_start, y, x, 16))
+
+        return img_out_arr
+
+    def _execute_histogram(self, img_arr_padded: np.ndarray, shape: tuple, statistics: dict,
+                           z_origin: int = 0) -> np.ndarray:
+        """Calculates the exact moments, minimum, and maximum and the approximate entropy and percentiles.
+
+        Args:
+            img_arr_padded (np.ndarray): The padded image array.
+            shape (tuple): The shape (z, y, x) of the unpadded image array.
+            statistics (dict): Statistics of the whole image.
+            z_origin (int): The z-coordinate of the first slice of the array in the image.
+
+        Returns:
+            np.ndarray: The feature array.
+        """
+        window_shape = (self.kernel[2], self.kernel[1], self.kernel[0])
+        img_out_arr = np.zeros(shape + (len(self.features),), dtype=np.float32)
+
+        def indices(group):
+            return [idx for idx, f in enumerate(self.features) if f in group]
+
+        moment_indices = indices(MOMENT_FEATURES)
+        if moment_indices:
+            img_out_arr[..., moment_indices] = first_order_moment_features_integral(
+                img_arr_padded, window_shape, shape, tuple(self.features[idx] for idx in moment_indices),
+                num_values=window_shape[0], shift=statistics['shift'], z_origin=z_origin)
+
+        min_max_indices = indices(MIN_MAX_FEATURES)
+        if min_max_indices:
+            minimum, maximum = running_min_max(img_arr_padded, window_shape, shape)
+            for idx in min_max_indices:
+                if self.features[idx] == 'min':
+                    img_out_arr[..., idx] = minimum
+                elif self.features[idx] == 'max':
+                    img_out_arr[..., idx] = maximum
+                else:
+                    img_out_arr[..., idx] = maximum - minimum
+
+        histogram_indices = indices(HISTOGRAM_FEATURES)
+        if histogram_indices:
+            img_out_arr[..., histogram_indices] = first_order_histogram_features(
+                img_arr_padded, window_shape, shape, tuple(self.features[idx] for idx in histogram_indices),
+                self.bins, statistics['value_range'], z_origin)
+
+        return img_out_arr
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        return 'NeighborhoodFeatureExtractor:\n' \
+               ' kernel:   {self.kernel}\n' \
+               ' backend:  {self.backend}\n' \
+               ' features: {self.features}\n' \
+               ' tiling:   {self.tile_size} z-slices, {self.n_workers} workers\n' \
+            .format(self=self)
+
+
+SCALE_SPACE_FEATURES = ('intensity', 'gradient', 'laplacian', 'hessian')
+"""The features of the :class:`GaussianScaleSpaceFeatureExtractor`, where ``'hessian'`` are the three eigenvalues of
+the Hessian matrix in ascending order."""
+
+
+def symmetric_eigenvalues_3x3(a11: np.ndarray, a22: np.ndarray, a33: np.ndarray,
+                              a12: np.ndarray, a13: np.ndarray, a23: np.ndarray) -> np.ndarray:
+    """Calculates the eigenvalues of symmetric 3x3 matrices in closed form.
+
+    The matrices are given element-wise, which is faster and leaner than ``np.linalg.eigvalsh`` on stacked matrices.
+
+    Args:
+        a11, a22, a33, a12, a13, a23 (np.ndarray): The upper triangle of the matrices, each of shape (n,).
+
+    Returns:
+        np.ndarray: The eigenvalues of shape (n, 3) in ascending order.
+    """
+    a11, a22, a33, a12, a13, a23 = (np.asarray(a, dtype=np.float64) for a in (a11, a22, a33, a12, a13, a23))
+
+    q = (a11 + a22 + a33) / 3
+    b11, b22, b33 = a11 - q, a22 - q, a33 - q
+    p = np.sqrt((b11 * b11 + b22 * b22 + b33 * b33 + 2 * (a12 * a12 + a13 * a13 + a23 * a23)) / 6)
+
+    # the eigenvalues are q + 2 p cos(phi + 2 pi k / 3) with r = cos(3 phi) = det((A - q I) / p) / 2
+    det = b11 * (b22 * b33 - a23 * a23) - a12 * (a12 * b33 - a23 * a13) + a13 * (a12 * a23 - b22 * a13)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(p > 0, det / (2 * p * p * p), 0)
+    phi = np.arccos(np.clip(r, -1, 1)) / 3
+
+    eigenvalues = np.empty(q.shape + (3,))
+    eigenvalues[..., 2] = q + 2 * p * np.cos(phi)
+    eigenvalues[..., 0] = q + 2 * p * np.cos(phi + 2 * np.pi / 3)
+    eigenvalues[..., 1] = 3 * q - eigenvalues[..., 0] - eigenvalues[..., 2]
+    return eigenvalues
+
+
+class GaussianScaleSpaceFeatureExtractor(fltr.Filter):
+    """Represents a multi-scale Gaussian feature extractor.
+
+    The image is smoothed once per scale by a recursive Gaussian filter and all features of a scale are derived from the
+    smoothed image by central finite differences (with replicated borders):
+
+    - ``'intensity'``: the smoothed intensity.
+    - ``'gradient'``: the gradient magnitude.
+    - ``'laplacian'``: the Laplacian, i.e. the trace of the Hessian matrix.
+    - ``'hessian'``: the three eigenvalues of the Hessian matrix in ascending order.
+
+    The output is a vector image with the selected features of the first scale, followed by the ones of the second
+    scale, and so on.
+    """
+
+    def __init__(self, sigmas: tuple = (1, 2, 4), features: tuple = SCALE_SPACE_FEATURES, chunk_size: int = 2 ** 20):
+        """Initializes a new instance of the GaussianScaleSpaceFeatureExtractor class.
+
+        Args:
+            sigmas (tuple of float): The standard deviations of the Gaussian scales in physical units (mm).
+            features (tuple of str): The features to emit per scale (see :const:`SCALE_SPACE_FEATURES`).
+            chunk_size (int): The number of voxels whose Hessian eigenvalues are calculated at once.
+                Bounds the size of temporary arrays.
+
+        Raises:
+            ValueError: If no sigmas or unknown features are given.
+        """
+        super().__init__()
+        if len(sigmas) == 0:
+            raise ValueError('at least one sigma is required')
+        features = tuple(features)
+        if len(features) == 0 or any(f not in SCALE_SPACE_FEATURES for f in features):
+            raise ValueError('features must be a non-empty subset of {}'.format(SCALE_SPACE_FEATURES))
+
+        self.sigmas = tuple(sigmas)
+        self.features = features
+        self.chunk_size = chunk_size
+
+    def execute(self, image: sitk.Image, params: fltr.FilterParams = None) -> sitk.Image:
+        """Executes the multi-scale Gaussian feature extractor on an image.
+
+        Args:
+            image (sitk.Image): The image.
+            params (fltr.FilterParams): The parameters (unused).
+
+        Returns:
+            sitk.Image: The float32 feature image.
+
+        Raises:
+            ValueError: If image is not 3-D.
+        """
+        if image.GetDimension() != 3:
+            raise ValueError('image needs to be 3-D')
+
+        z, y, x = image.GetSize()[::-1]
+        features = np.empty((z * y * x, self._get_number_of_components()), dtype=np.float32)
+
+        column = 0
+        for smoothed in self._smooth(image):
+            padded = np.pad(smoothed, 1, mode='edge')
+
+            def at(dz, dy, dx):
+                return padded[1 + dz:1 + dz + z, 1 + dy:1 + dy + y, 1 + dx:1 + dx + x].reshape(-1)
+
+            column = self._features_of_scale(at, image.GetSpacing(), features, column)
+
+        img_out = sitk.GetImageFromArray(features.reshape((z, y, x, -1)).squeeze(axis=3)
+                                         if features.shape[1] == 1 else features.reshape((z, y, x, -1)))
         img_out.CopyInformation(image)
+        return img_out
+
+    def execute_at(self, image: sitk.Image, indices: np.ndarray) -> np.ndarray:
+        """Calculates the features of some voxels only.
+
+        The image is still smoothed entirely, but the derivatives are calculated at the voxels only.
+
+        Args:
+            image (sitk.Image): The image.
+            indices (np.ndarray): The flat indices of the voxels into the image array (see sitk.GetArrayFromImage).
+
+        Returns:
+            np.ndarray: The float32 features of shape (number of voxels, number of features), equal to the ones of
+            :meth:`execute`.
+
+        Raises:
+            ValueError: If image is not 3-D.
+        """
+        if image.GetDimension() != 3:
+            raise ValueError('image needs to be 3-D')
+
+        shape = image.GetSize()[::-1]
+        features = np.empty((indices.size, self._get_number_of_components()), dtype=np.float32)
+
+        # the flat indices into the padded image and its strides
+        padded_shape = tuple(s + 2 for s in shape)
+        padded_indices = np.ravel_multi_index(tuple(i + 1 for i in np.unravel_index(indices, shape)), padded_shape)
+        stride_z, stride_y = padded_shape[1] * padded_shape[2], padded_shape[2]
+
+        column = 0
+        for smoothed in self._smooth(image):
+            padded = np.pad(smoothed, 1, mode='edge').reshape(-1)
+
+            def at(dz, dy, dx):
+                return padded[padded_indices + (dz * stride_z + dy * stride_y + dx)]
+
+            column = self._features_of_scale(at, image.GetSpacing(), features, column)
+
+        return features
+
+    def _smooth(self, image: sitk.Image):
+        """Yields the image smoothed at each scale as float32 array."""
+        image = sitk.Cast(image, sitk.sitkFloat32)
+        for sigma in self.sigmas:
+            smoothed = sitk.SmoothingRecursiveGaussian(image, sigma)  # the view is only valid while the image exists
+            yield sitk.GetArrayViewFromImage(smoothed)
+
+    def _features_of_scale(self, at, spacing: tuple, features: np.ndarray, column: int) -> int:
+        """Calculates the features of a scale.
+
+        Args:
+            at (callable): A function returning the flat smoothed values shifted by (dz, dy, dx) voxels.
+            spacing (tuple of float): The spacing in x, y, z direction.
+            features (np.ndarray): The features to write into.
+            column (int): The first column of the scale.
+
+        Returns:
+            int: The first column of the next scale.
+        """
+        # the axes of the arrays are z, y, x
+        h = spacing[::-1]
+        unit = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+        center = at(0, 0, 0)
+
+        for feature in self.features:
+            if feature == 'intensity':
+                features[:, column] = center
+                column += 1
+            elif feature == 'gradient':
+                magnitude = np.zeros(center.shape, dtype=np.float32)
+                for axis in range(3):
+                    derivative = (at(*unit[axis]) - at(*(-u for u in unit[axis]))) / np.float32(2 * h[axis])
+                    magnitude += derivative * derivative
+                features[:, column] = np.sqrt(magnitude)
+                column += 1
+            elif feature == 'laplacian':
+                laplacian = np.zeros(center.shape, dtype=np.float32)
+                for axis in range(3):
+                    laplacian += self._second_derivative(at, center, h, axis, axis)
+                features[:, column] = laplacian
+                column += 1
+            elif feature == 'hessian':
+                hessian = {(a, b): self._second_derivative(at, center, h, a, b)
+                           for a in range(3) for b in range(a, 3)}
+                for start in range(0, center.size, self.chunk_size):
+                    chunk = slice(start, start + self.chunk_size)
+                    # the eigenvalues do not depend on the order of the axes
+                    features[chunk, column:column + 3] = symmetric_eigenvalues_3x3(
+                        hessian[0, 0][chunk], hessian[1, 1][chunk], hessian[2, 2][chunk],
+                        hessian[0, 1][chunk], hessian[0, 2][chunk], hessian[1, 2][chunk])
+                column += 3
+
+        return column
+
+    @staticmethod
+    def _second_derivative(at, center: np.ndarray, h: tuple, axis_a: int, axis_b: int) -> np.ndarray:
+        """Calculates a second derivative by central differences."""
+        if axis_a == axis_b:
+            shift = [0, 0, 0]
+            shift[axis_a] = 1
+            plus = at(*shift)
+            shift[axis_a] = -1
+            return (plus - 2 * center + at(*shift)) / np.float32(h[axis_a] * h[axis_a])
+
+        def shifted(sign_a, sign_b):
+            shift = [0, 0, 0]
+            shift[axis_a], shift[axis_b] = sign_a, sign_b
+            return at(*shift)
+
+        return (shifted(1, 1) - shifted(1, -1) - shifted(-1, 1) + shifted(-1, -1)) / \
+            np.float32(4 * h[axis_a] * h[axis_b])
+
+    def _get_number_of_components(self) -> int:
+        """Gets the number of features."""
+        return len(self.sigmas) * sum(3 if f == 'hessian' else 1 for f in self.features)
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        return 'GaussianScaleSpaceFeatureExtractor:\n' \
+               ' sigmas:   {self.sigmas}\n' \
+               ' features: {self.features}\n' \
+            .format(self=self)
+
+
+GLCM_FEATURES = ('contrast', 'homogeneity', 'correlation', 'energy')
+"""The features of the :class:`GLCMFeatureExtractor`."""
+
+
+def glcm_features_from_counts(counts, levels: int, no_pairs: int, features: tuple = GLCM_FEATURES) -> np.ndarray:
+    """Calculates Haralick features of symmetric gray-level co-occurrence matrices (GLCMs) from their counts.
+
+    Args:
+        counts (iterable): The counts of the unordered gray-level pairs (i, j) with i <= j as arrays of equal shape,
+            in the order (0, 0), (0, 1), ..., (0, levels - 1), (1, 1), ..., (levels - 1, levels - 1).
+        levels (int): The number of gray levels.
+        no_pairs (int): The number of voxel pairs, i.e. the sum of the counts.
+        features (tuple of str): The features to calculate (see :const:`GLCM_FEATURES`).
+
+    Returns:
+        np.ndarray: The features of shape (count shape..., number of features).
+    """
+    counts = iter(counts)
+    contrast = homogeneity = mean = mean_of_squares = mean_of_products = energy = 0
+
+    # the symmetric GLCM has the probabilities P(i, j) = P(j, i) = c / (2 N) (i != j) and P(i, i) = c / N,
+    # where c is the count of the unordered pair (i, j) and N the number of voxel pairs
+    for i in range(levels):
+        for j in range(i, levels):
+            probability = next(counts).astype(np.float64) / no_pairs
+            contrast = contrast + (i - j) * (i - j) * probability
+            homogeneity = homogeneity + probability / (1 + (i - j) * (i - j))
+            mean = mean + (i + j) / 2 * probability
+            mean_of_squares = mean_of_squares + (i * i + j * j) / 2 * probability
+            mean_of_products = mean_of_products + i * j * probability
+            energy = energy + (probability * probability if i == j else probability * probability / 2)
+
+    # the correlation of a constant neighborhood is 1
+    variance = mean_of_squares - mean * mean
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = np.where(variance > 1e-12, (mean_of_products - mean * mean) / variance, 1.0)
+
+    values = {'contrast': contrast, 'homogeneity': homogeneity, 'correlation': correlation, 'energy': energy}
+    return np.stack([values[f] for f in features], axis=-1)
+
+
+class GLCMFeatureExtractor(fltr.Filter):
+    """Represents a gray-level co-occurrence matrix (GLCM) texture feature extractor, which works on a neighborhood.
+
+    The intensities of the image are quantized into ``levels`` equally wide gray levels between the image's minimum and
+    maximum. For each voxel, a symmetric GLCM pools the gray-level pairs of the voxels in its neighborhood with their
+    direct neighbors in positive x, y, and z direction. The features (see :const:`GLCM_FEATURES`) are contrast,
+    homogeneity, correlation, and energy.
+
+    Like for the :class:`NeighborhoodFeatureExtractor`, the neighborhood of a voxel is the window of size ``kernel``
+    starting at the voxel, where the image is padded symmetrically at its upper borders.
+    The co-occurrence counts of all windows are calculated without a per-voxel loop by window sums (see
+    :func:`_window_sum`) of the indicator images of each gray-level pair, such that the costs grow with the number of
+    gray-level pairs, ``levels * (levels + 1) / 2``, but hardly with the kernel size (see the ``glcm`` benchmark in
+    ``bin/benchmark.py`` for the run time).
+    """
+
+    def __init__(self, kernel: tuple = (5, 5, 5), levels: int = 8, features: tuple = GLCM_FEATURES,
+                 tile_size: int = 32, n_workers: int = 1, chunk_size: int = 2 ** 16):
+        """Initializes a new instance of the GLCMFeatureExtractor class.
+
+        Args:
+            kernel (tuple of int): The neighborhood size in x, y, z direction.
+            levels (int): The number of gray levels.
+            features (tuple of str): The features to emit (see :const:`GLCM_FEATURES`).
+            tile_size (int): The number of z-slices per tile. None processes the image as a single tile.
+            n_workers (int): The number of threads processing the tiles.
+            chunk_size (int): The number of voxels :meth:`execute_at` processes at once.
+
+        Raises:
+            ValueError: If the levels or features are invalid.
+        """
+        super().__init__()
+        if not 2 <= levels <= 256:
+            raise ValueError('levels must be between 2 and 256')
+        features = tuple(features)
+        if len(features) == 0 or any(f not in GLCM_FEATURES for f in features):
+            raise ValueError('features must be a non-empty subset of {}'.format(GLCM_FEATURES))
+
+        self.kernel = kernel
+        self.levels = levels
+        self.features = features
+        self.tile_size = tile_size
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+
+    def execute(self, image: sitk.Image, params: fltr.FilterParams = None) -> sitk.Image:
+        """Executes the GLCM feature extractor on an image.
+
+        Args:
+            image (sitk.Image): The image.
+            params (fltr.FilterParams): The parameters (unused).
+
+        Returns:
+            sitk.Image: The float32 feature image.
+
+        Raises:
+            ValueError: If image is not 3-D.
+        """
+        if image.GetDimension() != 3:
+            raise ValueError('image needs to be 3-D')
+
+        quantized_padded = self._quantize_and_pad(sitk.GetArrayViewFromImage(image))
+        window_shape = self.kernel[::-1]
+        shape = image.GetSize()[::-1]
+        z = shape[0]
+
+        img_out_arr = np.zeros(shape + (len(self.features),), dtype=np.float32)
+
+        tile_size = z if self.tile_size is None else self.tile_size
+        tiles = [(start, min(start + tile_size, z)) for start in range(0, z, tile_size)]
+
+        def execute_tile(tile):
+            start, stop = tile
+            # the pairs start in the windows of the tile, the neighbors lie one voxel further
+            slab = quantized_padded[start:stop + window_shape[0]]
+            region = tuple(slice(0, n + k - 1) for n, k in zip((stop - start,) + shape[1:], window_shape))
+            codes = [self._pair_codes(slab[region],
+                                      slab[tuple(slice(r.start + (a == axis), r.stop + (a == axis))
+                                                 for a, r in enumerate(region))])
+                     for axis in range(3)]
+            counts_dtype = np.int16 if 3 * np.prod(window_shape) <= np.iinfo(np.int16).max else np.int32
+
+            def counts():
+                for i in range(self.levels):
+                    for j in range(i, self.levels):
+                        code = i * self.levels + j
+                        indicator = (codes[0] == code).view(np.uint8) + (codes[1] == code).view(np.uint8) + \
+                            (codes[2] == code).view(np.uint8)
+                        yield _window_sum(indicator, window_shape, counts_dtype, start)
+
+            img_out_arr[start:stop] = glcm_features_from_counts(counts(), self.levels, 3 * int(np.prod(window_shape)),
+                                                                self.features)
+
+        if self.n_workers > 1 and len(tiles) > 1:
+            # numpy releases the GIL for the heavy lifting, therefore, threads are sufficient
+            with futures.ThreadPoolExecutor(self.n_workers) as executor:
+                list(executor.map(execute_tile, tiles))  # list() to raise possible exceptions
+        else:
+            for tile in tiles:
+                execute_tile(tile)
 
+        img_out = sitk.GetImageFromArray(img_out_arr if len(self.features) > 1 else img_out_arr[..., 0],
+                                         isVector=len(self.features) > 1)
+        img_out.CopyInformation(image)
         return img_out
 
+    def execute_at(self, image: sitk.Image, indices: np.ndarray) -> np.ndarray:
+        """Calculates the features of the neighborhoods of some voxels only.
+
+        Args:
+            image (sitk.Image): The image.
+            indices (np.ndarray): The flat indices of the voxels into the image array (see sitk.GetArrayFromImage).
+
+        Returns:
+            np.ndarray: The float32 features of shape (number of voxels, number of features), equal to the ones of
+            :meth:`execute`.
+
+        Raises:
+            ValueError: If image is not 3-D.
+        """
+        if image.GetDimension() != 3:
+            raise ValueError('image needs to be 3-D')
+
+        quantized_padded = self._quantize_and_pad(sitk.GetArrayViewFromImage(image))
+        window_shape = self.kernel[::-1]
+        shape = image.GetSize()[::-1]
+        windows_view = np.lib.stride_tricks.sliding_window_view(quantized_padded, tuple(k + 1 for k in window_shape))
+        indices = np.asarray(indices)
+        no_codes = self.levels * self.levels
+
+        out = np.zeros((len(indices), len(self.features)), dtype=np.float32)
+        for start in range(0, len(indices), self.chunk_size):
+            stop = min(start + self.chunk_size, len(indices))
+            windows = windows_view[np.unravel_index(indices[start:stop], shape)]
+
+            region = (slice(None),) + tuple(slice(0, k) for k in window_shape)
+            codes = np.concatenate([self._pair_codes(windows[region],
+                                                     windows[(slice(None),) + tuple(slice(a == axis, k + (a == axis))
+                                                             for a, k in enumerate(window_shape))]
+                                                     ).reshape((stop - start, -1))
+                                    for axis in range(3)], axis=1)
+            counts = np.bincount((np.arange(stop - start)[:, np.newaxis] * no_codes + codes).reshape(-1),
+                                 minlength=(stop - start) * no_codes).reshape((stop - start, no_codes))
+
+            out[start:stop] = glcm_features_from_counts(
+                (counts[:, i * self.levels + j] for i in range(self.levels) for j in range(i, self.levels)),
+                self.levels, 3 * int(np.prod(window_shape)), self.features)
+
+        return out
+
+    def _quantize_and_pad(self, img_arr: np.ndarray) -> np.ndarray:
+        """Quantizes the image into gray levels and pads it symmetrically by the kernel size plus one voxel.
+
+        Args:
+            img_arr (np.ndarray): The image array.
+
+        Returns:
+            np.ndarray: The padded gray levels.
+        """
+        min_value, max_value = float(np.min(img_arr)), float(np.max(img_arr))
+        width = (max_value - min_value) / self.levels
+        if width == 0:
+            width = 1.0
+        quantized = np.clip(np.floor((img_arr - min_value) / width), 0, self.levels - 1).astype(np.uint8)
+        return np.pad(quantized, [(0, k + 1) for k in self.kernel[::-1]], 'symmetric')
+
+    def _pair_codes(self, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """Gets the codes ``i * levels + j`` of the unordered gray-level pairs (i, j), i <= j, of two arrays."""
+        low = np.minimum(first, second).astype(np.uint16)
+        return low * self.levels + np.maximum(first, second)
+
     def __str__(self):
         """Gets a printable string representation.
 
         Returns:
             str: String representation.
         """
-        return 'NeighborhoodFeatureExtractor:\n' \
+        return 'GLCMFeatureExtractor:\n' \
+               ' kernel:   {self.kernel}\n' \
+               ' levels:   {self.levels}\n' \
+               ' features: {self.features}\n' \
             .format(self=self)
 
 
@@ -201,47 +1466,79 @@ class RandomizedTrainingMaskGenerator:
     """
 
     @staticmethod
-    def get_mask(ground_truth: sitk.Image,
-                 ground_truth_labels: list,
-                 label_percentages: list,
-                 background_mask: sitk.Image = None) -> sitk.Image:
-        """Gets a training mask.
+    def get_indices(ground_truth: sitk.Image,
+                    ground_truth_labels: list,
+                    label_percentages: list,
+                    background_mask: sitk.Image = None,
+                    seed=None) -> np.ndarray:
+        """Gets the flat indices of randomly sampled training voxels.
+
+        For each label, the voxels are drawn without replacement from the flat indices of the label's voxels.
 
         Args:
             ground_truth (sitk.Image): The ground truth image.
             ground_truth_labels (list of int): The ground truth labels,
                 where 0=background, 1=label1, 2=label2, ..., e.g. [0, 1]
-            label_percentages (list of float): The percentage of voxels of a corresponding label to extract as mask,
+            label_percentages (list of float): The percentage of voxels of a corresponding label to sample,
                 e.g. [0.2, 0.2].
             background_mask (sitk.Image): A mask, where intensity 0 indicates voxels to exclude independent of the
             label.
+            seed (int, sequence of int, or np.random.Generator): The seed of the random number generator
+                (see np.random.default_rng). None draws a new seed.
 
         Returns:
-            sitk.Image: The training mask.
+            np.ndarray: The sorted flat indices of the sampled voxels into the ground truth array
+            (see sitk.GetArrayFromImage).
         """
 
-        # initialize mask
-        ground_truth_array = sitk.GetArrayFromImage(ground_truth)
-        mask_array = np.zeros(ground_truth_array.shape, dtype=np.uint8)
+        rng = np.random.default_rng(seed)
+        ground_truth_array = sitk.GetArrayViewFromImage(ground_truth).reshape(-1)
 
         # exclude background
+        valid = None
         if background_mask is not None:
-            background_mask_array = sitk.GetArrayFromImage(background_mask)
-            background_mask_array = np.logical_not(background_mask_array)
-            ground_truth_array = ground_truth_array.astype(float)  # convert to float because of np.nan
-            ground_truth_array[background_mask_array] = np.nan
+            valid = sitk.GetArrayViewFromImage(background_mask).reshape(-1) != 0
 
+        indices = []
         for label_idx, label in enumerate(ground_truth_labels):
-            indices = np.transpose(np.where(ground_truth_array == label))
-            np.random.shuffle(indices)
+            is_label = ground_truth_array == label
+            if valid is not None:
+                is_label &= valid
+            candidates = np.flatnonzero(is_label)
+
+            no_mask_items = int(candidates.shape[0] * label_percentages[label_idx])
+            indices.append(candidates[rng.choice(candidates.shape[0], no_mask_items, replace=False)])
+
+        return np.sort(np.concatenate(indices))
+
+    @staticmethod
+    def get_mask(ground_truth: sitk.Image,
+                 ground_truth_labels: list,
+                 label_percentages: list,
+                 background_mask: sitk.Image = None,
+                 seed=None) -> sitk.Image:
+        """Gets a training mask.
+
+        Args:
+            ground_truth (sitk.Image): The ground truth image.
+            ground_truth_labels (list of int): The ground truth labels,
+                where 0=background, 1=label1, 2=label2, ..., e.g. [0, 1]
+            label_percentages (list of float): The percentage of voxels of a corresponding label to extract as mask,
+                e.g. [0.2, 0.2].
+            background_mask (sitk.Image): A mask, where intensity 0 indicates voxels to exclude independent of the
+            label.
+            seed (int, sequence of int, or np.random.Generator): The seed of the random number generator
+                (see np.random.default_rng). None draws a new seed.
+
+        Returns:
+            sitk.Image: The training mask.
+        """
 
-            no_mask_items = int(indices.shape[0] * label_percentages[label_idx])
+        indices = RandomizedTrainingMaskGenerator.get_indices(ground_truth, ground_truth_labels, label_percentages,
+                                                              background_mask, seed)
 
-            for no in range(no_mask_items):
-                x = indices[no][0]
-                y = indices[no][1]
-                z = indices[no][2]
-                mask_array[x, y, z] = 1  # this is a masked item
+        mask_array = np.zeros(ground_truth.GetSize()[::-1], dtype=np.uint8)
+        mask_array.reshape(-1)[indices] = 1  # these are masked items
 
         mask = sitk.GetImageFromArray(mask_array)
         mask.SetOrigin(ground_truth.GetOrigin())
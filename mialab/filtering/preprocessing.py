@@ -2,6 +2,7 @@
 
 Image pre-processing aims to improve the image quality (image intensities) for subsequent pipeline steps.
 """
+import typing as t
 import warnings
 
 import pymia.filtering.filter as pymia_fltr
@@ -163,3 +164,24 @@ class ImageRegistration(pymia_fltr.Filter):
         """
         return 'ImageRegistration:\n' \
             .format(self=self)
+
+
+def register_multi_component(images: t.List[sitk.Image], atlas: sitk.Image,
+                             transformation: sitk.Transform) -> t.List[sitk.Image]:
+    """Registers images of the same grid, e.g. the T1w and T2w images, by a single linear resampling.
+
+    The images are composed to a multi-component image of doubles, such that the voxels of each image are equal to
+    the ones of :class:`ImageRegistration`, which resamples each image separately. Note that SimpleITK's vector
+    interpolation is slower than the separate scalar interpolations (see ``benchmark.py registration``).
+
+    Args:
+        images (list of sitk.Image): The images, which have the same grid.
+        atlas (sitk.Image): The atlas image.
+        transformation (sitk.Transform): The transformation for registration.
+
+    Returns:
+        list of sitk.Image: The registered images with the pixel types of the images.
+    """
+    image = sitk.Compose([sitk.Cast(image, sitk.sitkFloat64) for image in images])
+    image = sitk.Resample(image, atlas, transformation, sitk.sitkLinear, 0.0)
+    return [sitk.VectorIndexSelectionCast(image, i, original.GetPixelID()) for i, original in enumerate(images)]
@@ -0,0 +1,286 @@
+"""The cache module holds a content-addressed on-disk cache for pre-processed images.
+
+An entry is keyed by a hash of the identities of the input files, the pre-processing parameters, and the code version,
+such that it is invalidated automatically when any of them changes. The images and the feature matrix of an entry are
+stored as uncompressed ``.npy`` arrays, which load in milliseconds. The least recently used entries are evicted when
+the cache exceeds its maximum size.
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import typing as t
+
+import numpy as np
+import pymia.data.conversion as conversion
+import SimpleITK as sitk
+
+import mialab.data.structure as structure
+
+META_FILE_NAME = 'meta.json'
+TRANSFORM_FILE_NAME = 'transform.tfm'
+
+# the parameters changing how but not what is computed, e.g. the resources, which are excluded from the keys
+EXECUTION_PARAMS = ('n_threads', 'n_jobs', 'neighborhood_n_workers', 'tile_size', 'chunk_size',
+                    'registration_multi_component')
+
+
+def result_params(params: dict) -> dict:
+    """Gets the parameters changing the result, i.e. without the cache parameters and :data:`EXECUTION_PARAMS`.
+
+    Args:
+        params (dict): The parameters, e.g. of the pre-processing.
+
+    Returns:
+        dict: The parameters changing the result.
+    """
+    return {k: v for k, v in params.items() if not k.startswith('cache_') and k not in EXECUTION_PARAMS}
+
+
+@functools.lru_cache(maxsize=1)
+def code_version() -> str:
+    """Gets the version of the code, i.e. the hash of the source files of the mialab package.
+
+    Returns:
+        str: The hexadecimal hash.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sha = hashlib.sha256()
+    for directory, directories, files in os.walk(root):
+        directories.sort()
+        for file in sorted(f for f in files if f.endswith('.py')):
+            path = os.path.join(directory, file)
+            sha.update(os.path.relpath(path, root).replace(os.sep, '/').encode())
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+
+def file_identity(path: str, content_hash: bool = False) -> dict:
+    """Gets the identity of a file.
+
+    Args:
+        path (str): The path to the file.
+        content_hash (bool): Whether to include the hash of the file content, which is robust to touched files
+            but requires reading the file.
+
+    Returns:
+        dict: The absolute path, size, modification time, and optionally the content hash of the file.
+    """
+    stat = os.stat(path)
+    identity = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if content_hash:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(functools.partial(f.read, 2 ** 20), b''):
+                sha.update(block)
+        identity['sha256'] = sha.hexdigest()
+    return identity
+
+
+class PreProcessingCache:
+    """Represents a content-addressed on-disk cache of pre-processed :class:`BrainImage <data.structure.BrainImage>`.
+
+    Each entry is a directory named by its key, which holds the images, the feature matrix, and the feature indices as
+    ``.npy`` files, the registration transformation, and a ``meta.json`` file. The modification time of the
+    ``meta.json`` file is the time of the last use.
+    """
+
+    def __init__(self, directory: str, max_size: int = None, content_hash: bool = False):
+        """Initializes a new instance of the PreProcessingCache class.
+
+        Args:
+            directory (str): The cache directory.
+            max_size (int): The maximum size of the cache in bytes. None for an unbounded cache.
+            content_hash (bool): Whether the keys include the hash of the input file contents
+                (see :func:`file_identity`).
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.content_hash = content_hash
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, id_: str, paths: dict, params: dict, extra: str = '') -> str:
+        """Gets the key of an image.
+
+        Args:
+            id_ (str): The image identifier.
+            paths (dict): The paths to the input files, where the keys are of type structure.BrainImageTypes.
+            params (dict): The pre-processing parameters. The cache and execution parameters are ignored (see
+                :func:`result_params`).
+            extra (str): Additional identity, e.g. of the atlas images.
+
+        Returns:
+            str: The key.
+        """
+        params = result_params(params)
+        files = {key.name: file_identity(path, self.content_hash) for key, path in paths.items()
+                 if isinstance(key, structure.BrainImageTypes)}
+        identity = {'id': id_, 'files': files, 'params': params, 'code': code_version(), 'extra': extra}
+        # default=repr such that tuples, enums, etc. have a stable representation
+        return hashlib.sha256(json.dumps(identity, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def load(self, key: str) -> t.Optional[structure.BrainImage]:
+        """Loads an entry.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            structure.BrainImage: The image or None if the entry does not exist or is evicted while it is loaded.
+        """
+        entry_dir = os.path.join(self.directory, key)
+        meta_path = os.path.join(entry_dir, META_FILE_NAME)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # the entry may be evicted by another process while it is read, which is a miss
+        try:
+            img = self._read_entry(entry_dir, meta)
+            os.utime(meta_path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return img
+
+    @staticmethod
+    def _read_entry(entry_dir: str, meta: dict) -> structure.BrainImage:
+        """Reads the image of an entry.
+
+        Raises:
+            FileNotFoundError: If a file of the entry does not exist (anymore).
+        """
+        images = {}
+        for name, properties in meta['images'].items():
+            image = sitk.GetImageFromArray(np.load(os.path.join(entry_dir, name + '.npy')),
+                                           isVector=properties['is_vector'])
+            image.SetOrigin(properties['origin'])
+            image.SetSpacing(properties['spacing'])
+            image.SetDirection(properties['direction'])
+            images[structure.BrainImageTypes[name]] = image
+
+        transform_path = os.path.join(entry_dir, TRANSFORM_FILE_NAME)
+        transform = None
+        if os.path.exists(transform_path):
+            try:
+                transform = sitk.ReadTransform(transform_path)
+            except RuntimeError:
+                if os.path.exists(transform_path):
+                    raise
+                raise FileNotFoundError(transform_path)
+
+        img = structure.BrainImage(meta['id'], meta['path'], images, transform)
+        img.image_properties = conversion.ImageProperties(images[structure.BrainImageTypes.T1w])
+        if meta['feature_matrix']:
+            img.feature_matrix = (np.load(os.path.join(entry_dir, 'features.npy')),
+                                  np.load(os.path.join(entry_dir, 'labels.npy')))
+        if meta['feature_indices']:
+            img.feature_indices = np.load(os.path.join(entry_dir, 'feature_indices.npy'))
+        return img
+
+    def store(self, key: str, img: structure.BrainImage):
+        """Stores an entry and evicts the least recently used entries if the cache exceeds its maximum size.
+
+        Args:
+            key (str): The key.
+            img (structure.BrainImage): The pre-processed image.
+        """
+        # write into a temporary directory and rename it, such that concurrent readers never see partial entries
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            meta = {'id': img.id_, 'path': img.path, 'images': {}, 'created': time.time(),
+                    'feature_matrix': img.feature_matrix is not None,
+                    'feature_indices': img.feature_indices is not None}
+            for image_type, image in img.images.items():
+                np.save(os.path.join(tmp_dir, image_type.name + '.npy'), sitk.GetArrayViewFromImage(image))
+                meta['images'][image_type.name] = {'origin': image.GetOrigin(), 'spacing': image.GetSpacing(),
+                                                   'direction': image.GetDirection(),
+                                                   'is_vector': image.GetNumberOfComponentsPerPixel() > 1}
+            if img.transformation is not None:
+                sitk.WriteTransform(img.transformation, os.path.join(tmp_dir, TRANSFORM_FILE_NAME))
+            if img.feature_matrix is not None:
+                np.save(os.path.join(tmp_dir, 'features.npy'), img.feature_matrix[0])
+                np.save(os.path.join(tmp_dir, 'labels.npy'), img.feature_matrix[1])
+            if img.feature_indices is not None:
+                np.save(os.path.join(tmp_dir, 'feature_indices.npy'), img.feature_indices)
+            with open(os.path.join(tmp_dir, META_FILE_NAME), 'w') as f:
+                json.dump(meta, f, indent=2)
+
+            os.rename(tmp_dir, os.path.join(self.directory, key))
+        except OSError:
+            # e.g. another process stored the same entry in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(os.path.join(self.directory, key)):
+                raise
+
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def entries(self) -> t.List[dict]:
+        """Gets the entries ordered from the least to the most recently used.
+
+        Returns:
+            list of dict: The key, image identifier, size in bytes, and time of the last use of the entries.
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            entry_dir = os.path.join(self.directory, key)
+            meta_path = os.path.join(entry_dir, META_FILE_NAME)
+            if key.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            try:
+                with open(meta_path, 'r') as f:
+                    id_ = json.load(f)['id']
+                size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                last_used = os.stat(meta_path).st_mtime
+            except (OSError, ValueError):
+                continue  # evicted in the meantime
+            entries.append({'key': key, 'id': id_, 'size': size, 'last_used': last_used})
+        return sorted(entries, key=lambda entry: entry['last_used'])
+
+    def size(self) -> int:
+        """Gets the size of the cache.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return sum(entry['size'] for entry in self.entries())
+
+    def evict(self, max_size: int) -> t.List[dict]:
+        """Removes the least recently used entries until the cache does not exceed a size.
+
+        Args:
+            max_size (int): The maximum size in bytes.
+
+        Returns:
+            list of dict: The removed entries (see :meth:`entries`).
+        """
+        entries = self.entries()
+        size = sum(entry['size'] for entry in entries)
+        removed = []
+        for entry in entries:
+            if size <= max_size:
+                break
+            self.remove(entry['key'])
+            size -= entry['size']
+            removed.append(entry)
+        return removed
+
+    def remove(self, key: str):
+        """Removes an entry.
+
+        Args:
+            key (str): The key.
+        """
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def clear(self):
+        """Removes all entries, including left-over temporary directories."""
+        for key in os.listdir(self.directory):
+            if os.path.isdir(os.path.join(self.directory, key)):
+                self.remove(key)
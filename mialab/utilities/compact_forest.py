@@ -0,0 +1,306 @@
+"""The compact forest module holds a random forest flattened into contiguous arrays.
+
+A scikit-learn forest consists of an estimator object per tree, each with its own node and value arrays of 64 bytes
+and 8 bytes per class per node. The :class:`CompactForest` concatenates the nodes of all trees into one int32 array of
+16 bytes per node and stores the class probabilities of the leaves only, optionally quantized to 8 or 16 bits. It is
+saved as a directory of ``.npy`` files, which are memory-mapped when loaded, such that worker processes share the
+pages of the model instead of unpickling it.
+"""
+import json
+import os
+
+import numpy as np
+
+NODES_FILE_NAME = 'nodes.npy'
+PROBABILITIES_FILE_NAME = 'probabilities.npy'
+INDEX_FILE_NAME = 'index.json'
+
+QUANTIZATION_TYPES = {8: np.uint8, 16: np.uint16}
+
+# the fields of a node, and the values of the leaf field of split nodes giving the direction of missing values
+FEATURE, THRESHOLD, CHILD, LEAF = range(4)
+MISSING_LEFT, MISSING_RIGHT = -1, -2
+
+
+class CompactForest:
+    """Represents a random forest classifier as contiguous arrays of the nodes of all trees.
+
+    The nodes of each tree are in breadth-first order, such that the two children of a node are adjacent. A node is a
+    row of four int32 fields in ``nodes``:
+
+    - ``FEATURE``: The feature index of the split.
+    - ``THRESHOLD``: The bits of the float32 threshold of the split. The voxels go to the left child if the feature is
+      lower or equal to the threshold and to the right child otherwise.
+    - ``CHILD``: The index of the left child, the right child is the next node.
+    - ``LEAF``: The row of the class probabilities in ``probabilities`` for a leaf, and ``MISSING_LEFT`` or
+      ``MISSING_RIGHT`` for a split node, i.e. the child of the voxels with a missing (NaN) feature as in scikit-learn.
+
+    A leaf has an infinite threshold and itself as left child, such that the voxels in a leaf stay there. The float64
+    thresholds of scikit-learn are rounded down to the next float32, which keeps the splits of float32 features exact.
+
+    The prediction traverses the trees one after the other for blocks of voxels, i.e. it advances all voxels of a
+    block by one tree level at once. The node of a voxel is read as one 16 byte record, and the voxels in leaves are
+    only removed from the block if this saves more than it costs. The prediction averages the leaf probabilities of the
+    trees, as ``predict_proba`` of scikit-learn. It remains slower than the compiled traversal of scikit-learn
+    (see ``benchmark.py prediction``).
+
+    Examples:
+        >>> compact = CompactForest.from_forest(forest, quantization=8)
+        >>> compact.save('/tmp/forest')
+        >>> compact = CompactForest.load('/tmp/forest')  # memory-mapped
+        >>> probabilities = compact.predict_proba(img.feature_matrix[0])
+    """
+
+    def __init__(self, nodes: np.ndarray, probabilities: np.ndarray, roots: np.ndarray, depths: np.ndarray,
+                 classes: np.ndarray, no_features: int, quantization: int = None, block_size: int = 16384):
+        """Initializes a new instance of the CompactForest class.
+
+        Args:
+            nodes (np.ndarray): The int32 nodes of shape (number of nodes, 4).
+            probabilities (np.ndarray): The class probabilities of the leaves of shape (number of leaves, number of
+                classes), float32 or, if quantized, unsigned integers of ``quantization`` bits.
+            roots (np.ndarray): The int32 index of the root node of each tree.
+            depths (np.ndarray): The int32 depth of each tree.
+            classes (np.ndarray): The class labels.
+            no_features (int): The number of features.
+            quantization (int): The number of bits of the quantized probabilities, None if not quantized.
+            block_size (int): The number of voxels traversed at once, which keeps them in the processor cache.
+        """
+        self.nodes = nodes
+        self.probabilities = probabilities
+        self.roots = roots
+        self.depths = depths
+        self.classes_ = classes
+        self.n_features_in_ = no_features
+        self.quantization = quantization
+        self.block_size = block_size
+
+    @classmethod
+    def from_forest(cls, forest, quantization: int = None) -> 'CompactForest':
+        """Flattens a trained random forest classifier.
+
+        Args:
+            forest (sklearn.ensemble.RandomForestClassifier): The forest with a single output.
+            quantization (int): The number of bits (8 or 16) to quantize the leaf probabilities to, which bounds
+                their error by half a quantization step. None stores float32 probabilities.
+
+        Returns:
+            CompactForest: The compact forest.
+
+        Raises:
+            ValueError: If the forest has multiple outputs or the quantization is not supported.
+        """
+        if quantization is not None and quantization not in QUANTIZATION_TYPES:
+            raise ValueError('quantization must be one of {}'.format(tuple(QUANTIZATION_TYPES)))
+        if getattr(forest, 'n_outputs_', 1) != 1:
+            raise ValueError('only forests with a single output are supported')
+
+        nodes, probabilities, roots, depths = [], [], [], []
+        no_nodes = no_leaves = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            order = _breadth_first_order(tree.children_left, tree.children_right)
+            position = np.empty_like(order)
+            position[order] = np.arange(order.size)
+
+            is_leaf = tree.children_left[order] == -1
+            leaf_rows = no_leaves + np.cumsum(is_leaf) - 1
+            # scikit-learn sends missing values to the child with more samples if there were none in the training
+            missing_go_to_left = getattr(tree, 'missing_go_to_left', np.ones(tree.node_count, np.uint8))[order]
+
+            tree_nodes = np.empty((order.size, 4), np.int32)
+            tree_nodes[:, FEATURE] = np.where(is_leaf, 0, tree.feature[order])
+            tree_nodes[:, THRESHOLD] = np.where(is_leaf, np.float32(np.inf),
+                                                _round_down_to_float32(tree.threshold[order])).view(np.int32)
+            tree_nodes[:, CHILD] = no_nodes + np.where(is_leaf, np.arange(order.size),
+                                                       position[np.maximum(tree.children_left[order], 0)])
+            tree_nodes[:, LEAF] = np.where(is_leaf, leaf_rows,
+                                           np.where(missing_go_to_left, MISSING_LEFT, MISSING_RIGHT))
+            nodes.append(tree_nodes)
+
+            value = tree.value[order[is_leaf], 0, :]  # class counts or fractions, depending on the scikit-learn version
+            probabilities.append(value / value.sum(axis=1, keepdims=True))
+            roots.append(no_nodes)
+            depths.append(tree.max_depth)
+
+            no_nodes += order.size
+            no_leaves += int(is_leaf.sum())
+
+        probabilities = np.concatenate(probabilities)
+        if quantization is None:
+            probabilities = probabilities.astype(np.float32)
+        else:
+            probabilities = np.rint(probabilities * _max_level(quantization)).astype(QUANTIZATION_TYPES[quantization])
+
+        return cls(np.concatenate(nodes), probabilities, np.array(roots, np.int32), np.array(depths, np.int32),
+                   np.asarray(forest.classes_), forest.n_features_in_, quantization)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: str = 'r') -> 'CompactForest':
+        """Loads a saved compact forest.
+
+        Args:
+            directory (str): The directory of the forest (see :meth:`save`).
+            mmap_mode (str): The memory-map mode of the arrays (see :func:`numpy.load`). None reads them into memory.
+
+        Returns:
+            CompactForest: The compact forest.
+        """
+        with open(os.path.join(directory, INDEX_FILE_NAME), 'r') as f:
+            index = json.load(f)
+
+        def load_array(file_name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, file_name), mmap_mode=mmap_mode)
+
+        return cls(load_array(NODES_FILE_NAME), load_array(PROBABILITIES_FILE_NAME), np.array(index['roots'], np.int32),
+                   np.array(index['depths'], np.int32), np.array(index['classes']), index['no_features'],
+                   index['quantization'])
+
+    def save(self, directory: str):
+        """Saves the forest as ``.npy`` files and an index.
+
+        Args:
+            directory (str): The directory for the files. Existing files of a forest are overwritten.
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, NODES_FILE_NAME), self.nodes)
+        np.save(os.path.join(directory, PROBABILITIES_FILE_NAME), self.probabilities)
+        with open(os.path.join(directory, INDEX_FILE_NAME), 'w') as f:
+            json.dump({'roots': self.roots.tolist(), 'depths': self.depths.tolist(), 'classes': self.classes_.tolist(),
+                       'no_features': self.n_features_in_, 'quantization': self.quantization}, f)
+
+    @property
+    def n_estimators(self) -> int:
+        """int: The number of trees."""
+        return len(self.roots)
+
+    @property
+    def nbytes(self) -> int:
+        """int: The size of the arrays in bytes."""
+        return sum(array.nbytes for array in (self.nodes, self.probabilities, self.roots, self.depths))
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """Predicts the class probabilities.
+
+        Missing (NaN) features go to the child of the split as in scikit-learn.
+
+        Args:
+            features (np.ndarray): The features of shape (n, number of features).
+
+        Returns:
+            np.ndarray: The float32 probabilities of shape (n, number of classes), i.e. the mean of the trees.
+
+        Raises:
+            ValueError: If the number of features does not match.
+        """
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        if features.ndim != 2 or features.shape[1] != self.n_features_in_:
+            raise ValueError('features must be of shape (n, {})'.format(self.n_features_in_))
+
+        probabilities = np.zeros((features.shape[0], len(self.classes_)), np.float32)
+        records = np.ascontiguousarray(self.nodes).view(np.complex128).reshape(-1)  # a node as one 16 byte element
+        for start in range(0, features.shape[0], self.block_size):
+            block = features[start:start + self.block_size]
+            has_missing = bool(np.isnan(block).any())
+            for root, depth in zip(self.roots, self.depths):
+                probabilities[start:start + len(block)] += self.probabilities.take(
+                    _leaf_rows(records, block, root, depth, has_missing), axis=0)
+
+        scale = self.n_estimators
+        if self.quantization is not None:
+            scale *= _max_level(self.quantization)
+        probabilities /= scale
+        return probabilities
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Predicts the classes.
+
+        Args:
+            features (np.ndarray): The features of shape (n, number of features).
+
+        Returns:
+            np.ndarray: The classes of shape (n,), i.e. the classes with the highest probability.
+        """
+        return self.classes_.take(np.argmax(self.predict_proba(features), axis=1))
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        return 'CompactForest:\n' \
+               ' trees:        {trees}\n' \
+               ' nodes:        {nodes}\n' \
+               ' leaves:       {leaves}\n' \
+               ' quantization: {quantization}\n' \
+               ' size:         {size:.1f} MB\n' \
+            .format(trees=self.n_estimators, nodes=len(self.nodes), leaves=len(self.probabilities),
+                    quantization='{} bit'.format(self.quantization) if self.quantization else 'none',
+                    size=self.nbytes / 2 ** 20)
+
+
+# removing the voxels in leaves from a block costs about as much as this number of levels of their traversal, and is
+# considered every this number of levels only, since finding them costs about a fourth of a level
+_COMPACTION_COST = 3
+_COMPACTION_INTERVAL = 3
+
+
+def _leaf_rows(records: np.ndarray, features: np.ndarray, root: int, depth: int, has_missing: bool) -> np.ndarray:
+    """Gets the rows of the probabilities of the leaves of a tree reached by the rows of the features."""
+    flat_features = features.reshape(-1)
+    offsets = np.arange(features.shape[0], dtype=np.int32) * features.shape[1]  # of the rows not yet removed
+    positions = None  # of the rows not yet removed, None if none are removed
+    leaf_rows = np.empty(features.shape[0], np.int32)
+
+    nodes = np.full(features.shape[0], root, np.int32)
+    for level in range(depth):
+        node = records.take(nodes).view(np.int32).reshape(-1, 4)
+        remaining_levels = depth - level
+        if remaining_levels > _COMPACTION_COST and level % _COMPACTION_INTERVAL == _COMPACTION_INTERVAL - 1:
+            in_leaf = node[:, LEAF] >= 0
+            no_in_leaf = np.count_nonzero(in_leaf)
+            if no_in_leaf * remaining_levels > _COMPACTION_COST * nodes.size:
+                if positions is None:
+                    positions = np.arange(features.shape[0], dtype=np.int32)
+                leaf_rows[np.compress(in_leaf, positions)] = np.compress(in_leaf, node[:, LEAF])
+                not_in_leaf = ~in_leaf
+                positions = np.compress(not_in_leaf, positions)
+                offsets = np.compress(not_in_leaf, offsets)
+                node = np.compress(not_in_leaf, node, axis=0)
+                if positions.size == 0:
+                    return leaf_rows
+
+        values = flat_features.take(offsets + node[:, FEATURE])
+        go_right = values > node[:, THRESHOLD].view(np.float32)
+        if has_missing:
+            go_right = np.where(np.isnan(values), node[:, LEAF] == MISSING_RIGHT, go_right)
+        nodes = node[:, CHILD] + go_right
+
+    node_leaf_rows = records.take(nodes).view(np.int32).reshape(-1, 4)[:, LEAF]
+    if positions is None:
+        return node_leaf_rows
+    leaf_rows[positions] = node_leaf_rows
+    return leaf_rows
+
+
+def _breadth_first_order(children_left: np.ndarray, children_right: np.ndarray) -> np.ndarray:
+    """Gets the nodes of a scikit-learn tree in breadth-first order, where the children of a node are adjacent."""
+    levels = [np.zeros(1, np.int64)]
+    while levels[-1].size > 0:
+        split_nodes = levels[-1][children_left[levels[-1]] != -1]
+        levels.append(np.stack([children_left[split_nodes], children_right[split_nodes]], axis=1).reshape(-1))
+    return np.concatenate(levels)
+
+
+def _round_down_to_float32(values: np.ndarray) -> np.ndarray:
+    """Rounds float64 values down to the next float32, such that ``x <= value`` equals ``x <= rounded`` for all float32
+    values x."""
+    rounded = values.astype(np.float32)
+    too_large = rounded.astype(np.float64) > values
+    rounded[too_large] = np.nextafter(rounded[too_large], np.float32(-np.inf))
+    return rounded
+
+
+def _max_level(quantization: int) -> int:
+    return 2 ** quantization - 1
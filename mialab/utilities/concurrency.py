@@ -0,0 +1,406 @@
+"""The concurrency module holds a memory-aware planner of the number of worker processes and the execution policy.
+
+The peak memory of the pre-processing of a subject is estimated from the image headers, which are read without the
+voxels, and the enabled features. The planner chooses the largest number of worker processes whose concurrent peak
+memory fits into a memory budget, and orders the subjects largest-first, such that the small subjects fill the gaps at
+the end (longest processing time first).
+
+The execution policy divides the CPUs among the workers, such that the threads of SimpleITK, BLAS, and OpenMP of all
+workers together match the allocated CPUs instead of oversubscribing them.
+"""
+import functools
+import os
+import typing as t
+
+import SimpleITK as sitk
+import threadpoolctl
+
+import mialab.data.structure as structure
+import mialab.utilities.multi_processor as mproc
+import mialab.utilities.pipeline_utilities as putil
+
+THREAD_ENVIRONMENT_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+"""tuple of str: The environment variables limiting the threads of the native libraries in child processes."""
+
+PROCESS_OVERHEAD = 300 * 2 ** 20
+"""int: The memory of a worker process without images, i.e. the interpreter and the imported modules, in bytes."""
+
+WORKING_VOLUMES = 6
+"""int: The number of float32 volumes of the processed grid used by the pre-processing besides the input images and
+the features, i.e. the pre-processed images and temporaries. Measured with the features of ``bin/main.py``."""
+
+SPARSE_BYTES_PER_FEATURE = 20
+"""int: The bytes per feature of a sparse feature matrix row during its assembly, i.e. the columns, their
+concatenation, and the float32 result."""
+
+BRAIN_MASK_FRACTION = 0.25
+"""float: The assumed fraction of voxels inside the brain mask for ``brain_mask_inference``, which cannot be read from
+the header. The brain covers about 18 % of the voxels of the MNI-sized 1 mm grid."""
+
+TRAINING_FRACTION = 0.01
+"""float: The assumed upper bound of the fraction of training voxels (see ``FeatureExtractor._get_training_indices``).
+"""
+
+
+class ImageInformation:
+    """Represents the header information of an image file."""
+
+    def __init__(self, path: str):
+        """Initializes a new instance of the ImageInformation class by reading the header of an image file.
+
+        Args:
+            path (str): The path to the image file.
+        """
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(path)
+        reader.ReadImageInformation()  # reads the header only
+
+        self.path = path
+        self.size = reader.GetSize()
+        self.number_of_components = reader.GetNumberOfComponents()
+        self.component_size = _get_component_size(reader.GetPixelID())
+
+    @property
+    def number_of_voxels(self) -> int:
+        """int: The number of voxels."""
+        n = 1
+        for s in self.size:
+            n *= s
+        return n
+
+    @property
+    def nbytes(self) -> int:
+        """int: The size of the voxels in memory in bytes."""
+        return self.number_of_voxels * self.number_of_components * self.component_size
+
+
+@functools.lru_cache(maxsize=None)
+def _get_component_size(pixel_id: int) -> int:
+    """Gets the size of a pixel component of a SimpleITK pixel type in bytes."""
+    return sitk.GetArrayViewFromImage(sitk.Image([1, 1, 1], pixel_id)).itemsize
+
+
+def estimate_peak_memory(paths: dict, model_size: int = 0, no_classes: int = 0, chunk_size: int = 65536,
+                         **kwargs) -> int:
+    """Estimates the peak memory of the pre-processing of a subject (see :func:`pipeline_utilities.pre_process`) and,
+    if ``no_classes`` is given, of its prediction (see :func:`pipeline_utilities.predict`).
+
+    The model is counted in full, although the workers inherit it copy-on-write, since the pages it touches, e.g. the
+    reference counts of the Python objects of a forest, are copied.
+
+    Args:
+        paths (dict): A dict, where the keys are an image identifier of type structure.BrainImageTypes
+            and the values are paths to the images.
+        model_size (int): The size of the model in bytes, e.g. the size of its joblib file as a proxy.
+        no_classes (int): The number of classes of the prediction. 0 for no prediction.
+        chunk_size (int): The number of rows per chunk of the prediction (see
+            :class:`PredictionEngine <mialab.utilities.prediction.PredictionEngine>`).
+        kwargs: The pre-processing parameters.
+
+    Returns:
+        int: The estimated peak memory of a worker process in bytes, including :const:`PROCESS_OVERHEAD`.
+    """
+    images = [ImageInformation(path) for key, path in paths.items()
+              if isinstance(key, structure.BrainImageTypes) and key != structure.BrainImageTypes.RegistrationTransform]
+
+    # the images are processed on the atlas grid after the registration
+    native_voxels = max(image.number_of_voxels for image in images)
+    voxels = native_voxels
+    if kwargs.get('registration_pre', False) and putil.atlas_t1.GetNumberOfPixels() > 1:
+        voxels = max(voxels, putil.atlas_t1.GetNumberOfPixels())
+    input_bytes = sum(image.nbytes for image in images) * voxels // native_voxels
+
+    # the feature extractor does not need an image to count the features
+    feature_extractor = putil.FeatureExtractor(None, **kwargs)
+    no_features = feature_extractor.get_number_of_features()
+
+    training = kwargs.get('training', True)
+    sparse = (training and kwargs.get('sparse_training', False)) or \
+             (not training and kwargs.get('brain_mask_inference', False))
+    if training:
+        no_rows = int(voxels * TRAINING_FRACTION)
+    elif sparse:
+        no_rows = int(voxels * BRAIN_MASK_FRACTION)
+    else:
+        no_rows = voxels
+
+    if sparse:
+        feature_bytes = no_rows * no_features * SPARSE_BYTES_PER_FEATURE
+    else:
+        # the feature images, except the intensity images, which are the images, and the feature matrix
+        no_feature_images = no_features - (2 if kwargs.get('intensity_feature', False) else 0)
+        feature_bytes = voxels * no_feature_images * 4 + no_rows * no_features * 4
+
+    prediction_bytes = 0
+    if no_classes > 0:
+        # the float64 probabilities and temporaries of a chunk, the float32 probabilities and uint8 labels of the rows,
+        # and their images
+        prediction_bytes = model_size + min(chunk_size, no_rows) * no_classes * 16 + \
+            (no_rows + voxels) * (no_classes * 4 + 1)
+
+    return PROCESS_OVERHEAD + input_bytes + WORKING_VOLUMES * voxels * 4 + feature_bytes + no_rows * 2 + \
+        prediction_bytes
+
+
+def get_memory_budget() -> int:
+    """Gets the default memory budget, i.e. the memory allocated to a SLURM job or 80 % of the physical memory.
+
+    Returns:
+        int: The memory budget in bytes.
+    """
+    if 'SLURM_MEM_PER_NODE' in os.environ:
+        return int(os.environ['SLURM_MEM_PER_NODE']) * 2 ** 20
+    if 'SLURM_MEM_PER_CPU' in os.environ and 'SLURM_CPUS_PER_TASK' in os.environ:
+        return int(os.environ['SLURM_MEM_PER_CPU']) * int(os.environ['SLURM_CPUS_PER_TASK']) * 2 ** 20
+    return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * 0.8)
+
+
+def get_number_of_cpus() -> int:
+    """Gets the number of CPUs available to the process, e.g. the CPUs allocated to a SLURM job.
+
+    Returns:
+        int: The number of CPUs.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class ConcurrencyPlan:
+    """Represents the number of worker processes and the order of the subjects of a batch."""
+
+    def __init__(self, n_workers: int, order: t.List[str], estimates: t.Dict[str, int], memory_budget: int):
+        """Initializes a new instance of the ConcurrencyPlan class.
+
+        Args:
+            n_workers (int): The number of worker processes.
+            order (list of str): The subject identifiers in the order of processing, i.e. largest-first.
+            estimates (dict): The estimated peak memory in bytes per subject identifier.
+            memory_budget (int): The memory budget in bytes.
+        """
+        self.n_workers = n_workers
+        self.order = order
+        self.estimates = estimates
+        self.memory_budget = memory_budget
+
+    @property
+    def peak_memory(self) -> int:
+        """int: The estimated peak memory of the worker processes in bytes, i.e. of the largest subjects running
+        concurrently."""
+        return sum(self.estimates[id_] for id_ in self.order[:self.n_workers])
+
+    def ordered(self, data_batch: dict) -> dict:
+        """Gets a batch in the planned order.
+
+        Args:
+            data_batch (dict): The batch, where the keys are the subject identifiers.
+
+        Returns:
+            dict: The batch in the planned order.
+        """
+        return {id_: data_batch[id_] for id_ in self.order}
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        return 'ConcurrencyPlan:\n' \
+               ' workers:       {self.n_workers}\n' \
+               ' subjects:      {subjects}\n' \
+               ' peak memory:   {peak:.0f} MB\n' \
+               ' memory budget: {budget:.0f} MB\n' \
+            .format(self=self, subjects=len(self.order), peak=self.peak_memory / 2 ** 20,
+                    budget=self.memory_budget / 2 ** 20)
+
+
+def plan(data_batch: dict, pre_process_params: dict = None, memory_budget: int = None, max_workers: int = None,
+         reserved_memory: int = PROCESS_OVERHEAD, model_size: int = 0, no_classes: int = 0) -> ConcurrencyPlan:
+    """Plans the pre-processing of a batch of subjects.
+
+    The number of worker processes is the largest number, for which the largest subjects running concurrently fit into
+    the memory budget, but at least one.
+
+    Args:
+        data_batch (dict): The batch, where the keys are the subject identifiers and the values the paths
+            (see :func:`pipeline_utilities.pre_process_batch`).
+        pre_process_params (dict): The pre-processing parameters.
+        memory_budget (int): The memory budget in bytes. None for :func:`get_memory_budget`.
+        max_workers (int): The maximum number of worker processes. None for :func:`get_number_of_cpus`.
+        reserved_memory (int): The memory reserved for the main process in bytes.
+        model_size (int): The size of the model in bytes for a prediction (see :func:`estimate_peak_memory`).
+        no_classes (int): The number of classes of the prediction. 0 for the pre-processing only.
+
+    Returns:
+        ConcurrencyPlan: The plan.
+    """
+    if pre_process_params is None:
+        pre_process_params = {}
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+    if max_workers is None:
+        max_workers = get_number_of_cpus()
+
+    estimates = {id_: estimate_peak_memory(paths, model_size, no_classes, **pre_process_params)
+                 for id_, paths in data_batch.items()}
+    order = sorted(estimates, key=lambda id_: estimates[id_], reverse=True)
+
+    n_workers = 1
+    while n_workers < min(max_workers, len(order)) and \
+            sum(estimates[id_] for id_ in order[:n_workers + 1]) <= memory_budget - reserved_memory:
+        n_workers += 1
+
+    return ConcurrencyPlan(n_workers, order, estimates, memory_budget)
+
+
+def set_number_of_threads(n_threads: int):
+    """Sets the number of threads of SimpleITK, BLAS, and OpenMP in the calling process and its future child processes.
+
+    Args:
+        n_threads (int): The number of threads.
+    """
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(n_threads)
+    threadpoolctl.threadpool_limits(n_threads)  # the libraries are already loaded, thus, the variables have no effect
+    for variable in THREAD_ENVIRONMENT_VARIABLES:
+        os.environ[variable] = str(n_threads)
+
+
+class ThreadLimits:
+    """Represents limits of the threads of SimpleITK, BLAS, and OpenMP in the calling process, which are restored when
+    leaving the context or by :meth:`restore`.
+
+    Unlike :func:`set_number_of_threads`, the limits do not outlast their use, e.g. by the thread backend.
+
+    Examples:
+        >>> with ThreadLimits(2):
+        >>>     image = sitk.SmoothingRecursiveGaussian(image, 2)
+    """
+
+    def __init__(self, n_threads: int):
+        """Initializes a new instance of the ThreadLimits class, which limits the threads.
+
+        Args:
+            n_threads (int): The number of threads.
+        """
+        self.n_threads = n_threads
+        self._sitk_threads = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+        self._environment = {variable: os.environ.get(variable) for variable in THREAD_ENVIRONMENT_VARIABLES}
+        self._limits = threadpoolctl.threadpool_limits(n_threads)
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(n_threads)
+        for variable in THREAD_ENVIRONMENT_VARIABLES:
+            os.environ[variable] = str(n_threads)
+
+    def restore(self):
+        """Restores the limits before the initialization, once."""
+        if self._limits is None:
+            return
+        self._limits.restore_original_limits()
+        self._limits = None
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(self._sitk_threads)
+        for variable, value in self._environment.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.restore()
+
+
+class _ThreadLimitedWorkerPool(mproc.WorkerPool):
+    """Represents a pool of worker threads, which limits the threads of the calling process until it is closed."""
+
+    def __init__(self, n_threads: int, processes: int, initializer: callable = None, initargs: tuple = ()):
+        super().__init__(processes, initializer, initargs, backend='thread')
+        # the thread limits are process-wide and set once for all threads
+        self.limits = ThreadLimits(n_threads)
+
+    def close(self):
+        super().close()
+        self.limits.restore()
+
+    def terminate(self):
+        super().terminate()
+        self.limits.restore()
+
+
+def _initialize_worker(n_threads: int, initializer: callable = None, initargs: tuple = ()):
+    """Initializes a worker of an :class:`ExecutionPolicy` (see :meth:`ExecutionPolicy.worker_pool`)."""
+    set_number_of_threads(n_threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class ExecutionPolicy:
+    """Represents the division of the allocated CPUs among parallel workers.
+
+    Each of the ``n_workers`` workers gets ``threads_per_worker`` CPUs, which are divided among ``stage_threads``
+    stages of a subject running in parallel (the ``n_threads`` of :func:`pre_process
+    <mialab.utilities.pipeline_utilities.pre_process>`) and ``filter_threads`` threads of SimpleITK, BLAS, and OpenMP
+    per stage, such that the workers do not run more threads than CPUs. With the ``'process'`` backend, the workers
+    are processes, which scale for Python code but pickle the images (see :mod:`mialab.utilities.multi_processor`).
+    With the ``'thread'`` backend, the workers are threads of the main process, which share the images, but run Python
+    code in turn, and the SimpleITK threads are a process-wide setting, which is restored when the pool is closed.
+
+    Examples:
+        >>> policy = ExecutionPolicy('process', n_workers=4)
+        >>> params['n_threads'] = policy.stage_threads
+        >>> with policy.worker_pool(putil.load_atlas_images, (data_atlas_dir,)) as pool:
+        >>>     images = putil.pre_process_batch(data, params, pool=pool)
+        >>> forest = sk_ensemble.RandomForestClassifier(n_jobs=policy.n_cpus)
+    """
+
+    def __init__(self, backend: str = 'process', n_workers: int = None, n_cpus: int = None, stage_threads: int = 1):
+        """Initializes a new instance of the ExecutionPolicy class.
+
+        Args:
+            backend (str): The backend of the workers, i.e. ``'process'`` or ``'thread'``.
+            n_workers (int): The number of workers. None for one worker per CPU.
+            n_cpus (int): The number of allocated CPUs. None for :func:`get_number_of_cpus`.
+            stage_threads (int): The number of stages of a worker running in parallel, at most ``threads_per_worker``.
+
+        Raises:
+            ValueError: If the backend is unknown.
+        """
+        if backend not in mproc.WorkerPool.BACKENDS:
+            raise ValueError('backend must be one of {}'.format(mproc.WorkerPool.BACKENDS))
+        self.backend = backend
+        self.n_cpus = n_cpus if n_cpus is not None else get_number_of_cpus()
+        self.n_workers = max(1, n_workers if n_workers is not None else self.n_cpus)
+        self.threads_per_worker = max(1, self.n_cpus // self.n_workers)
+        self.stage_threads = max(1, min(stage_threads, self.threads_per_worker))
+        self.filter_threads = max(1, self.threads_per_worker // self.stage_threads)
+
+    def worker_pool(self, initializer: callable = None, initargs: tuple = ()) -> mproc.WorkerPool:
+        """Gets a worker pool, whose workers limit the threads of SimpleITK, BLAS, and OpenMP to ``filter_threads``.
+
+        Args:
+            initializer (callable): The function called once in each worker after limiting the threads.
+            initargs (tuple): The arguments of the initializer.
+
+        Returns:
+            mproc.WorkerPool: The worker pool.
+        """
+        if self.backend == 'thread':
+            return _ThreadLimitedWorkerPool(self.filter_threads, self.n_workers, initializer, initargs)
+        return mproc.WorkerPool(self.n_workers, functools.partial(_initialize_worker, self.filter_threads),
+                                (initializer, initargs))
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        return 'ExecutionPolicy:\n' \
+               ' backend:            {self.backend}\n' \
+               ' CPUs:               {self.n_cpus}\n' \
+               ' workers:            {self.n_workers}\n' \
+               ' threads per worker: {self.threads_per_worker}\n' \
+               ' stage threads:      {self.stage_threads}\n' \
+               ' filter threads:     {self.filter_threads}\n' \
+            .format(self=self)
@@ -0,0 +1,199 @@
+"""The feature store module holds a store of the feature matrices of many subjects on disk.
+
+The rows of the subjects are appended to ``.npy`` files, which are memory-mapped after finalization, such that the
+training data does not need to be concatenated in memory.
+"""
+import json
+import os
+import struct
+import typing as t
+
+import numpy as np
+
+FEATURES_FILE_NAME = 'features.npy'
+LABELS_FILE_NAME = 'labels.npy'
+INDEX_FILE_NAME = 'index.json'
+
+_HEADER_SIZE = 128  # the fixed size of the .npy headers, such that they can be rewritten after appending the rows
+
+
+def _npy_header(shape: tuple, dtype) -> bytes:
+    """Gets a .npy (version 1.0) header padded to a fixed size.
+
+    Args:
+        shape (tuple): The shape of the array.
+        dtype (np.dtype): The data type of the array.
+
+    Returns:
+        bytes: The header.
+    """
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False,
+                   'shape': tuple(shape)})
+    header = header.ljust(_HEADER_SIZE - 10 - 1) + '\n'  # 10 bytes magic, version, and header length
+    if len(header) != _HEADER_SIZE - 10:
+        raise ValueError('shape {} is too large for the header'.format(shape))
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class FeatureStore:
+    """Represents a store of the feature matrices of subjects.
+
+    The features (float32) and labels (int16) of each appended subject are written to the end of two ``.npy`` files,
+    and the rows of each subject are recorded in an index. :meth:`finalize` writes the final shapes into the headers,
+    after which :attr:`data` and :attr:`labels` are memory-mapped views of all rows.
+
+    Examples:
+        >>> with FeatureStore('/tmp/features') as store:
+        >>>     for img in images:
+        >>>         store.append(img.id_, *img.feature_matrix)
+        >>> forest.fit(store.data, store.labels)
+    """
+
+    def __init__(self, directory: str):
+        """Initializes a new, empty instance of the FeatureStore class.
+
+        Args:
+            directory (str): The directory for the files. Existing files of a store are overwritten.
+        """
+        self.directory = directory
+        self.no_rows = 0
+        self.no_features = None
+        self.offsets = {}  # the rows (start, stop) per subject identifier
+        self._data = None
+        self._labels = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._features_file = open(os.path.join(directory, FEATURES_FILE_NAME), 'wb')
+        self._labels_file = open(os.path.join(directory, LABELS_FILE_NAME), 'wb')
+        self._write_headers()
+
+    @classmethod
+    def open(cls, directory: str) -> 'FeatureStore':
+        """Opens a finalized store.
+
+        Args:
+            directory (str): The directory of the store.
+
+        Returns:
+            FeatureStore: The store.
+        """
+        store = cls.__new__(cls)
+        store.directory = directory
+        with open(os.path.join(directory, INDEX_FILE_NAME), 'r') as f:
+            index = json.load(f)
+        store.no_rows = index['no_rows']
+        store.no_features = index['no_features']
+        store.offsets = {id_: tuple(rows) for id_, rows in index['offsets'].items()}
+        store._features_file = store._labels_file = None
+        store._load()
+        return store
+
+    def append(self, id_: str, features: np.ndarray, labels: np.ndarray):
+        """Appends the feature matrix of a subject.
+
+        Args:
+            id_ (str): The subject identifier.
+            features (np.ndarray): The features of shape (n, number of features).
+            labels (np.ndarray): The labels of shape (n,) or (n, 1).
+
+        Raises:
+            ValueError: If the store is finalized, the subject exists, or the shapes do not match.
+        """
+        if self._features_file is None:
+            raise ValueError('the store is finalized')
+        if id_ in self.offsets:
+            raise ValueError('subject {} already in the store'.format(id_))
+        if self.no_features is None:
+            self.no_features = features.shape[1]
+        if features.ndim != 2 or features.shape[1] != self.no_features:
+            raise ValueError('features must be of shape (n, {})'.format(self.no_features))
+        if labels.size != features.shape[0]:
+            raise ValueError('number of labels and feature rows differ')
+
+        self._features_file.write(np.ascontiguousarray(features, dtype=np.float32).tobytes())
+        self._labels_file.write(np.ascontiguousarray(labels, dtype=np.int16).tobytes())
+        self.offsets[id_] = (self.no_rows, self.no_rows + features.shape[0])
+        self.no_rows += features.shape[0]
+
+    def finalize(self):
+        """Writes the final shapes and the index and memory-maps the rows."""
+        if self._features_file is None:
+            return
+
+        if self.no_features is None:
+            self.no_features = 0
+        self._write_headers()
+        self._features_file.close()
+        self._labels_file.close()
+        self._features_file = self._labels_file = None
+
+        with open(os.path.join(self.directory, INDEX_FILE_NAME), 'w') as f:
+            json.dump({'no_rows': self.no_rows, 'no_features': self.no_features, 'offsets': self.offsets}, f)
+        self._load()
+
+    @property
+    def data(self) -> np.ndarray:
+        """np.ndarray: The memory-mapped float32 features of shape (number of rows, number of features)."""
+        self._check_finalized()
+        return self._data
+
+    @property
+    def labels(self) -> np.ndarray:
+        """np.ndarray: The memory-mapped int16 labels of shape (number of rows,)."""
+        self._check_finalized()
+        return self._labels
+
+    def rows(self, id_: str) -> slice:
+        """Gets the rows of a subject.
+
+        Args:
+            id_ (str): The subject identifier.
+
+        Returns:
+            slice: The rows.
+        """
+        return slice(*self.offsets[id_])
+
+    def ids(self) -> t.List[str]:
+        """Gets the subject identifiers in the order of their rows.
+
+        Returns:
+            list of str: The subject identifiers.
+        """
+        return list(self.offsets.keys())
+
+    def _write_headers(self):
+        for file, shape, dtype in ((self._features_file, (self.no_rows, self.no_features or 0), np.float32),
+                                   (self._labels_file, (self.no_rows,), np.int16)):
+            position = file.tell()
+            file.seek(0)
+            file.write(_npy_header(shape, dtype))
+            file.seek(max(position, _HEADER_SIZE))
+
+    def _load(self):
+        mmap_mode = 'r' if self.no_rows > 0 else None  # empty files cannot be memory-mapped
+        self._data = np.load(os.path.join(self.directory, FEATURES_FILE_NAME), mmap_mode=mmap_mode)
+        self._labels = np.load(os.path.join(self.directory, LABELS_FILE_NAME), mmap_mode=mmap_mode)
+
+    def _check_finalized(self):
+        if self._features_file is not None:
+            raise ValueError('the store is not finalized')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finalize()
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        return 'FeatureStore:\n' \
+               ' directory: {self.directory}\n' \
+               ' subjects:  {subjects}\n' \
+               ' rows:      {self.no_rows}\n' \
+               ' features:  {self.no_features}\n' \
+            .format(self=self, subjects=len(self.offsets))
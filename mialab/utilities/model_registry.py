@@ -0,0 +1,204 @@
+"""The model registry module holds an on-disk registry of trained classifiers.
+
+A model is keyed by a hash of the identities of the training subjects' files, the pre-processing parameters, and the
+classifier's hyperparameters, such that a test run finds the model trained on the same data instead of retraining it.
+Unlike the keys of the :mod:`cache <mialab.utilities.cache>`, the keys do not include the code version, since
+changes of e.g. the post-processing do not invalidate a model. The code version is recorded and checked when loading.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import typing as t
+import warnings
+
+import joblib
+
+import mialab.data.structure as structure
+import mialab.utilities.cache as cache
+
+MODEL_FILE_NAME = 'model.joblib'
+META_FILE_NAME = 'meta.json'
+
+
+def _model_params(params: dict) -> dict:
+    """Gets the parameters changing the trained model, i.e. without the cache and execution parameters (see
+    :func:`cache.result_params <mialab.utilities.cache.result_params>`) and the training mode."""
+    params = {k: v for k, v in cache.result_params(params).items() if k != 'training'}
+    return json.loads(json.dumps(params, sort_keys=True, default=repr))  # as stored in the meta file
+
+
+class ModelRegistry:
+    """Represents an on-disk registry of trained models.
+
+    Each entry is a directory named by its key, which holds the model as joblib file and a ``meta.json`` file with the
+    training subjects, the parameters, and the code version.
+
+    Examples:
+        >>> registry = ModelRegistry('./mia-models')
+        >>> key = registry.key(crawler.data, pre_process_params, hyperparameters)
+        >>> forest = registry.load(key)
+        >>> if forest is None:
+        >>>     forest = sk_ensemble.RandomForestClassifier(**hyperparameters).fit(data, labels)
+        >>>     registry.store(key, forest, crawler.data, pre_process_params, hyperparameters)
+    """
+
+    def __init__(self, directory: str, content_hash: bool = False):
+        """Initializes a new instance of the ModelRegistry class.
+
+        Args:
+            directory (str): The registry directory.
+            content_hash (bool): Whether the keys include the hash of the training file contents
+                (see :func:`cache.file_identity <mialab.utilities.cache.file_identity>`).
+        """
+        self.directory = directory
+        self.content_hash = content_hash
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data_batch: dict, pre_process_params: dict, hyperparameters: dict, extra: str = '') -> str:
+        """Gets the key of a model.
+
+        Args:
+            data_batch (dict): The training subjects, where the keys are the identifiers and the values the paths to
+                the input files (see :class:`FileSystemDataCrawler
+                <mialab.utilities.file_access_utilities.FileSystemDataCrawler>`).
+            pre_process_params (dict): The pre-processing parameters.
+            hyperparameters (dict): The hyperparameters of the classifier, e.g. ``forest.get_params()``.
+            extra (str): Additional identity, e.g. of the atlas images.
+
+        Returns:
+            str: The key.
+        """
+        subjects = {id_: {key.name: cache.file_identity(path, self.content_hash) for key, path in paths.items()
+                          if isinstance(key, structure.BrainImageTypes)}
+                    for id_, paths in data_batch.items()}
+        identity = {'subjects': subjects, 'params': _model_params(pre_process_params),
+                    'hyperparameters': _model_params(hyperparameters), 'extra': extra}
+        return hashlib.sha256(json.dumps(identity, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def find(self, key: str) -> str:
+        """Finds the key of an entry by its key or a unique prefix of it.
+
+        Args:
+            key (str): The key or a prefix.
+
+        Returns:
+            str: The key.
+
+        Raises:
+            KeyError: If no or multiple entries match.
+        """
+        keys = [entry['key'] for entry in self.entries() if entry['key'].startswith(key)]
+        if len(keys) != 1:
+            raise KeyError('{} models in {} match {}'.format(len(keys), self.directory, key))
+        return keys[0]
+
+    def path(self, key: str) -> str:
+        """Gets the path to the model file of an entry.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            str: The path to the joblib file.
+        """
+        return os.path.join(self.directory, key, MODEL_FILE_NAME)
+
+    def meta(self, key: str) -> t.Optional[dict]:
+        """Gets the meta data of an entry.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            dict: The training subjects, parameters, hyperparameters, code version, and creation time, or None if the
+            entry does not exist.
+        """
+        try:
+            with open(os.path.join(self.directory, key, META_FILE_NAME), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def load(self, key: str, pre_process_params: dict = None, mmap_mode: str = None):
+        """Loads the model of an entry.
+
+        The model is read into the private memory of the calling process, i.e. each process loading it holds a copy
+        of the size of the model file. Memory-mapping does not avoid the copy for scikit-learn forests, since their
+        trees copy the node arrays when unpickled. Worker processes share the model if they are started after it is
+        loaded (see :func:`pipeline_utilities.set_model <mialab.utilities.pipeline_utilities.set_model>`).
+
+        Args:
+            key (str): The key.
+            pre_process_params (dict): The pre-processing parameters of the images to predict, which are compared to
+                the ones of the training.
+            mmap_mode (str): The memory-map mode of the arrays (see :func:`joblib.load`), which only applies to
+                models keeping their arrays as they are unpickled.
+
+        Returns:
+            The model or None if the entry does not exist.
+        """
+        meta = self.meta(key)
+        if meta is None:
+            return None
+
+        if meta['code'] != cache.code_version():
+            warnings.warn('model {} was trained with another code version'.format(key[:16]))
+        if pre_process_params is not None and meta['params'] != _model_params(pre_process_params):
+            warnings.warn('model {} was trained with other pre-processing parameters: {}'.format(key[:16],
+                                                                                                 meta['params']))
+        return joblib.load(self.path(key), mmap_mode=mmap_mode)
+
+    def store(self, key: str, model, data_batch: dict, pre_process_params: dict, hyperparameters: dict):
+        """Stores a model.
+
+        Args:
+            key (str): The key (see :meth:`key`).
+            model: The trained model.
+            data_batch (dict): The training subjects.
+            pre_process_params (dict): The pre-processing parameters.
+            hyperparameters (dict): The hyperparameters of the classifier.
+        """
+        # write into a temporary directory and rename it, such that concurrent readers never see partial entries
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            joblib.dump(model, os.path.join(tmp_dir, MODEL_FILE_NAME))
+            meta = {'subjects': sorted(data_batch), 'params': _model_params(pre_process_params),
+                    'hyperparameters': _model_params(hyperparameters), 'code': cache.code_version(),
+                    'created': time.time()}
+            with open(os.path.join(tmp_dir, META_FILE_NAME), 'w') as f:
+                json.dump(meta, f, indent=2)
+
+            os.rename(tmp_dir, os.path.join(self.directory, key))
+        except OSError:
+            # e.g. another process stored the same model in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(os.path.join(self.directory, key)):
+                raise
+
+    def entries(self) -> t.List[dict]:
+        """Gets the entries ordered from the oldest to the newest.
+
+        Returns:
+            list of dict: The key, number of training subjects, size in bytes, and creation time of the entries.
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            if key.startswith('.'):
+                continue
+            meta = self.meta(key)
+            if meta is None:
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(self.directory, key)))
+            entries.append({'key': key, 'subjects': len(meta['subjects']), 'size': size, 'created': meta['created']})
+        return sorted(entries, key=lambda entry: entry['created'])
+
+    def remove(self, key: str):
+        """Removes an entry.
+
+        Args:
+            key (str): The key.
+        """
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
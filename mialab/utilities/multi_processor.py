@@ -1,4 +1,9 @@
 """Module for the management of multi-process function calls."""
+import contextlib
+import multiprocessing.resource_tracker as resource_tracker
+import multiprocessing.shared_memory as shared_memory
+import os
+import sys
 import typing as t
 
 import numpy as np
@@ -9,6 +14,95 @@ import pymia.data.conversion as conversion
 import mialab.data.structure as structure
 
 
+SHARED_MEMORY = os.name == 'posix'  # shared memory segments outlive their handles on POSIX systems only
+
+
+class SharedArray:
+    """Represents a numpy array in a shared memory segment, which is pickled as a handle instead of the array bytes.
+
+    The process creating the array and the processes unpickling it map the same segment. The segments are not tracked
+    by the resource tracker, which would unlink them when any of the processes exits, but need to be released
+    explicitly by :meth:`release`. The receiving process typically copies the array, e.g. into a SimpleITK image, and
+    unlinks the segment.
+
+    Examples:
+        >>> shared = SharedArray(np.zeros((181, 217, 181), np.float32))  # in the worker process
+        >>> image = sitk.GetImageFromArray(shared.asarray())  # in the parent process, after unpickling
+        >>> shared.release(unlink=True)
+    """
+
+    def __init__(self, array: np.ndarray):
+        """Initializes a new instance of the SharedArray class, i.e. copies an array into a new shared memory segment.
+
+        Args:
+            array (np.ndarray): The array.
+        """
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self._shm = _open_shared_memory(size=max(array.nbytes, 1))  # the size cannot be 0
+        self.name = self._shm.name
+        self.asarray()[...] = array
+
+    def asarray(self) -> np.ndarray:
+        """Gets the array, which is a view of the shared memory segment.
+
+        Returns:
+            np.ndarray: The array. It is invalid after :meth:`release`.
+        """
+        return np.ndarray(self.shape, self.dtype, buffer=self._shm.buf)
+
+    def release(self, unlink: bool = False):
+        """Unmaps the shared memory segment.
+
+        Args:
+            unlink (bool): Whether to remove the segment, which is done by the last process using it.
+        """
+        if self._shm is None:
+            return
+        self._shm.close()
+        if unlink:
+            if sys.version_info < (3, 13):
+                # unlink unregisters the segment from the resource tracker, which does not know it
+                resource_tracker.register(self._shm._name, 'shared_memory')
+            self._shm.unlink()
+        self._shm = None
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype.str}
+
+    def __setstate__(self, state):
+        self.name = state['name']
+        self.shape = tuple(state['shape'])
+        self.dtype = np.dtype(state['dtype'])
+        self._shm = _open_shared_memory(self.name)
+
+
+def _open_shared_memory(name: str = None, size: int = 0) -> shared_memory.SharedMemory:
+    """Creates (if ``name`` is None) or attaches a shared memory segment, which is not tracked by the resource tracker
+    (see :class:`SharedArray`)."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, create=name is None, size=size, track=False)
+
+    shm = shared_memory.SharedMemory(name, create=name is None, size=size)
+    resource_tracker.unregister(shm._name, 'shared_memory')  # attached segments are registered as well (bpo-39959)
+    return shm
+
+
+def _share(array, use_shared_memory: bool):
+    """Gets an array as :class:`SharedArray` if ``use_shared_memory`` is True and the array is not None."""
+    return SharedArray(array) if use_shared_memory and array is not None else array
+
+
+def _as_array(array) -> t.Optional[np.ndarray]:
+    """Gets a :class:`SharedArray` or numpy array as numpy array, where shared arrays are views."""
+    return array.asarray() if isinstance(array, SharedArray) else array
+
+
+def _as_owned_array(array) -> t.Optional[np.ndarray]:
+    """Gets a :class:`SharedArray` or numpy array as numpy array, where shared arrays are copied."""
+    return array.asarray().copy() if isinstance(array, SharedArray) else array
+
+
 class PicklableAffineTransform:
     """Represents a transformation that can be pickled."""
 
@@ -22,6 +116,36 @@ class PicklableAffineTransform:
         return transform
 
 
+class PicklableImage:
+    """Represents a SimpleITK image that can be pickled."""
+
+    def __init__(self, image: sitk.Image, use_shared_memory: bool = False):
+        """Initializes a new instance of the PicklableImage class.
+
+        Args:
+            image (sitk.Image): The image.
+            use_shared_memory (bool): Whether to copy the array into shared memory (see :class:`SharedArray`) instead
+                of pickling it.
+        """
+        if use_shared_memory:
+            self.np_image = SharedArray(sitk.GetArrayViewFromImage(image))
+        else:
+            self.np_image = sitk.GetArrayFromImage(image)
+        self.image_properties = conversion.ImageProperties(image)
+
+    def get_sitk_image(self) -> sitk.Image:
+        return conversion.NumpySimpleITKImageBridge.convert(_as_array(self.np_image), self.image_properties)
+
+    def release(self, unlink: bool = False):
+        """Releases the :class:`SharedArray` of the image.
+
+        Args:
+            unlink (bool): Whether to remove the shared memory segment.
+        """
+        if isinstance(self.np_image, SharedArray):
+            self.np_image.release(unlink)
+
+
 class PicklableBrainImage:
     """Represents a brain image that can be pickled."""
 
@@ -33,7 +157,8 @@ class PicklableBrainImage:
             id_ (str): An identifier.
             path (str): Full path to the image directory.
             np_images (dict): The images, where the key is a
-                :class:`BrainImageTypes <data.structure.BrainImageTypes>` and the value is a numpy image.
+                :class:`BrainImageTypes <data.structure.BrainImageTypes>` and the value is a numpy image or a
+                :class:`SharedArray`.
         """
 
         self.id_ = id_
@@ -44,35 +169,57 @@ class PicklableBrainImage:
         self.feature_matrix = None  # a tuple (features, labels),
         # where the shape of features is (n, number_of_features) and the shape of labels is (n, 1)
         # with n being the amount of voxels
+        self.feature_indices = None  # the flat indices of the voxels of the feature matrix rows, None for all voxels
         self.pickable_transform = PicklableAffineTransform(transform)
 
+    def release(self, unlink: bool = False):
+        """Releases the :class:`SharedArray` of the image.
+
+        Args:
+            unlink (bool): Whether to remove the shared memory segments.
+        """
+        arrays = [*self.np_images.values(), *self.np_feature_images.values(), *(self.feature_matrix or ()),
+                  self.feature_indices]
+        for array in arrays:
+            if isinstance(array, SharedArray):
+                array.release(unlink)
+
 
 class BrainImageToPicklableBridge:
     """A :class:`BrainImage <data.structure.BrainImage>` to :class:`PicklableBrainImage` bridge."""
 
     @staticmethod
-    def convert(brain_image: structure.BrainImage) -> PicklableBrainImage:
+    def convert(brain_image: structure.BrainImage, use_shared_memory: bool = False) -> PicklableBrainImage:
         """Converts a :class:`BrainImage <data.structure.BrainImage>` to :class:`PicklableBrainImage`.
 
         Args:
             brain_image (BrainImage): A brain image.
+            use_shared_memory (bool): Whether to copy the arrays into shared memory (see :class:`SharedArray`) instead
+                of pickling them.
 
         Returns:
             PicklableBrainImage: The pickable brain image.
         """
 
+        def get_array(img: sitk.Image) -> np.ndarray:
+            # the view is copied into the shared memory segment, thus, it does not need to be copied itself
+            return SharedArray(sitk.GetArrayViewFromImage(img)) if use_shared_memory else sitk.GetArrayFromImage(img)
+
         np_images = {}
         for key, img in brain_image.images.items():
-            np_images[key] = sitk.GetArrayFromImage(img)
+            np_images[key] = get_array(img)
         np_feature_images = {}
         for key, feat_img in brain_image.feature_images.items():
-            np_feature_images[key] = sitk.GetArrayFromImage(feat_img)
+            np_feature_images[key] = get_array(feat_img)
 
         pickable_brain_image = PicklableBrainImage(brain_image.id_, brain_image.path, np_images,
                                                    brain_image.image_properties,
                                                    brain_image.transformation)
         pickable_brain_image.np_feature_images = np_feature_images
-        pickable_brain_image.feature_matrix = brain_image.feature_matrix
+        if brain_image.feature_matrix is not None:
+            pickable_brain_image.feature_matrix = tuple(_share(array, use_shared_memory)
+                                                        for array in brain_image.feature_matrix)
+        pickable_brain_image.feature_indices = _share(brain_image.feature_indices, use_shared_memory)
 
         return pickable_brain_image
 
@@ -81,11 +228,14 @@ class PicklableToBrainImageBridge:
     """A :class:`PicklableBrainImage` to :class:`BrainImage <data.structure.BrainImage>` bridge."""
 
     @staticmethod
-    def convert(picklable_brain_image: PicklableBrainImage) -> structure.BrainImage:
+    def convert(picklable_brain_image: PicklableBrainImage, unlink: bool = True) -> structure.BrainImage:
         """Converts a :class:`PicklableBrainImage` to :class:`BrainImage <data.structure.BrainImage>`.
 
+        The arrays in shared memory are copied and released afterwards.
+
         Args:
             picklable_brain_image (PicklableBrainImage): A pickable brain image.
+            unlink (bool): Whether to remove the shared memory segments, i.e. whether the calling process owns them.
 
         Returns:
             BrainImage: The brain image.
@@ -93,17 +243,23 @@ class PicklableToBrainImageBridge:
 
         images = {}
         for key, np_img in picklable_brain_image.np_images.items():
-            images[key] = conversion.NumpySimpleITKImageBridge.convert(np_img, picklable_brain_image.image_properties)
+            images[key] = conversion.NumpySimpleITKImageBridge.convert(_as_array(np_img),
+                                                                       picklable_brain_image.image_properties)
 
         feature_images = {}
         for key, np_feat_img in picklable_brain_image.np_feature_images.items():
-            feature_images[key] = conversion.NumpySimpleITKImageBridge.convert(np_feat_img,
+            feature_images[key] = conversion.NumpySimpleITKImageBridge.convert(_as_array(np_feat_img),
                                                                                picklable_brain_image.image_properties)
 
         transform = picklable_brain_image.pickable_transform.get_sitk_transformation()
 
         brain_image = structure.BrainImage(picklable_brain_image.id_, picklable_brain_image.path, images, transform)
-        brain_image.feature_matrix = picklable_brain_image.feature_matrix
+        if picklable_brain_image.feature_matrix is not None:
+            brain_image.feature_matrix = tuple(_as_owned_array(array)
+                                               for array in picklable_brain_image.feature_matrix)
+        brain_image.feature_indices = _as_owned_array(picklable_brain_image.feature_indices)
+
+        picklable_brain_image.release(unlink)
         return brain_image
 
 
@@ -134,6 +290,16 @@ class DefaultPickleHelper:
         """
         return params
 
+    def release_params(self, params):
+        """Default function called in the original process to release the picklable parameters ``params`` after the
+        function call finished, e.g. shared memory.
+        To be overwritten if the picklable parameters hold resources.
+
+        Args:
+            params (tuple): Picklable parameters (see :meth:`make_params_picklable`).
+        """
+        pass
+
     def make_return_value_picklable(self, ret_val):
         """ Default function called to ensure that all return values ``ret_val`` can be pickled before transferring
         back to the original process.
@@ -160,9 +326,24 @@ class DefaultPickleHelper:
         """
         return ret_val
 
+    def release_return_value(self, ret_val):
+        """Default function called in the original process to release the picklable return values ``ret_val`` that
+        are not recovered, e.g. the shared memory of the return values received before another call failed.
+        To be overwritten if the picklable return values hold resources.
+
+        Args:
+            ret_val: Picklable return values (see :meth:`make_return_value_picklable`).
+        """
+        pass
+
 
 class PreProcessingPickleHelper(DefaultPickleHelper):
-    """Pre-processing pickle helper class"""
+    """Pre-processing pickle helper class
+
+    The arrays of the images are transported in shared memory (see :class:`SharedArray`) if ``shared_memory`` is True.
+    """
+
+    shared_memory = SHARED_MEMORY
 
     def make_return_value_picklable(self, ret_val: structure.BrainImage) -> PicklableBrainImage:
         """Ensures that all pre-processing return values ``ret_val`` can be pickled before transferring back to
@@ -175,7 +356,7 @@ class PreProcessingPickleHelper(DefaultPickleHelper):
             PicklableBrainImage: The modified pre-processing return values.
         """
 
-        return BrainImageToPicklableBridge.convert(ret_val)
+        return BrainImageToPicklableBridge.convert(ret_val, self.shared_memory)
 
     def recover_return_value(self, ret_val: PicklableBrainImage) -> structure.BrainImage:
         """Recovers (from the pickle state) the original pre-processing return values.
@@ -188,9 +369,23 @@ class PreProcessingPickleHelper(DefaultPickleHelper):
         """
         return PicklableToBrainImageBridge.convert(ret_val)
 
+    def release_return_value(self, ret_val: PicklableBrainImage):
+        """Removes the shared memory of pre-processing return values that are not recovered.
+
+        Args:
+            ret_val(PicklableBrainImage): Picklable pre-processing return values.
+        """
+        ret_val.release(unlink=True)
+
 
 class PostProcessingPickleHelper(DefaultPickleHelper):
-    """Post-processing pickle helper class"""
+    """Post-processing pickle helper class
+
+    The arrays of the images are transported in shared memory (see :class:`SharedArray`) if ``shared_memory`` is True.
+    The original process owns the shared memory of the parameters and of the return values.
+    """
+
+    shared_memory = SHARED_MEMORY
 
     def make_params_picklable(self, params: t.Tuple[structure.BrainImage, sitk.Image, sitk.Image, dict]):
         """Ensures that all post-processing parameters can be pickled before transferred to the new process.
@@ -202,9 +397,13 @@ class PostProcessingPickleHelper(DefaultPickleHelper):
             tuple: The modified post-processing parameters.
         """
         brain_img, segmentation, probability, fn_kwargs = params
-        picklable_brain_image = BrainImageToPicklableBridge.convert(brain_img)
-        np_segmentation, _ = conversion.SimpleITKNumpyImageBridge.convert(segmentation)
-        np_probability, _ = conversion.SimpleITKNumpyImageBridge.convert(probability)
+        picklable_brain_image = BrainImageToPicklableBridge.convert(brain_img, self.shared_memory)
+        if self.shared_memory:
+            np_segmentation = SharedArray(sitk.GetArrayViewFromImage(segmentation))
+            np_probability = SharedArray(sitk.GetArrayViewFromImage(probability))
+        else:
+            np_segmentation, _ = conversion.SimpleITKNumpyImageBridge.convert(segmentation)
+            np_probability, _ = conversion.SimpleITKNumpyImageBridge.convert(probability)
         return picklable_brain_image, np_segmentation, np_probability, fn_kwargs
 
     def recover_params(self, params: t.Tuple[PicklableBrainImage, np.ndarray, np.ndarray, dict]):
@@ -218,11 +417,28 @@ class PostProcessingPickleHelper(DefaultPickleHelper):
 
         """
         picklable_img, np_segmentation, np_probability, fn_kwargs = params
-        img = PicklableToBrainImageBridge.convert(picklable_img)
-        segmentation = conversion.NumpySimpleITKImageBridge.convert(np_segmentation, picklable_img.image_properties)
-        probability = conversion.NumpySimpleITKImageBridge.convert(np_probability, picklable_img.image_properties)
+        img = PicklableToBrainImageBridge.convert(picklable_img, unlink=False)
+        segmentation = conversion.NumpySimpleITKImageBridge.convert(_as_array(np_segmentation),
+                                                                    picklable_img.image_properties)
+        probability = conversion.NumpySimpleITKImageBridge.convert(_as_array(np_probability),
+                                                                   picklable_img.image_properties)
+        for array in (np_segmentation, np_probability):
+            if isinstance(array, SharedArray):
+                array.release()
         return img, segmentation, probability, fn_kwargs
 
+    def release_params(self, params: t.Tuple[PicklableBrainImage, np.ndarray, np.ndarray, dict]):
+        """Removes the shared memory of the post-processing parameters.
+
+        Args:
+            params (tuple): Picklable post-processing parameters.
+        """
+        picklable_img, np_segmentation, np_probability, _ = params
+        picklable_img.release(unlink=True)
+        for array in (np_segmentation, np_probability):
+            if isinstance(array, SharedArray):
+                array.release(unlink=True)
+
     def make_return_value_picklable(self, ret_val: sitk.Image) -> t.Tuple[np.ndarray, conversion.ImageProperties]:
         """Ensures that all post-processing return values ``ret_val`` can be pickled before transferring back to
         the original process.
@@ -233,6 +449,8 @@ class PostProcessingPickleHelper(DefaultPickleHelper):
         Returns:
             The modified post-processing return values.
         """
+        if self.shared_memory:
+            return SharedArray(sitk.GetArrayViewFromImage(ret_val)), conversion.ImageProperties(ret_val)
         np_img, image_properties = conversion.SimpleITKNumpyImageBridge.convert(ret_val)
         return np_img, image_properties
 
@@ -246,38 +464,313 @@ class PostProcessingPickleHelper(DefaultPickleHelper):
             sitk.Image: The recovered post-processing return values.
         """
         np_img, image_properties = ret_val
-        return conversion.NumpySimpleITKImageBridge.convert(np_img, image_properties)
+        img = conversion.NumpySimpleITKImageBridge.convert(_as_array(np_img), image_properties)
+        if isinstance(np_img, SharedArray):
+            np_img.release(unlink=True)
+        return img
+
+    def release_return_value(self, ret_val: t.Tuple[np.ndarray, conversion.ImageProperties]):
+        """Removes the shared memory of post-processing return values that are not recovered.
+
+        Args:
+            ret_val: Picklable post-processing return values.
+        """
+        np_img, _ = ret_val
+        if isinstance(np_img, SharedArray):
+            np_img.release(unlink=True)
+
+
+class PredictionPickleHelper(DefaultPickleHelper):
+    """Prediction pickle helper class
+
+    The brain images and SimpleITK images among the parameters and return values are converted to
+    :class:`PicklableBrainImage` and :class:`PicklableImage`, whose arrays are transported in shared memory (see
+    :class:`SharedArray`) if ``shared_memory`` is True, and the remaining values are pickled as they are.
+    The model is not among the parameters but inherited or loaded once by each worker process (see
+    :func:`pipeline_utilities.predict <mialab.utilities.pipeline_utilities.predict>`).
+    The original process owns the shared memory of the parameters and of the return values.
+    """
+
+    shared_memory = SHARED_MEMORY
+
+    def make_params_picklable(self, params: tuple) -> tuple:
+        """Ensures that all prediction parameters can be pickled before transferred to the new process.
+
+        Args:
+            params (tuple): Prediction parameters to be rendered picklable.
+
+        Returns:
+            tuple: The modified prediction parameters.
+        """
+        return tuple(self._make_picklable(param) for param in params)
+
+    def recover_params(self, params: tuple) -> tuple:
+        """Recovers (from the pickle state) the original prediction parameters in another process.
+
+        Args:
+            params (tuple): Prediction parameters to be recovered.
+
+        Returns:
+            tuple: The recovered prediction parameters.
+        """
+        return tuple(self._recover(param, unlink=False) for param in params)
+
+    def release_params(self, params: tuple):
+        """Removes the shared memory of the prediction parameters.
+
+        Args:
+            params (tuple): Picklable prediction parameters.
+        """
+        for param in params:
+            if isinstance(param, (PicklableBrainImage, PicklableImage)):
+                param.release(unlink=True)
+
+    def make_return_value_picklable(self, ret_val: tuple) -> tuple:
+        """Ensures that all prediction return values ``ret_val`` can be pickled before transferring back to
+        the original process.
+
+        Args:
+            ret_val (tuple): Return values of the prediction function executed in another process, e.g. the label
+                and probability images.
+
+        Returns:
+            tuple: The modified prediction return values.
+        """
+        return tuple(self._make_picklable(value) for value in ret_val)
+
+    def recover_return_value(self, ret_val: tuple) -> tuple:
+        """Recovers (from the pickle state) the original prediction return values.
+
+        Args:
+            ret_val (tuple): Prediction return values to be recovered.
+
+        Returns:
+            tuple: The recovered prediction return values.
+        """
+        return tuple(self._recover(value, unlink=True) for value in ret_val)
+
+    def release_return_value(self, ret_val: tuple):
+        """Removes the shared memory of prediction return values that are not recovered.
+
+        Args:
+            ret_val (tuple): Picklable prediction return values.
+        """
+        self.release_params(ret_val)
+
+    def _make_picklable(self, value):
+        if isinstance(value, structure.BrainImage):
+            return BrainImageToPicklableBridge.convert(value, self.shared_memory)
+        if isinstance(value, sitk.Image):
+            return PicklableImage(value, self.shared_memory)
+        return value
+
+    @staticmethod
+    def _recover(value, unlink: bool):
+        if isinstance(value, PicklableBrainImage):
+            return PicklableToBrainImageBridge.convert(value, unlink)
+        if isinstance(value, PicklableImage):
+            image = value.get_sitk_image()
+            value.release(unlink)
+            return image
+        return value
+
+
+class WorkerPool:
+    """Represents a long-lived pool of worker processes, which is shared by several :class:`MultiProcessor` calls.
+
+    The worker processes are started once, and the initializer is called once in each worker process, e.g. to load the
+    atlas images. The pool is closed when leaving the context.
+    With the ``'thread'`` backend, the workers are threads of the calling process instead, which share the objects
+    without pickling them, and the initializer is called once in each thread.
+
+    Examples:
+        >>> with WorkerPool(initializer=putil.load_atlas_images, initargs=(data_atlas_dir,)) as pool:
+        >>>     images = putil.pre_process_batch(data, params, pool=pool)
+        >>>     ...
+        >>>     post_processed = putil.post_process_batch(images, segmentations, probabilities, pool=pool)
+    """
+
+    BACKENDS = ('process', 'thread')
+
+    def __init__(self, processes: int = None, initializer: callable = None, initargs: tuple = (),
+                 backend: str = 'process'):
+        """Initializes a new instance of the WorkerPool class.
+
+        Args:
+            processes (int): The number of worker processes. None for the number of CPUs.
+            initializer (callable): The function called once in each worker process when it starts.
+            initargs (tuple): The arguments of the initializer.
+            backend (str): The backend of the workers, i.e. ``'process'`` or ``'thread'``.
+
+        Raises:
+            ValueError: If the backend is unknown.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError('backend must be one of {}'.format(self.BACKENDS))
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.backend = backend
+        self._pool = None
+
+    @property
+    def pool(self) -> pmp.Pool:
+        """pmp.Pool: The pool, which is started on the first access."""
+        if self._pool is None:
+            pool_cls = pmp.ThreadPool if self.backend == 'thread' else pmp.Pool
+            self._pool = pool_cls(self.processes, self.initializer, self.initargs)
+        return self._pool
+
+    def close(self):
+        """Closes the pool and waits for the worker processes to exit."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        """Stops the worker processes immediately without finishing outstanding work."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        self.pool  # start the worker processes
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
 
 
 class MultiProcessor:
     """Class managing multiprocessing"""
 
     @staticmethod
-    def run(fn: callable, param_list: iter, fn_kwargs: dict = None, pickle_helper_cls: type = DefaultPickleHelper):
+    def run(fn: callable, param_list: iter, fn_kwargs: dict = None, pickle_helper_cls: type = DefaultPickleHelper,
+            pool: WorkerPool = None):
         """ Executes the function ``fn`` in parallel (different processes) for each parameter in the parameter list.
 
+        If a call fails, the return values of the other calls are released (see
+        :meth:`DefaultPickleHelper.release_return_value`) before the exception is raised.
+
         Args:
             fn (callable): Function to be executed in another process.
             param_list (List[tuple]): List containing the parameters for each ``fn`` call.
             fn_kwargs (dict): kwargs for the ``fn`` function call.
             pickle_helper_cls: Class responsible for the pickling of the parameters
+            pool (WorkerPool): The worker pool. None starts a new pool, which is closed afterwards.
 
         Returns:
             list: A list of all return values of the ``fn`` calls
         """
         if fn_kwargs is None:
             fn_kwargs = {}
+        if pool is not None and pool.backend == 'thread':
+            pickle_helper_cls = DefaultPickleHelper  # threads share the objects
 
         helper = pickle_helper_cls()
         # add additional_params
         param_list = ((*p, fn_kwargs) for p in param_list)
-        param_list = (helper.make_params_picklable(params) for params in param_list)
-
-        with pmp.Pool() as p:
-            ret_vals = p.starmap(MultiProcessor._wrap_fn(fn, pickle_helper_cls), param_list)
-        ret_vals = [helper.recover_return_value(ret_val) for ret_val in ret_vals]
+        param_list = [helper.make_params_picklable(params) for params in param_list]
+
+        wrapped_fn = MultiProcessor._wrap_fn(fn, pickle_helper_cls)
+        received = []  # the picklable return values, which are released if they are not recovered
+        ret_vals = []
+        try:
+            with MultiProcessor._get_pool(pool) as p:
+                results = p.imap(lambda params: wrapped_fn(*params), param_list)
+                try:
+                    received.extend(results)
+                except BaseException:
+                    MultiProcessor._drain(results, helper)  # the calls still running return values as well
+                    raise
+            for ret_val in received:
+                ret_vals.append(helper.recover_return_value(ret_val))
+        except BaseException:
+            for ret_val in received[len(ret_vals):]:
+                helper.release_return_value(ret_val)
+            raise
+        finally:
+            for params in param_list:
+                helper.release_params(params)
         return ret_vals
 
+    @staticmethod
+    def run_iter(fn: callable, param_list: iter, fn_kwargs: dict = None,
+                 pickle_helper_cls: type = DefaultPickleHelper, pool: WorkerPool = None) -> t.Iterator:
+        """ Executes the function ``fn`` in parallel (different processes) for each parameter in the parameter list
+        and yields the return values as soon as they are available.
+
+        In contrast to :meth:`run`, the return values are yielded in the order of completion instead of the order of
+        the parameter list, such that they can be consumed while the remaining calls are still running.
+        If a call fails or the iteration is stopped early (e.g. the generator is closed), the remaining calls are
+        waited for and their return values released (see :meth:`DefaultPickleHelper.release_return_value`).
+
+        Args:
+            fn (callable): Function to be executed in another process.
+            param_list (List[tuple]): List containing the parameters for each ``fn`` call.
+            fn_kwargs (dict): kwargs for the ``fn`` function call.
+            pickle_helper_cls: Class responsible for the pickling of the parameters
+            pool (WorkerPool): The worker pool. None starts a new pool, which is closed afterwards.
+
+        Yields:
+            The return values of the ``fn`` calls in the order of completion.
+        """
+        if fn_kwargs is None:
+            fn_kwargs = {}
+        if pool is not None and pool.backend == 'thread':
+            pickle_helper_cls = DefaultPickleHelper  # threads share the objects
+
+        helper = pickle_helper_cls()
+        # add additional_params
+        param_list = ((*p, fn_kwargs) for p in param_list)
+        param_list = [helper.make_params_picklable(params) for params in param_list]
+
+        wrapped_fn = MultiProcessor._wrap_fn(fn, pickle_helper_cls)
+        try:
+            with MultiProcessor._get_pool(pool) as p:
+                # chunksize=1 such that each return value is yielded as soon as its call is done
+                results = p.imap_unordered(lambda params: wrapped_fn(*params), param_list, chunksize=1)
+                try:
+                    for ret_val in results:
+                        try:
+                            ret_val = helper.recover_return_value(ret_val)
+                        except BaseException:
+                            helper.release_return_value(ret_val)
+                            raise
+                        yield ret_val
+                finally:
+                    # if a call failed or the iteration stopped early, the remaining calls still return values
+                    MultiProcessor._drain(results, helper)
+        finally:
+            for params in param_list:
+                helper.release_params(params)
+
+    @staticmethod
+    def _drain(results: t.Iterator, helper: DefaultPickleHelper):
+        """Waits for the remaining return values of the calls and releases them, ignoring failed calls."""
+        while True:
+            try:
+                ret_val = next(results)
+            except StopIteration:
+                return
+            except Exception:
+                continue
+            helper.release_return_value(ret_val)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _get_pool(pool: WorkerPool = None) -> t.Iterator[pmp.Pool]:
+        if pool is not None:
+            yield pool.pool  # the shared pool outlives the call
+        else:
+            with pmp.Pool() as p:
+                yield p
+
     @staticmethod
     def _wrap_fn(fn, pickle_helper_cls):
         def wrapped_fn(*params):
@@ -1,9 +1,12 @@
 """This module contains utility classes and functions."""
 import enum
 import os
+import threading
 import typing as t
 import warnings
+import zlib
 
+import joblib
 import numpy as np
 import pymia.data.conversion as conversion
 import pymia.filtering.filter as fltr
@@ -15,10 +18,17 @@ import mialab.data.structure as structure
 import mialab.filtering.feature_extraction as fltr_feat
 import mialab.filtering.postprocessing as fltr_postp
 import mialab.filtering.preprocessing as fltr_prep
+import mialab.utilities.cache as cache
+import mialab.utilities.compact_forest as compact_forest
 import mialab.utilities.multi_processor as mproc
+import mialab.utilities.prediction as prediction
+import mialab.utilities.task_graph as task_graph
 
 atlas_t1 = sitk.Image()
 atlas_t2 = sitk.Image()
+model = None  # the classifier of the prediction (see set_model and load_model)
+model_path = None  # the file or directory the model was loaded from
+_model_lock = threading.Lock()
 
 
 def load_atlas_images(directory: str):
@@ -36,6 +46,63 @@ def load_atlas_images(directory: str):
         raise ValueError('T1w and T2w atlas images have not the same image properties')
 
 
+def atlas_identity(params: dict) -> str:
+    """Gets the identity of the atlas images, which are an input of the registration, for the keys of the cache and the
+    model registry (see :func:`load_atlas_images`).
+
+    Args:
+        params (dict): The pre-processing parameters.
+
+    Returns:
+        str: The image properties of the atlas if ``registration_pre`` is True; otherwise, an empty string.
+    """
+    return str(conversion.ImageProperties(atlas_t1)) if params.get('registration_pre', False) else ''
+
+
+def set_model(model_):
+    """Sets the classifier of the prediction.
+
+    Worker processes started afterwards by fork inherit the model copy-on-write, i.e. without pickling it, and share
+    its pages with the calling process as long as they only read them. Start the worker pool of the prediction after
+    setting the model to avoid a copy of the model in each worker.
+
+    Args:
+        model_: The trained classifier.
+    """
+
+    global model
+    global model_path
+    model = model_
+    model_path = None
+
+
+def load_model(path: str):
+    """Loads the classifier of the prediction from a joblib file or a compact forest directory, unless it is already
+    loaded from the path.
+
+    A worker process loads the model once instead of receiving it pickled with each task. Note that a scikit-learn
+    forest is unpickled from a joblib file into private memory, i.e. each process holds a copy of the model, since its
+    trees copy their node arrays when unpickled. The arrays of a compact forest are memory-mapped instead (see
+    :meth:`CompactForest.load <mialab.utilities.compact_forest.CompactForest.load>`), such that the processes share
+    their pages in the page cache. To share a scikit-learn forest, set it before starting the workers (see
+    :func:`set_model`).
+
+    Args:
+        path (str): The joblib file of the model (see :func:`joblib.dump`) or the directory of a compact forest (see
+            :meth:`CompactForest.save <mialab.utilities.compact_forest.CompactForest.save>`).
+    """
+
+    global model
+    global model_path
+    with _model_lock:  # the threads of a worker pool share the model
+        if model_path != path:
+            if os.path.isdir(path):
+                model = compact_forest.CompactForest.load(path)
+            else:
+                model = joblib.load(path)
+            model_path = path
+
+
 class FeatureImageTypes(enum.Enum):
     """Represents the feature image types."""
 
@@ -44,10 +111,27 @@ class FeatureImageTypes(enum.Enum):
     T1w_GRADIENT_INTENSITY = 3
     T2w_INTENSITY = 4
     T2w_GRADIENT_INTENSITY = 5
+    T1w_NEIGHBORHOOD = 6
+    T2w_NEIGHBORHOOD = 7
+    T1w_SCALE_SPACE = 8
+    T2w_SCALE_SPACE = 9
+    T1w_GLCM = 10
+    T2w_GLCM = 11
 
 
 class FeatureExtractor:
-    """Represents a feature extractor."""
+    """Represents a feature extractor.
+
+    In training mode with ``sparse_training``, the features are calculated at the sampled training voxels only instead
+    of calculating feature images, such that the costs scale with the number of samples instead of the image size.
+    Likewise, in testing mode with ``brain_mask_inference``, the features are calculated at the voxels of the
+    (optionally dilated by ``brain_mask_margin`` voxels) brain mask only, since the background is skull-stripped anyway.
+    The flat indices of the feature matrix rows are stored in ``feature_indices`` of the image
+    (see :func:`predictions_as_images`).
+    With ``n_threads`` > 1, the independent features are extracted in parallel (see :meth:`add_tasks`).
+    The neighborhood features are extracted in tiles of ``tile_size`` z-slices on ``neighborhood_n_workers`` threads
+    (see :class:`NeighborhoodFeatureExtractor <mialab.filtering.feature_extraction.NeighborhoodFeatureExtractor>`).
+    """
 
     def __init__(self, img: structure.BrainImage, **kwargs):
         """Initializes a new instance of the FeatureExtractor class.
@@ -57,9 +141,26 @@ class FeatureExtractor:
         """
         self.img = img
         self.training = kwargs.get('training', True)
+        self.sparse_training = kwargs.get('sparse_training', False)
         self.coordinates_feature = kwargs.get('coordinates_feature', False)
         self.intensity_feature = kwargs.get('intensity_feature', False)
         self.gradient_intensity_feature = kwargs.get('gradient_intensity_feature', False)
+        self.neighborhood_feature = kwargs.get('neighborhood_feature', False)
+        self.neighborhood_kernel = kwargs.get('neighborhood_kernel', (3, 3, 3))
+        self.neighborhood_backend = kwargs.get('neighborhood_backend', None)
+        self.neighborhood_features = kwargs.get('neighborhood_features', None)
+        self.tile_size = kwargs.get('tile_size', 32)
+        self.neighborhood_n_workers = kwargs.get('neighborhood_n_workers', 1)
+        self.scale_space_feature = kwargs.get('scale_space_feature', False)
+        self.scale_space_sigmas = kwargs.get('scale_space_sigmas', (1, 2, 4))
+        self.scale_space_features = kwargs.get('scale_space_features', fltr_feat.SCALE_SPACE_FEATURES)
+        self.glcm_feature = kwargs.get('glcm_feature', False)
+        self.glcm_kernel = kwargs.get('glcm_kernel', (5, 5, 5))
+        self.glcm_levels = kwargs.get('glcm_levels', 8)
+        self.training_seed = kwargs.get('training_seed', None)
+        self.brain_mask_inference = kwargs.get('brain_mask_inference', False)
+        self.brain_mask_margin = kwargs.get('brain_mask_margin', 0)
+        self.n_threads = kwargs.get('n_threads', 1)
 
     def execute(self) -> structure.BrainImage:
         """Extracts features from an image.
@@ -69,95 +170,260 @@ class FeatureExtractor:
         """
         # warnings.warn('No features from T2-weighted image extracted.')
 
+        graph = task_graph.TaskGraph()
+        self.add_tasks(graph)
+        graph.execute(self.n_threads)
+        return self.img
+
+    def add_tasks(self, graph: task_graph.TaskGraph, dependencies: dict = None) -> str:
+        """Adds the feature extraction to a task graph.
+
+        Each feature of the T1w and T2w images is a task, which depends on the task producing the image only, such that
+        the features of an image are extracted while the other images are still processed. A final task assembles the
+        feature matrix.
+
+        Args:
+            graph (task_graph.TaskGraph): The task graph.
+            dependencies (dict): The names of the tasks producing the images, where the keys are of type
+                structure.BrainImageTypes. Images without a task are ready.
+
+        Returns:
+            str: The name of the final task.
+        """
+        if dependencies is None:
+            dependencies = {}
+
+        def after(*image_types):
+            return [dependencies[image_type] for image_type in image_types if image_type in dependencies]
+
+        # the features are calculated at the voxels of the indices task only (see execute_at of the extractors)
+        indices_tasks = []
+        if self.training and self.sparse_training:
+            indices_tasks.append(graph.add('training indices', self._get_training_indices,
+                                           after(structure.BrainImageTypes.GroundTruth)))
+        elif not self.training and self.brain_mask_inference:
+            indices_tasks.append(graph.add('brain mask indices', self._get_brain_mask_indices,
+                                           after(structure.BrainImageTypes.BrainMask)))
+
+        feature_types = []
+        feature_tasks = []
+        for feature_type, image_type, dense_fn, sparse_fn, _ in self._get_feature_stages():
+            if indices_tasks:
+                fn = lambda fn=sparse_fn, image_type=image_type: fn(self.img.images[image_type],
+                                                                     graph.result(indices_tasks[0]))
+            else:
+                fn = lambda fn=dense_fn, image_type=image_type: fn(self.img.images[image_type])
+            feature_types.append(feature_type)
+            feature_tasks.append(graph.add(feature_type.name, fn, after(image_type) + indices_tasks))
+
+        def assemble():
+            if indices_tasks:
+                self._generate_sparse_feature_matrix(graph.result(indices_tasks[0]),
+                                                     [graph.result(task) for task in feature_tasks])
+            else:
+                for feature_type, task in zip(feature_types, feature_tasks):
+                    self.img.feature_images[feature_type] = graph.result(task)
+                self._generate_feature_matrix()
+
+        return graph.add('feature matrix', assemble,
+                         feature_tasks + indices_tasks + after(structure.BrainImageTypes.GroundTruth))
+
+    def get_number_of_features(self) -> int:
+        """Gets the number of features, i.e. the number of columns of the feature matrix, without extracting them.
+
+        Returns:
+            int: The number of features.
+        """
+        return sum(stage[4] for stage in self._get_feature_stages())
+
+    def _get_feature_stages(self) -> list:
+        """Gets the feature stages in the order of the feature matrix columns.
+
+        Returns:
+            list of tuple: The feature image type, the image type, the function calculating the feature image of the
+            image, the function calculating the features of the image at flat indices, and the number of features.
+        """
+        image_types = (structure.BrainImageTypes.T1w, structure.BrainImageTypes.T2w)
+
+        stages = []
         if self.coordinates_feature:
-            atlas_coordinates = fltr_feat.AtlasCoordinates()
-            self.img.feature_images[FeatureImageTypes.ATLAS_COORD] = \
-                atlas_coordinates.execute(self.img.images[structure.BrainImageTypes.T1w])
+            stages.append((FeatureImageTypes.ATLAS_COORD, structure.BrainImageTypes.T1w,
+                           fltr_feat.AtlasCoordinates().execute, fltr_feat.AtlasCoordinates.execute_at, 3))
 
         if self.intensity_feature:
-            self.img.feature_images[FeatureImageTypes.T1w_INTENSITY] = self.img.images[structure.BrainImageTypes.T1w]
-            self.img.feature_images[FeatureImageTypes.T2w_INTENSITY] = self.img.images[structure.BrainImageTypes.T2w]
+            for feature_type, image_type in zip((FeatureImageTypes.T1w_INTENSITY, FeatureImageTypes.T2w_INTENSITY),
+                                                image_types):
+                stages.append((feature_type, image_type, lambda image: image,
+                               lambda image, indices: sitk.GetArrayViewFromImage(image).reshape(-1)[indices,
+                                                                                                    np.newaxis], 1))
 
         if self.gradient_intensity_feature:
-            # compute gradient magnitude images
-            self.img.feature_images[FeatureImageTypes.T1w_GRADIENT_INTENSITY] = \
-                sitk.GradientMagnitude(self.img.images[structure.BrainImageTypes.T1w])
-            self.img.feature_images[FeatureImageTypes.T2w_GRADIENT_INTENSITY] = \
-                sitk.GradientMagnitude(self.img.images[structure.BrainImageTypes.T2w])
+            for feature_type, image_type in zip((FeatureImageTypes.T1w_GRADIENT_INTENSITY,
+                                                 FeatureImageTypes.T2w_GRADIENT_INTENSITY), image_types):
+                stages.append((feature_type, image_type, sitk.GradientMagnitude,
+                               lambda image, indices: fltr_feat.gradient_magnitude_at(image, indices)[:, np.newaxis],
+                               1))
+
+        if self.neighborhood_feature:
+            for feature_type, image_type in zip((FeatureImageTypes.T1w_NEIGHBORHOOD,
+                                                 FeatureImageTypes.T2w_NEIGHBORHOOD), image_types):
+                neighborhood = self._get_neighborhood_feature_extractor()
+                stages.append((feature_type, image_type, neighborhood.execute, neighborhood.execute_at,
+                               neighborhood._get_number_of_components()))
+
+        if self.scale_space_feature:
+            for feature_type, image_type in zip((FeatureImageTypes.T1w_SCALE_SPACE,
+                                                 FeatureImageTypes.T2w_SCALE_SPACE), image_types):
+                scale_space = self._get_scale_space_feature_extractor()
+                stages.append((feature_type, image_type, scale_space.execute, scale_space.execute_at,
+                               scale_space._get_number_of_components()))
+
+        if self.glcm_feature:
+            for feature_type, image_type in zip((FeatureImageTypes.T1w_GLCM, FeatureImageTypes.T2w_GLCM),
+                                                image_types):
+                glcm = self._get_glcm_feature_extractor()
+                stages.append((feature_type, image_type, glcm.execute, glcm.execute_at, len(glcm.features)))
+
+        return stages
+
+    def _get_neighborhood_feature_extractor(self) -> fltr_feat.NeighborhoodFeatureExtractor:
+        """Gets the neighborhood feature extractor.
 
-        self._generate_feature_matrix()
+        Returns:
+            fltr_feat.NeighborhoodFeatureExtractor: The neighborhood feature extractor.
+        """
+        return fltr_feat.NeighborhoodFeatureExtractor(self.neighborhood_kernel, backend=self.neighborhood_backend,
+                                                      features=self.neighborhood_features, tile_size=self.tile_size,
+                                                      n_workers=self.neighborhood_n_workers)
 
-        return self.img
+    def _get_scale_space_feature_extractor(self) -> fltr_feat.GaussianScaleSpaceFeatureExtractor:
+        """Gets the multi-scale Gaussian feature extractor.
+
+        Returns:
+            fltr_feat.GaussianScaleSpaceFeatureExtractor: The multi-scale Gaussian feature extractor.
+        """
+        return fltr_feat.GaussianScaleSpaceFeatureExtractor(self.scale_space_sigmas, self.scale_space_features)
+
+    def _get_glcm_feature_extractor(self) -> fltr_feat.GLCMFeatureExtractor:
+        """Gets the GLCM feature extractor.
+
+        Returns:
+            fltr_feat.GLCMFeatureExtractor: The GLCM feature extractor.
+        """
+        return fltr_feat.GLCMFeatureExtractor(self.glcm_kernel, self.glcm_levels)
+
+    def _generate_sparse_feature_matrix(self, indices: np.ndarray, columns: t.List[np.ndarray]):
+        """Generates the feature matrix of the features calculated at some voxels only.
+
+        The columns are in the same order as the ones of :meth:`_generate_feature_matrix`.
+
+        Args:
+            indices (np.ndarray): The flat indices of the voxels.
+            columns (list of np.ndarray): The features at the voxels in the order of :meth:`_get_feature_stages`.
+        """
+
+        data = np.concatenate(columns, axis=1)
+        labels = sitk.GetArrayViewFromImage(self.img.images[structure.BrainImageTypes.GroundTruth]).reshape(-1)
+        labels = labels[indices, np.newaxis]
+
+        self.img.feature_matrix = (data.astype(np.float32), labels.astype(np.int16))
+        self.img.feature_indices = indices
 
     def _generate_feature_matrix(self):
-        """Generates a feature matrix."""
-
-        mask = None
-        if self.training:
-            # generate a randomized mask where 1 represents voxels used for training
-            # the mask needs to be binary, where the value 1 is considered as a voxel which is to be loaded
-            # we have following labels:
-            # - 0 (background)
-            # - 1 (white matter)
-            # - 2 (grey matter)
-            # - 3 (Hippocampus)
-            # - 4 (Amygdala)
-            # - 5 (Thalamus)
-
-            # you can exclude background voxels from the training mask generation
-            # mask_background = self.img.images[structure.BrainImageTypes.BrainMask]
-            # and use background_mask=mask_background in get_mask()
-
-            mask = fltr_feat.RandomizedTrainingMaskGenerator.get_mask(
-                self.img.images[structure.BrainImageTypes.GroundTruth],
-                [0, 1, 2, 3, 4, 5],
-                [0.0003, 0.004, 0.003, 0.04, 0.04, 0.02])
-
-            # convert the mask to a logical array where value 1 is False and value 0 is True
-            mask = sitk.GetArrayFromImage(mask)
-            mask = np.logical_not(mask)
+        """Generates a feature matrix.
+
+        The float32 feature matrix is allocated once and each feature image is written into its column block, such that
+        no intermediate copies of the features are made.
+        """
+
+        ground_truth = self.img.images[structure.BrainImageTypes.GroundTruth]
+        indices = self._get_training_indices() if self.training else None
+        no_voxels = ground_truth.GetNumberOfPixels() if indices is None else indices.size
 
         # generate features
-        data = np.concatenate(
-            [self._image_as_numpy_array(image, mask) for id_, image in self.img.feature_images.items()],
-            axis=1)
+        no_features = sum(image.GetNumberOfComponentsPerPixel() for image in self.img.feature_images.values())
+        data = np.empty((no_voxels, no_features), dtype=np.float32)
+        column = 0
+        for id_, image in self.img.feature_images.items():
+            number_of_components = image.GetNumberOfComponentsPerPixel()
+            self._image_as_numpy_array(image, indices, out=data[:, column:column + number_of_components])
+            column += number_of_components
 
         # generate labels (note that we assume to have a ground truth even for testing)
-        labels = self._image_as_numpy_array(self.img.images[structure.BrainImageTypes.GroundTruth], mask)
+        labels = np.empty((no_voxels, 1), dtype=np.int16)
+        self._image_as_numpy_array(ground_truth, indices, out=labels)
 
-        self.img.feature_matrix = (data.astype(np.float32), labels.astype(np.int16))
+        self.img.feature_matrix = (data, labels)
+        self.img.feature_indices = indices
+
+    def _get_training_indices(self) -> np.ndarray:
+        """Gets the flat indices of randomly sampled training voxels.
+
+        If ``training_seed`` is set, the sampling is reproducible and differs between the subjects because the seed
+        is combined with the subject's identifier.
+
+        Returns:
+            np.ndarray: The sorted flat indices of the voxels used for training.
+        """
+        # we have following labels:
+        # - 0 (background)
+        # - 1 (white matter)
+        # - 2 (grey matter)
+        # - 3 (Hippocampus)
+        # - 4 (Amygdala)
+        # - 5 (Thalamus)
+
+        # you can exclude background voxels from the training mask generation
+        # mask_background = self.img.images[structure.BrainImageTypes.BrainMask]
+        # and use background_mask=mask_background in get_indices()
+
+        seed = None
+        if self.training_seed is not None:
+            seed = [self.training_seed, zlib.crc32(self.img.id_.encode())]
+
+        return fltr_feat.RandomizedTrainingMaskGenerator.get_indices(
+            self.img.images[structure.BrainImageTypes.GroundTruth],
+            [0, 1, 2, 3, 4, 5],
+            [0.0003, 0.004, 0.003, 0.04, 0.04, 0.02],
+            seed=seed)
+
+    def _get_brain_mask_indices(self) -> np.ndarray:
+        """Gets the flat indices of the brain mask voxels.
+
+        Returns:
+            np.ndarray: The sorted flat indices of the voxels inside the brain mask dilated by ``brain_mask_margin``.
+        """
+        mask = self.img.images[structure.BrainImageTypes.BrainMask] != 0
+        if self.brain_mask_margin > 0:
+            mask = sitk.BinaryDilate(mask, [self.brain_mask_margin] * mask.GetDimension())
+
+        return np.flatnonzero(sitk.GetArrayViewFromImage(mask))
 
     @staticmethod
-    def _image_as_numpy_array(image: sitk.Image, mask: np.ndarray = None):
+    def _image_as_numpy_array(image: sitk.Image, indices: np.ndarray = None, out: np.ndarray = None):
         """Gets an image as numpy array where each row is a voxel and each column is a feature.
 
         Args:
             image (sitk.Image): The image.
-            mask (np.ndarray): A mask defining which voxels to return. True is background, False is a masked voxel.
+            indices (np.ndarray): The flat indices of the voxels to return. None returns all voxels.
+            out (np.ndarray): An array of shape (number of voxels, number of components) to write the voxels into,
+                casting them to its data type. None allocates a new array of the image's data type.
 
         Returns:
             np.ndarray: An array where each row is a voxel and each column is a feature.
         """
 
         number_of_components = image.GetNumberOfComponentsPerPixel()  # the number of features for this image
-        no_voxels = np.prod(image.GetSize())
-        image = sitk.GetArrayFromImage(image)
+        image = sitk.GetArrayViewFromImage(image).reshape((-1, number_of_components))
 
-        if mask is not None:
-            no_voxels = np.size(mask) - np.count_nonzero(mask)
+        if out is None:
+            return image.copy() if indices is None else image.take(indices, axis=0)
 
-            if number_of_components == 1:
-                masked_image = np.ma.masked_array(image, mask=mask)
-            else:
-                # image is a vector image, make a vector mask
-                vector_mask = np.expand_dims(mask, axis=3)  # shape is now (z, x, y, 1)
-                vector_mask = np.repeat(vector_mask, number_of_components,
-                                        axis=3)  # shape is now (z, x, y, number_of_components)
-                masked_image = np.ma.masked_array(image, mask=vector_mask)
-
-            image = masked_image[~masked_image.mask]
-
-        return image.reshape((no_voxels, number_of_components))
+        if indices is None:
+            out[...] = image
+        else:
+            out[...] = image.take(indices, axis=0)
+        return out
 
 
 def pre_process(id_: str, paths: dict, **kwargs) -> structure.BrainImage:
@@ -169,6 +435,20 @@ def pre_process(id_: str, paths: dict, **kwargs) -> structure.BrainImage:
     - Pre-processing
     - Feature extraction
 
+    If the parameter ``cache_dir`` is given, the result is cached on disk (see :mod:`mialab.utilities.cache`) and
+    loaded instead of processed when neither the input files, the parameters, nor the code changed.
+    ``cache_max_size`` limits the cache size in bytes and ``cache_content_hash`` identifies the input files by their
+    content instead of their size and modification time. Note that a cached training image keeps its randomly sampled
+    training voxels.
+
+    If the parameter ``registration_multi_component`` is True, the T1w and T2w images are registered by a single
+    resampling of a multi-component image (see :func:`register_multi_component
+    <mialab.filtering.preprocessing.register_multi_component>`) instead of separately, with equal results.
+
+    The stages (the pre-processing of each image and the extraction of each feature) are executed as a task graph
+    (see :mod:`mialab.utilities.task_graph`), where the independent stages run in parallel on ``n_threads`` threads.
+    The critical path of the stages is reported.
+
     Args:
         id_ (str): An image identifier.
         paths (dict): A dict, where the keys are an image identifier of type structure.BrainImageTypes
@@ -178,83 +458,205 @@ def pre_process(id_: str, paths: dict, **kwargs) -> structure.BrainImage:
         (structure.BrainImage):
     """
 
+    preprocessing_cache = None
+    if kwargs.get('cache_dir', None) is not None:
+        preprocessing_cache = cache.PreProcessingCache(kwargs['cache_dir'], kwargs.get('cache_max_size', None),
+                                                       kwargs.get('cache_content_hash', False))
+        key = preprocessing_cache.key(id_, paths, kwargs, atlas_identity(kwargs))
+        img = preprocessing_cache.load(key)
+        if img is not None:
+            print('-' * 10, 'Loaded', id_, 'from cache')
+            return img
+
     print('-' * 10, 'Processing', id_)
 
-    # load image
+    # load image, without changing the caller's paths, which are not copied by pickling on the thread backend
+    paths = dict(paths)
     path = paths.pop(id_, '')  # the value with key id_ is the root directory of the image
     path_to_transform = paths.pop(structure.BrainImageTypes.RegistrationTransform, '')
     img = {img_key: sitk.ReadImage(path) for img_key, path in paths.items()}
     transform = sitk.ReadTransform(path_to_transform)
     img = structure.BrainImage(id_, path, img, transform)
 
-    # construct pipeline for brain mask registration
-    # we need to perform this before the T1w and T2w pipeline because the registered mask is used for skull-stripping
-    pipeline_brain_mask = fltr.FilterPipeline()
-    if kwargs.get('registration_pre', False):
-        pipeline_brain_mask.add_filter(fltr_prep.ImageRegistration())
-        pipeline_brain_mask.set_param(fltr_prep.ImageRegistrationParameters(atlas_t1, img.transformation, True),
-                                      len(pipeline_brain_mask.filters) - 1)
-
-    # execute pipeline on the brain mask image
-    img.images[structure.BrainImageTypes.BrainMask] = pipeline_brain_mask.execute(
-        img.images[structure.BrainImageTypes.BrainMask])
-
-    # construct pipeline for T1w image pre-processing
-    pipeline_t1 = fltr.FilterPipeline()
-    if kwargs.get('registration_pre', False):
-        pipeline_t1.add_filter(fltr_prep.ImageRegistration())
-        pipeline_t1.set_param(fltr_prep.ImageRegistrationParameters(atlas_t1, img.transformation),
-                              len(pipeline_t1.filters) - 1)
-    if kwargs.get('skullstrip_pre', False):
-        pipeline_t1.add_filter(fltr_prep.SkullStripping())
-        pipeline_t1.set_param(fltr_prep.SkullStrippingParameters(img.images[structure.BrainImageTypes.BrainMask]),
-                              len(pipeline_t1.filters) - 1)
-    if kwargs.get('normalization_pre', False):
-        pipeline_t1.add_filter(fltr_prep.ImageNormalization())
-
-    # execute pipeline on the T1w image
-    img.images[structure.BrainImageTypes.T1w] = pipeline_t1.execute(img.images[structure.BrainImageTypes.T1w])
-
-    # construct pipeline for T2w image pre-processing
-    pipeline_t2 = fltr.FilterPipeline()
-    if kwargs.get('registration_pre', False):
-        pipeline_t2.add_filter(fltr_prep.ImageRegistration())
-        pipeline_t2.set_param(fltr_prep.ImageRegistrationParameters(atlas_t2, img.transformation),
-                              len(pipeline_t2.filters) - 1)
-    if kwargs.get('skullstrip_pre', False):
-        pipeline_t2.add_filter(fltr_prep.SkullStripping())
-        pipeline_t2.set_param(fltr_prep.SkullStrippingParameters(img.images[structure.BrainImageTypes.BrainMask]),
-                              len(pipeline_t2.filters) - 1)
-    if kwargs.get('normalization_pre', False):
-        pipeline_t2.add_filter(fltr_prep.ImageNormalization())
-
-    # execute pipeline on the T2w image
-    img.images[structure.BrainImageTypes.T2w] = pipeline_t2.execute(img.images[structure.BrainImageTypes.T2w])
-
-    # construct pipeline for ground truth image pre-processing
-    pipeline_gt = fltr.FilterPipeline()
-    if kwargs.get('registration_pre', False):
-        pipeline_gt.add_filter(fltr_prep.ImageRegistration())
-        pipeline_gt.set_param(fltr_prep.ImageRegistrationParameters(atlas_t1, img.transformation, True),
-                              len(pipeline_gt.filters) - 1)
-
-    # execute pipeline on the ground truth image
-    img.images[structure.BrainImageTypes.GroundTruth] = pipeline_gt.execute(
-        img.images[structure.BrainImageTypes.GroundTruth])
-
-    # update image properties to atlas image properties after registration
-    img.image_properties = conversion.ImageProperties(img.images[structure.BrainImageTypes.T1w])
+    # the stages of the pre-processing form a task graph, whose independent stages run on n_threads threads
+    graph = task_graph.TaskGraph()
+    registration = kwargs.get('registration_pre', False)
+    # the T1w and T2w images are either registered separately in their pipelines or together by one resampling
+    multi_component = registration and kwargs.get('registration_multi_component', False)
+
+    def process_brain_mask():
+        # construct pipeline for brain mask registration
+        pipeline_brain_mask = fltr.FilterPipeline()
+        if registration:
+            pipeline_brain_mask.add_filter(fltr_prep.ImageRegistration())
+            pipeline_brain_mask.set_param(fltr_prep.ImageRegistrationParameters(atlas_t1, img.transformation, True),
+                                          len(pipeline_brain_mask.filters) - 1)
+
+        # execute pipeline on the brain mask image
+        img.images[structure.BrainImageTypes.BrainMask] = pipeline_brain_mask.execute(
+            img.images[structure.BrainImageTypes.BrainMask])
+
+    def process_image(image_type: structure.BrainImageTypes, atlas: sitk.Image):
+        # construct pipeline for T1w or T2w image pre-processing
+        pipeline = fltr.FilterPipeline()
+        if registration and not multi_component:
+            pipeline.add_filter(fltr_prep.ImageRegistration())
+            pipeline.set_param(fltr_prep.ImageRegistrationParameters(atlas, img.transformation),
+                               len(pipeline.filters) - 1)
+        if kwargs.get('skullstrip_pre', False):
+            pipeline.add_filter(fltr_prep.SkullStripping())
+            pipeline.set_param(fltr_prep.SkullStrippingParameters(img.images[structure.BrainImageTypes.BrainMask]),
+                               len(pipeline.filters) - 1)
+        if kwargs.get('normalization_pre', False):
+            pipeline.add_filter(fltr_prep.ImageNormalization())
+
+        # execute pipeline on the image
+        img.images[image_type] = pipeline.execute(img.images[image_type])
+
+    def register_images():
+        image_types = (structure.BrainImageTypes.T1w, structure.BrainImageTypes.T2w)
+        registered = fltr_prep.register_multi_component([img.images[image_type] for image_type in image_types],
+                                                        atlas_t1, img.transformation)
+        img.images.update(zip(image_types, registered))
+
+    def process_ground_truth():
+        # construct pipeline for ground truth image pre-processing
+        pipeline_gt = fltr.FilterPipeline()
+        if registration:
+            pipeline_gt.add_filter(fltr_prep.ImageRegistration())
+            pipeline_gt.set_param(fltr_prep.ImageRegistrationParameters(atlas_t1, img.transformation, True),
+                                  len(pipeline_gt.filters) - 1)
+
+        # execute pipeline on the ground truth image
+        img.images[structure.BrainImageTypes.GroundTruth] = pipeline_gt.execute(
+            img.images[structure.BrainImageTypes.GroundTruth])
+
+    # the registered brain mask is used for skull-stripping, thus, the T1w and T2w pipelines depend on it
+    brain_mask_task = graph.add(structure.BrainImageTypes.BrainMask.name, process_brain_mask, [])
+    image_dependencies = [brain_mask_task] if kwargs.get('skullstrip_pre', False) else []
+    if multi_component:
+        image_dependencies.append(graph.add('T1w_T2w_REGISTRATION', register_images, []))
+    dependencies = {
+        structure.BrainImageTypes.BrainMask: brain_mask_task,
+        structure.BrainImageTypes.T1w: graph.add(structure.BrainImageTypes.T1w.name,
+                                                 lambda: process_image(structure.BrainImageTypes.T1w, atlas_t1),
+                                                 image_dependencies),
+        structure.BrainImageTypes.T2w: graph.add(structure.BrainImageTypes.T2w.name,
+                                                 lambda: process_image(structure.BrainImageTypes.T2w, atlas_t2),
+                                                 image_dependencies),
+        structure.BrainImageTypes.GroundTruth: graph.add(structure.BrainImageTypes.GroundTruth.name,
+                                                         process_ground_truth, [])
+    }
 
     # extract the features
     feature_extractor = FeatureExtractor(img, **kwargs)
-    img = feature_extractor.execute()
+    feature_extractor.add_tasks(graph, dependencies)
+
+    graph.execute(kwargs.get('n_threads', 1))
+    print('-' * 10, 'Critical path of', id_, '({:.1f} s of {:.1f} s):'.format(
+        sum(task.duration for task in graph.critical_path()), graph.elapsed),
+        ' -> '.join('{} ({:.1f} s)'.format(task.name, task.duration) for task in graph.critical_path()))
+
+    # update image properties to atlas image properties after registration
+    img.image_properties = conversion.ImageProperties(img.images[structure.BrainImageTypes.T1w])
 
     img.feature_images = {}  # we free up memory because we only need the img.feature_matrix
     # for training of the classifier
 
+    if preprocessing_cache is not None:
+        preprocessing_cache.store(key, img)
+
     return img
 
 
+def predictions_as_images(img: structure.BrainImage, predictions: np.ndarray,
+                          probabilities: np.ndarray) -> t.Tuple[sitk.Image, sitk.Image]:
+    """Converts the predictions of the feature matrix rows of an image back to images.
+
+    If the feature matrix contains some voxels only (see ``feature_indices`` of the image), the predictions are
+    scattered back into full-size images, where the remaining voxels are background, i.e. label 0 with probability 1.
+
+    Args:
+        img (structure.BrainImage): The image.
+        predictions (np.ndarray): The predicted labels of shape (n,).
+        probabilities (np.ndarray): The predicted probabilities of shape (n, number of classes),
+            where the first class is the background.
+
+    Returns:
+        (sitk.Image, sitk.Image): The prediction image (uint8) and the probabilities image (a vector image).
+    """
+
+    if img.feature_indices is not None:
+        no_voxels = int(np.prod(img.image_properties.size))
+
+        full_predictions = np.zeros(no_voxels, dtype=np.uint8)
+        full_predictions[img.feature_indices] = predictions
+        predictions = full_predictions
+
+        full_probabilities = np.zeros((no_voxels, probabilities.shape[1]), dtype=probabilities.dtype)
+        full_probabilities[:, 0] = 1
+        full_probabilities[img.feature_indices] = probabilities
+        probabilities = full_probabilities
+
+    image_prediction = conversion.NumpySimpleITKImageBridge.convert(predictions.astype(np.uint8, copy=False),
+                                                                    img.image_properties)
+    image_probabilities = conversion.NumpySimpleITKImageBridge.convert(probabilities, img.image_properties)
+
+    return image_prediction, image_probabilities
+
+
+def predict(img: structure.BrainImage, **kwargs) -> t.Tuple[sitk.Image, sitk.Image]:
+    """Predicts the labels and probabilities of an image by the classifier of the prediction (see :func:`set_model`).
+
+    Args:
+        img (structure.BrainImage): The pre-processed image with feature matrix.
+        **kwargs: ``model_path`` (str) loads the classifier once per process from the joblib file or compact forest
+            directory (see :func:`load_model`). ``chunk_size`` (int) and ``n_jobs`` (int) configure the
+            :class:`PredictionEngine <mialab.utilities.prediction.PredictionEngine>`.
+
+    Returns:
+        (sitk.Image, sitk.Image): The prediction image (uint8) and the probabilities image (a vector image).
+    """
+
+    print('-' * 10, 'Testing', img.id_)
+
+    if kwargs.get('model_path', None) is not None:
+        load_model(kwargs['model_path'])
+    if model is None:
+        raise ValueError('no model to predict {} (see set_model and load_model)'.format(img.id_))
+
+    engine = prediction.PredictionEngine(model, kwargs.get('chunk_size', 65536), kwargs.get('n_jobs', 1))
+    predictions, probabilities = engine.predict(img.feature_matrix[0])
+    print(' Time elapsed:', engine.elapsed, 's ({:.0f} voxels/s)'.format(engine.voxels_per_second))
+
+    return predictions_as_images(img, predictions, probabilities)
+
+
+def pre_process_and_predict(id_: str, paths: dict, pre_process_params: dict,
+                            predict_params: dict) -> t.Tuple[structure.BrainImage, sitk.Image, sitk.Image]:
+    """Loads and pre-processes an image and predicts it.
+
+    Since the feature matrix is not needed after the prediction, it is freed before the image is returned.
+
+    Args:
+        id_ (str): An image identifier.
+        paths (dict): A dict, where the keys are an image identifier of type structure.BrainImageTypes
+            and the values are paths to the images.
+        pre_process_params (dict): Pre-processing parameters (see :func:`pre_process`).
+        predict_params (dict): Prediction parameters (see :func:`predict`).
+
+    Returns:
+        (structure.BrainImage, sitk.Image, sitk.Image): The image without feature matrix, the prediction image, and the
+        probabilities image.
+    """
+
+    img = pre_process(id_, paths, **pre_process_params)
+    image_prediction, image_probabilities = predict(img, **predict_params)
+    img.feature_matrix = None  # free up memory
+    img.feature_indices = None
+    return img, image_prediction, image_probabilities
+
+
 def post_process(img: structure.BrainImage, segmentation: sitk.Image, probability: sitk.Image,
                  **kwargs) -> sitk.Image:
     """Post-processes a segmentation.
@@ -305,7 +707,8 @@ def init_evaluator(directory: str, result_file_name: str = 'results.csv') -> eva
 
 
 def pre_process_batch(data_batch: t.Dict[structure.BrainImageTypes, structure.BrainImage],
-                      pre_process_params: dict=None, multi_process=True) -> t.List[structure.BrainImage]:
+                      pre_process_params: dict=None, multi_process=True,
+                      pool: mproc.WorkerPool = None) -> t.List[structure.BrainImage]:
     """Loads and pre-processes a batch of images.
 
     The pre-processing includes:
@@ -318,6 +721,7 @@ def pre_process_batch(data_batch: t.Dict[structure.BrainImageTypes, structure.Br
         data_batch (Dict[structure.BrainImageTypes, structure.BrainImage]): Batch of images to be processed.
         pre_process_params (dict): Pre-processing parameters.
         multi_process (bool): Whether to use the parallel processing on multiple cores or to run sequentially.
+        pool (mproc.WorkerPool): The worker pool for the parallel processing. None starts a new pool.
 
     Returns:
         List[structure.BrainImage]: A list of images.
@@ -327,15 +731,45 @@ def pre_process_batch(data_batch: t.Dict[structure.BrainImageTypes, structure.Br
 
     params_list = list(data_batch.items())
     if multi_process:
-        images = mproc.MultiProcessor.run(pre_process, params_list, pre_process_params, mproc.PreProcessingPickleHelper)
+        images = mproc.MultiProcessor.run(pre_process, params_list, pre_process_params, mproc.PreProcessingPickleHelper,
+                                          pool)
     else:
         images = [pre_process(id_, path, **pre_process_params) for id_, path in params_list]
     return images
 
 
+def pre_process_batch_iter(data_batch: t.Dict[structure.BrainImageTypes, structure.BrainImage],
+                           pre_process_params: dict = None, multi_process: bool = True,
+                           pool: mproc.WorkerPool = None) -> t.Iterator[structure.BrainImage]:
+    """Loads and pre-processes a batch of images and yields each image as soon as it is pre-processed.
+
+    Unlike :func:`pre_process_batch`, the images can be consumed (e.g. predicted and evaluated) while the remaining
+    images are still pre-processed. With multiple processes, the images are yielded in the order of completion.
+
+    Args:
+        data_batch (Dict[structure.BrainImageTypes, structure.BrainImage]): Batch of images to be processed.
+        pre_process_params (dict): Pre-processing parameters.
+        multi_process (bool): Whether to use the parallel processing on multiple cores or to run sequentially.
+        pool (mproc.WorkerPool): The worker pool for the parallel processing. None starts a new pool.
+
+    Yields:
+        structure.BrainImage: The pre-processed images.
+    """
+    if pre_process_params is None:
+        pre_process_params = {}
+
+    params_list = list(data_batch.items())
+    if multi_process:
+        yield from mproc.MultiProcessor.run_iter(pre_process, params_list, pre_process_params,
+                                                 mproc.PreProcessingPickleHelper, pool)
+    else:
+        for id_, path in params_list:
+            yield pre_process(id_, path, **pre_process_params)
+
+
 def post_process_batch(brain_images: t.List[structure.BrainImage], segmentations: t.List[sitk.Image],
                        probabilities: t.List[sitk.Image], post_process_params: dict = None,
-                       multi_process: bool = True) -> t.List[sitk.Image]:
+                       multi_process: bool = True, pool: mproc.WorkerPool = None) -> t.List[sitk.Image]:
     """ Post-processes a batch of images.
 
     Args:
@@ -344,6 +778,7 @@ def post_process_batch(brain_images: t.List[structure.BrainImage], segmentations
         probabilities (List[sitk.Image]): The prediction probabilities.
         post_process_params (dict): Post-processing parameters.
         multi_process (bool): Whether to use the parallel processing on multiple cores or to run sequentially.
+        pool (mproc.WorkerPool): The worker pool for the parallel processing. None starts a new pool.
 
     Returns:
         List[sitk.Image]: List of post-processed images
@@ -354,7 +789,72 @@ def post_process_batch(brain_images: t.List[structure.BrainImage], segmentations
     param_list = zip(brain_images, segmentations, probabilities)
     if multi_process:
         pp_images = mproc.MultiProcessor.run(post_process, param_list, post_process_params,
-                                             mproc.PostProcessingPickleHelper)
+                                             mproc.PostProcessingPickleHelper, pool)
     else:
         pp_images = [post_process(img, seg, prob, **post_process_params) for img, seg, prob in param_list]
     return pp_images
+
+
+def predict_batch(brain_images: t.List[structure.BrainImage], predict_params: dict = None,
+                  multi_process: bool = True,
+                  pool: mproc.WorkerPool = None) -> t.List[t.Tuple[sitk.Image, sitk.Image]]:
+    """Predicts a batch of pre-processed images.
+
+    The worker processes do not receive the model with the images. Either they inherit it from the calling process
+    (see :func:`set_model`) if the pool is started afterwards, which shares the model, or they load it once from the
+    file given by the ``model_path`` prediction parameter (see :func:`load_model`).
+
+    Args:
+        brain_images (List[structure.BrainImage]): The pre-processed images with feature matrix.
+        predict_params (dict): Prediction parameters (see :func:`predict`).
+        multi_process (bool): Whether to use the parallel processing on multiple cores or to run sequentially.
+        pool (mproc.WorkerPool): The worker pool for the parallel processing. None starts a new pool.
+
+    Returns:
+        List[Tuple[sitk.Image, sitk.Image]]: The prediction and probabilities images of each image.
+    """
+    if predict_params is None:
+        predict_params = {}
+
+    param_list = [(img,) for img in brain_images]
+    if multi_process:
+        predictions = mproc.MultiProcessor.run(predict, param_list, predict_params, mproc.PredictionPickleHelper,
+                                               pool)
+    else:
+        predictions = [predict(img, **predict_params) for img, in param_list]
+    return predictions
+
+
+def pre_process_and_predict_batch_iter(data_batch: t.Dict[structure.BrainImageTypes, structure.BrainImage],
+                                       pre_process_params: dict = None, predict_params: dict = None,
+                                       multi_process: bool = True, pool: mproc.WorkerPool = None) \
+        -> t.Iterator[t.Tuple[structure.BrainImage, sitk.Image, sitk.Image]]:
+    """Loads, pre-processes, and predicts a batch of images and yields each image as soon as it is predicted.
+
+    Unlike :func:`pre_process_batch_iter` followed by :func:`predict`, each image is predicted by the worker that
+    pre-processed it, such that the feature matrix is never transferred and the subjects are predicted in parallel.
+    The model is provided to the workers as by :func:`predict_batch`.
+
+    Args:
+        data_batch (Dict[structure.BrainImageTypes, structure.BrainImage]): Batch of images to be processed.
+        pre_process_params (dict): Pre-processing parameters.
+        predict_params (dict): Prediction parameters (see :func:`predict`).
+        multi_process (bool): Whether to use the parallel processing on multiple cores or to run sequentially.
+        pool (mproc.WorkerPool): The worker pool for the parallel processing. None starts a new pool.
+
+    Yields:
+        (structure.BrainImage, sitk.Image, sitk.Image): The image without feature matrix, the prediction image, and the
+        probabilities image.
+    """
+    if pre_process_params is None:
+        pre_process_params = {}
+    if predict_params is None:
+        predict_params = {}
+
+    params_list = [(id_, path, pre_process_params, predict_params) for id_, path in data_batch.items()]
+    if multi_process:
+        yield from mproc.MultiProcessor.run_iter(pre_process_and_predict, params_list, None,
+                                                 mproc.PredictionPickleHelper, pool)
+    else:
+        for params in params_list:
+            yield pre_process_and_predict(*params)
@@ -0,0 +1,118 @@
+"""The prediction module holds a single-pass prediction of feature matrices in chunks of rows.
+
+Calling ``predict`` and ``predict_proba`` of a forest traverses all trees twice, and ``predict_proba`` allocates the
+float64 probabilities of all rows at once. The :class:`PredictionEngine` traverses the trees once per chunk of rows,
+derives the labels as the argmax of the probabilities, and writes both into preallocated uint8 and float32 buffers.
+"""
+import concurrent.futures as futures
+import timeit
+import typing as t
+
+import numpy as np
+
+
+class PredictionEngine:
+    """Represents a single-pass prediction of feature matrices by a classifier in chunks of rows.
+
+    The labels are the classes with the highest probability, which equals ``predict`` of scikit-learn classifiers.
+    The chunks are predicted by a pool of threads, since the tree traversal of scikit-learn releases the GIL.
+
+    Examples:
+        >>> engine = PredictionEngine(forest, chunk_size=65536, n_jobs=4)
+        >>> labels, probabilities = engine.predict(img.feature_matrix[0])
+        >>> print(engine)
+    """
+
+    def __init__(self, model, chunk_size: int = 65536, n_jobs: int = 1):
+        """Initializes a new instance of the PredictionEngine class.
+
+        Args:
+            model: The trained classifier with ``predict_proba`` and ``classes_``, e.g. a random forest. Its own
+                parallelization (e.g. ``n_jobs`` of a forest) is used within each chunk.
+            chunk_size (int): The number of rows per chunk, which bounds the temporary memory of the classifier.
+            n_jobs (int): The number of threads predicting chunks in parallel.
+
+        Raises:
+            ValueError: If the chunk size or the number of threads is not positive or the classes are no labels.
+        """
+        if chunk_size < 1 or n_jobs < 1:
+            raise ValueError('chunk_size and n_jobs must be positive')
+        classes = np.asarray(model.classes_)
+        if classes.min() < 0 or classes.max() > np.iinfo(np.uint8).max:
+            raise ValueError('classes must be labels between 0 and 255')
+        self.model = model
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.classes = classes.astype(np.uint8)
+        self.no_rows = 0  # the number of rows and the duration in seconds of the last prediction
+        self.elapsed = None
+
+    @property
+    def voxels_per_second(self) -> float:
+        """float: The throughput of the last prediction."""
+        return self.no_rows / max(self.elapsed, 1e-9)
+
+    def predict(self, features: np.ndarray, labels: np.ndarray = None,
+                probabilities: np.ndarray = None) -> t.Tuple[np.ndarray, np.ndarray]:
+        """Predicts the labels and probabilities of the rows of a feature matrix.
+
+        Args:
+            features (np.ndarray): The features of shape (n, number of features).
+            labels (np.ndarray): The uint8 buffer of shape (n,) for the labels. None allocates a new one.
+            probabilities (np.ndarray): The float32 buffer of shape (n, number of classes) for the probabilities.
+                None allocates a new one.
+
+        Returns:
+            (np.ndarray, np.ndarray): The labels and probabilities.
+
+        Raises:
+            ValueError: If the shape or type of a buffer does not match.
+        """
+        no_rows = features.shape[0]
+        if labels is None:
+            labels = np.empty(no_rows, np.uint8)
+        if probabilities is None:
+            probabilities = np.empty((no_rows, len(self.classes)), np.float32)
+        if labels.shape != (no_rows,) or labels.dtype != np.uint8:
+            raise ValueError('labels must be an uint8 buffer of shape ({},)'.format(no_rows))
+        if probabilities.shape != (no_rows, len(self.classes)) or probabilities.dtype != np.float32:
+            raise ValueError('probabilities must be a float32 buffer of shape ({}, {})'.format(no_rows,
+                                                                                               len(self.classes)))
+
+        def predict_chunk(start: int):
+            stop = min(start + self.chunk_size, no_rows)
+            chunk_probabilities = self.model.predict_proba(features[start:stop])
+            probabilities[start:stop] = chunk_probabilities
+            np.take(self.classes, np.argmax(chunk_probabilities, axis=1), out=labels[start:stop])
+
+        start_time = timeit.default_timer()
+        starts = range(0, no_rows, self.chunk_size)
+        if self.n_jobs == 1 or len(starts) == 1:
+            for start in starts:
+                predict_chunk(start)
+        else:
+            with futures.ThreadPoolExecutor(self.n_jobs) as executor:
+                for future in [executor.submit(predict_chunk, start) for start in starts]:
+                    future.result()  # re-raises the exception of a chunk
+        self.elapsed = timeit.default_timer() - start_time
+        self.no_rows = no_rows
+
+        return labels, probabilities
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        if self.elapsed is None:
+            return 'PredictionEngine:\n' \
+                   ' chunk size: {self.chunk_size}\n' \
+                   ' threads:    {self.n_jobs}\n' \
+                .format(self=self)
+        return 'PredictionEngine:\n' \
+               ' chunk size: {self.chunk_size}\n' \
+               ' threads:    {self.n_jobs}\n' \
+               ' voxels:     {self.no_rows}\n' \
+               ' elapsed:    {self.elapsed:.3f} s ({voxels_per_second:.0f} voxels/s)\n' \
+            .format(self=self, voxels_per_second=self.voxels_per_second)
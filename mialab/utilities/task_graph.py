@@ -0,0 +1,180 @@
+"""The task graph module holds a scheduler of dependent tasks on a thread pool.
+
+The stages of the processing of a single subject, e.g. the pre-processing of the T1w and T2w images, are often
+independent of each other. Since SimpleITK filters and most numpy operations release the GIL, independent stages run in
+parallel on threads without pickling the images.
+"""
+import concurrent.futures as futures
+import timeit
+import typing as t
+
+
+class Task:
+    """Represents a task of a :class:`TaskGraph`."""
+
+    def __init__(self, name: str, fn: t.Callable[[], t.Any], dependencies: t.Tuple[str, ...]):
+        """Initializes a new instance of the Task class.
+
+        Args:
+            name (str): The unique name of the task.
+            fn (callable): The function without arguments to execute.
+            dependencies (tuple of str): The names of the tasks that need to finish before this task starts.
+        """
+        self.name = name
+        self.fn = fn
+        self.dependencies = dependencies
+        self.result = None
+        self.start = None  # the start and stop time relative to the start of the graph execution
+        self.stop = None
+
+    @property
+    def duration(self) -> float:
+        """float: The duration of the execution in seconds."""
+        return self.stop - self.start
+
+
+class TaskGraph:
+    """Represents a directed acyclic graph of tasks, which is executed on a thread pool.
+
+    A task starts as soon as all its dependencies finished. Since the dependencies of a task need to be added before
+    the task itself, the graph is acyclic and the order of addition is a topological order.
+
+    Examples:
+        >>> graph = TaskGraph()
+        >>> graph.add('mask', lambda: register(mask))
+        >>> graph.add('t1', lambda: skull_strip(t1, graph.result('mask')), ['mask'])
+        >>> graph.add('t2', lambda: skull_strip(t2, graph.result('mask')), ['mask'])
+        >>> graph.execute(n_workers=2)
+        >>> print(graph.critical_path())
+    """
+
+    def __init__(self):
+        """Initializes a new, empty instance of the TaskGraph class."""
+        self.tasks = {}  # the tasks in the order of addition
+        self.elapsed = None
+
+    def add(self, name: str, fn: t.Callable[[], t.Any], dependencies: t.Iterable[str] = ()) -> str:
+        """Adds a task.
+
+        Args:
+            name (str): The unique name of the task.
+            fn (callable): The function without arguments to execute. Its return value is available by
+                :meth:`result`.
+            dependencies (iterable of str): The names of the tasks that need to finish before this task starts.
+
+        Returns:
+            str: The name of the task.
+
+        Raises:
+            ValueError: If the name exists or a dependency does not exist.
+        """
+        if name in self.tasks:
+            raise ValueError('task {} already exists'.format(name))
+        dependencies = tuple(dependencies)
+        for dependency in dependencies:
+            if dependency not in self.tasks:
+                raise ValueError('dependency {} of task {} does not exist'.format(dependency, name))
+        self.tasks[name] = Task(name, fn, dependencies)
+        return name
+
+    def result(self, name: str):
+        """Gets the result of a finished task.
+
+        Args:
+            name (str): The name of the task.
+
+        Returns:
+            The return value of the task's function.
+        """
+        return self.tasks[name].result
+
+    def execute(self, n_workers: int = 1):
+        """Executes the tasks.
+
+        Args:
+            n_workers (int): The number of threads. With one thread, the tasks are executed in the order of addition
+                without a thread pool.
+
+        Raises:
+            Exception: The first exception raised by a task. The remaining running tasks are finished, but no new tasks
+                are started.
+        """
+        start_time = timeit.default_timer()
+
+        if n_workers <= 1:
+            for task in self.tasks.values():
+                self._run(task, start_time)
+            self.elapsed = timeit.default_timer() - start_time
+            return
+
+        remaining = {name: set(task.dependencies) for name, task in self.tasks.items()}
+        dependents = {name: [] for name in self.tasks}
+        for name, task in self.tasks.items():
+            for dependency in task.dependencies:
+                dependents[dependency].append(name)
+
+        with futures.ThreadPoolExecutor(n_workers) as executor:
+            running = {}
+
+            def submit_ready():
+                for name in [name for name, dependencies in remaining.items() if not dependencies]:
+                    del remaining[name]
+                    running[executor.submit(self._run, self.tasks[name], start_time)] = name
+
+            submit_ready()
+            while running:
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    future.result()  # re-raises the exception of the task
+                    for dependent in dependents[name]:
+                        remaining[dependent].discard(name)
+                submit_ready()
+
+        self.elapsed = timeit.default_timer() - start_time
+
+    def critical_path(self) -> t.List[Task]:
+        """Gets the critical path of the executed graph, i.e. the chain of dependent tasks with the longest total
+        duration, which bounds the runtime irrespective of the number of threads.
+
+        Returns:
+            list of Task: The tasks of the critical path in the order of execution.
+        """
+        finish = {}  # the duration of the longest chain ending with a task
+        predecessor = {}
+        for name, task in self.tasks.items():  # the order of addition is a topological order
+            predecessor[name] = max(task.dependencies, key=lambda dependency: finish[dependency], default=None)
+            finish[name] = task.duration + (finish[predecessor[name]] if predecessor[name] is not None else 0)
+
+        path = []
+        name = max(finish, key=lambda n: finish[n], default=None)
+        while name is not None:
+            path.append(self.tasks[name])
+            name = predecessor[name]
+        return path[::-1]
+
+    @staticmethod
+    def _run(task: Task, start_time: float):
+        task.start = timeit.default_timer() - start_time
+        task.result = task.fn()
+        task.stop = timeit.default_timer() - start_time
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        if self.elapsed is None:
+            return 'TaskGraph:\n' \
+                   ' tasks: {}\n' \
+                .format(', '.join(self.tasks))
+
+        critical_path = self.critical_path()
+        lines = ['TaskGraph:', ' {:24s} {:>8s} {:>8s} {:>8s}'.format('task', 'start', 'stop', 'duration')]
+        for task in self.tasks.values():
+            lines.append('{}{:24s} {:8.3f} {:8.3f} {:8.3f}'.format('*' if task in critical_path else ' ', task.name,
+                                                                  task.start, task.stop, task.duration))
+        lines.append(' critical path (*): {:.3f} s, elapsed: {:.3f} s'.format(
+            sum(task.duration for task in critical_path), self.elapsed))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,97 @@
+"""The training module holds the out-of-core training of a random forest over chunks of subjects.
+
+A forest fitted on all rows of a :class:`FeatureStore <mialab.utilities.feature_store.FeatureStore>` reads rows at
+random from all subjects, which is slow once the store exceeds the memory. :func:`fit_incremental` grows the forest by
+``warm_start`` instead, i.e. it loads the rows of a chunk of subjects into memory, adds a block of trees fitted on the
+chunk, and releases the chunk before loading the next one. The memory is thus bounded by one chunk, but each tree
+sees the subjects of one chunk only.
+"""
+import timeit
+import typing as t
+
+import numpy as np
+
+import mialab.utilities.feature_store as fstore
+
+
+def chunk_subjects(store: fstore.FeatureStore, subjects_per_chunk: int) -> t.List[t.List[str]]:
+    """Splits the subjects of a store into chunks of consecutive subjects, each containing all classes.
+
+    A chunk is extended by the following subjects until it contains all classes of the store, and subjects left over
+    without all classes are added to the last chunk, since the trees of a forest need to know the same classes.
+
+    Args:
+        store (fstore.FeatureStore): The finalized store.
+        subjects_per_chunk (int): The minimal number of subjects per chunk.
+
+    Returns:
+        list of list of str: The subject identifiers of the chunks in the order of their rows.
+
+    Raises:
+        ValueError: If the number of subjects per chunk is not positive.
+    """
+    if subjects_per_chunk < 1:
+        raise ValueError('subjects_per_chunk must be positive')
+
+    subject_classes = {id_: set(np.unique(store.labels[store.rows(id_)]).tolist()) for id_ in store.ids()}
+    all_classes = set().union(*subject_classes.values())
+
+    chunks = []
+    chunk, chunk_classes = [], set()
+    for id_ in store.ids():
+        chunk.append(id_)
+        chunk_classes |= subject_classes[id_]
+        if len(chunk) >= subjects_per_chunk and chunk_classes == all_classes:
+            chunks.append(chunk)
+            chunk, chunk_classes = [], set()
+    if chunk:
+        if chunks:
+            chunks[-1].extend(chunk)
+        else:
+            chunks.append(chunk)
+    return chunks
+
+
+def fit_incremental(forest, store: fstore.FeatureStore, subjects_per_chunk: int = 1):
+    """Fits a random forest incrementally over chunks of subjects (see :func:`chunk_subjects`).
+
+    The ``n_estimators`` trees of the forest are split into a block per chunk, which is fitted by ``warm_start`` on the
+    rows of the chunk only.
+
+    Args:
+        forest (sklearn.ensemble.RandomForestClassifier): The forest to fit. Its ``n_estimators`` is the total number
+            of trees.
+        store (fstore.FeatureStore): The finalized store with the training rows.
+        subjects_per_chunk (int): The minimal number of subjects per chunk.
+
+    Returns:
+        sklearn.ensemble.RandomForestClassifier: The fitted forest.
+
+    Raises:
+        ValueError: If the forest has fewer trees than the number of chunks.
+    """
+    chunks = chunk_subjects(store, subjects_per_chunk)
+    no_trees = forest.n_estimators
+    if no_trees < len(chunks):
+        raise ValueError('{} trees cannot be split into {} chunks'.format(no_trees, len(chunks)))
+    trees_per_chunk = [len(trees) for trees in np.array_split(np.arange(no_trees), len(chunks))]
+
+    forest.set_params(warm_start=True)
+    no_fitted_trees = 0
+    for i, (chunk, no_chunk_trees) in enumerate(zip(chunks, trees_per_chunk)):
+        start_time = timeit.default_timer()
+        # the rows of consecutive subjects are consecutive, and are copied from the memory-mapped store
+        rows = slice(store.rows(chunk[0]).start, store.rows(chunk[-1]).stop)
+        features = np.array(store.data[rows])
+        labels = np.array(store.labels[rows])
+
+        no_fitted_trees += no_chunk_trees
+        forest.set_params(n_estimators=no_fitted_trees)
+        forest.fit(features, labels)
+        del features, labels  # release the chunk before loading the next one
+        print(' Chunk {}/{}: {} subjects, {} rows, {} trees, {:.1f} s'.format(
+            i + 1, len(chunks), len(chunk), rows.stop - rows.start, no_chunk_trees,
+            timeit.default_timer() - start_time))
+    forest.set_params(warm_start=False)
+
+    return forest
@@ -15,13 +15,15 @@ REQUIRED_PACKAGES = [
     'pymia == 0.3.1',
     'scikit-learn >= 0.23.2',
     'pathos >= 0.2.6',
+    'joblib >= 1.0.0',
+    'threadpoolctl >= 2.0.0',
     # 'pydensecrf >= 1.0rc3',
     'sphinx >= 3.2.1',
     'sphinx_rtd_theme >= 0.5.0',
 ]
 
 TEST_PACKAGES = [
-
+    'pytest >= 6.0',
 ]
 
 setup(
@@ -0,0 +1,5 @@
+"""Configures the tests, i.e. makes the mialab package importable without installing it."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,119 @@
+"""Tests the pre-processing cache (see :mod:`mialab.utilities.cache`)."""
+import os
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+import mialab.data.structure as structure
+import mialab.utilities.cache as cache
+
+
+@pytest.fixture
+def paths(tmp_path) -> dict:
+    paths = {'subject': str(tmp_path)}
+    for image_type in (structure.BrainImageTypes.T1w, structure.BrainImageTypes.T2w):
+        path = tmp_path / (image_type.name + '.txt')
+        path.write_text(image_type.name)
+        paths[image_type] = str(path)
+    return paths
+
+
+def _brain_image(id_: str, size: int = 8) -> structure.BrainImage:
+    image = sitk.GetImageFromArray(np.arange(size ** 3, dtype=np.float32).reshape((size,) * 3))
+    image.SetSpacing((1.0, 2.0, 3.0))
+    img = structure.BrainImage(id_, '/data/' + id_, {structure.BrainImageTypes.T1w: image}, None)
+    img.feature_matrix = (np.ones((5, 3), np.float32), np.arange(5, dtype=np.int16).reshape(-1, 1))
+    return img
+
+
+def test_key_is_stable(tmp_path, paths):
+    preprocessing_cache = cache.PreProcessingCache(str(tmp_path / 'cache'))
+    params = {'skullstrip_pre': True, 'neighborhood_kernel': (3, 3, 3)}
+    assert preprocessing_cache.key('subject', paths, params) == preprocessing_cache.key('subject', paths, dict(params))
+
+
+def test_key_ignores_cache_and_execution_params(tmp_path, paths):
+    preprocessing_cache = cache.PreProcessingCache(str(tmp_path / 'cache'))
+    params = {'skullstrip_pre': True}
+    key = preprocessing_cache.key('subject', paths, params)
+    assert preprocessing_cache.key('subject', paths, dict(params, cache_dir='/tmp', n_threads=8, tile_size=16,
+                                                          neighborhood_n_workers=4)) == key
+
+
+def test_key_changes_with_params_files_and_extra(tmp_path, paths):
+    preprocessing_cache = cache.PreProcessingCache(str(tmp_path / 'cache'))
+    params = {'skullstrip_pre': True}
+    key = preprocessing_cache.key('subject', paths, params)
+    assert preprocessing_cache.key('subject', paths, {'skullstrip_pre': False}) != key
+    assert preprocessing_cache.key('other', paths, params) != key
+    assert preprocessing_cache.key('subject', paths, params, extra='atlas') != key
+
+    path = paths[structure.BrainImageTypes.T1w]
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))  # touched
+    assert preprocessing_cache.key('subject', paths, params) != key
+
+
+def test_content_hash_ignores_touched_files(tmp_path, paths):
+    preprocessing_cache = cache.PreProcessingCache(str(tmp_path / 'cache'), content_hash=True)
+    key = preprocessing_cache.key('subject', paths, {})
+    path = paths[structure.BrainImageTypes.T1w]
+    identity = cache.file_identity(path, content_hash=True)
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.file_identity(path, content_hash=True)['sha256'] == identity['sha256']
+    with open(path, 'w') as f:
+        f.write('changed')
+    assert preprocessing_cache.key('subject', paths, {}) != key
+
+
+def test_store_and_load(tmp_path):
+    preprocessing_cache = cache.PreProcessingCache(str(tmp_path))
+    img = _brain_image('subject')
+    preprocessing_cache.store('key', img)
+
+    loaded = preprocessing_cache.load('key')
+    assert loaded.id_ == img.id_
+    assert loaded.path == img.path
+    image = loaded.images[structure.BrainImageTypes.T1w]
+    np.testing.assert_array_equal(sitk.GetArrayViewFromImage(image),
+                                  sitk.GetArrayViewFromImage(img.images[structure.BrainImageTypes.T1w]))
+    assert image.GetSpacing() == (1.0, 2.0, 3.0)
+    np.testing.assert_array_equal(loaded.feature_matrix[0], img.feature_matrix[0])
+    np.testing.assert_array_equal(loaded.feature_matrix[1], img.feature_matrix[1])
+    assert preprocessing_cache.load('missing') is None
+
+
+@pytest.mark.parametrize('file_name', ['T1w.npy', 'labels.npy', cache.META_FILE_NAME])
+def test_load_of_evicted_entry_is_a_miss(tmp_path, file_name):
+    preprocessing_cache = cache.PreProcessingCache(str(tmp_path))
+    preprocessing_cache.store('key', _brain_image('subject'))
+    os.remove(os.path.join(str(tmp_path), 'key', file_name))  # as if another process is evicting the entry
+
+    assert preprocessing_cache.load('key') is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    preprocessing_cache = cache.PreProcessingCache(str(tmp_path))
+    for i, key in enumerate(('a', 'b', 'c')):
+        preprocessing_cache.store(key, _brain_image(key))
+        os.utime(os.path.join(str(tmp_path), key, cache.META_FILE_NAME), (i, i))
+    preprocessing_cache.load('a')  # the most recently used now
+    sizes = {entry['key']: entry['size'] for entry in preprocessing_cache.entries()}
+
+    removed = preprocessing_cache.evict(sizes['a'] + sizes['c'])
+    assert [entry['key'] for entry in removed] == ['b']
+    assert sorted(entry['key'] for entry in preprocessing_cache.entries()) == ['a', 'c']
+
+
+def test_store_evicts_beyond_max_size(tmp_path):
+    preprocessing_cache = cache.PreProcessingCache(str(tmp_path))
+    preprocessing_cache.store('a', _brain_image('a'))
+    entry_size = preprocessing_cache.size()
+    os.utime(os.path.join(str(tmp_path), 'a', cache.META_FILE_NAME), (0, 0))
+
+    preprocessing_cache.max_size = entry_size * 3 // 2  # one entry, whose meta data differs in size
+    preprocessing_cache.store('b', _brain_image('b'))
+    assert [entry['key'] for entry in preprocessing_cache.entries()] == ['b']
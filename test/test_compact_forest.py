@@ -0,0 +1,69 @@
+"""Tests the compact forest (see :mod:`mialab.utilities.compact_forest`)."""
+import numpy as np
+import pytest
+import sklearn.ensemble as sk_ensemble
+
+import mialab.utilities.compact_forest as compact_forest
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    features = rng.normal(size=(3000, 5)).astype(np.float32)
+    labels = (features[:, 0] > 0).astype(int) + 2 * (features[:, 1] + features[:, 2] > 0.5)
+    return features, labels
+
+
+@pytest.fixture(scope='module')
+def forest(data):
+    return sk_ensemble.RandomForestClassifier(n_estimators=10, max_depth=12, random_state=0).fit(*data)
+
+
+@pytest.mark.parametrize('quantization, tolerance', [(None, 1e-6), (8, 0.5 / 255), (16, 0.5 / 65535)])
+def test_matches_sklearn(data, forest, quantization, tolerance):
+    compact = compact_forest.CompactForest.from_forest(forest, quantization)
+    compact.block_size = 1000  # several blocks, the last one partial
+
+    probabilities = compact.predict_proba(data[0])
+    assert probabilities.dtype == np.float32
+    np.testing.assert_allclose(probabilities, forest.predict_proba(data[0]), rtol=0, atol=tolerance + 1e-6)
+    if quantization is None:
+        np.testing.assert_array_equal(compact.predict(data[0]), forest.predict(data[0]))
+
+
+def test_save_and_load(tmp_path, data, forest):
+    compact = compact_forest.CompactForest.from_forest(forest, 8)
+    compact.save(str(tmp_path))
+
+    for mmap_mode in ('r', None):
+        loaded = compact_forest.CompactForest.load(str(tmp_path), mmap_mode)
+        assert loaded.quantization == 8
+        assert loaded.nbytes == compact.nbytes
+        np.testing.assert_array_equal(loaded.classes_, forest.classes_)
+        np.testing.assert_array_equal(loaded.predict_proba(data[0]), compact.predict_proba(data[0]))
+
+
+def test_missing_values(data):
+    features, labels = data
+    rng = np.random.default_rng(1)
+    missing = features.copy()
+    missing[rng.random(missing.shape) < 0.2] = np.nan
+
+    for training_features in (features, missing):  # without and with missing values in the training
+        forest = sk_ensemble.RandomForestClassifier(n_estimators=5, random_state=0).fit(training_features, labels)
+        compact = compact_forest.CompactForest.from_forest(forest)
+        np.testing.assert_allclose(compact.predict_proba(missing), forest.predict_proba(missing), rtol=0, atol=1e-6)
+
+
+def test_single_leaf_trees():
+    forest = sk_ensemble.RandomForestClassifier(n_estimators=3, random_state=0).fit(np.zeros((4, 2)), [0, 1, 0, 1])
+    compact = compact_forest.CompactForest.from_forest(forest)
+    np.testing.assert_allclose(compact.predict_proba(np.ones((7, 2))), forest.predict_proba(np.ones((7, 2))),
+                               atol=1e-6)
+
+
+def test_invalid_input(forest):
+    with pytest.raises(ValueError):
+        compact_forest.CompactForest.from_forest(forest, quantization=4)
+    with pytest.raises(ValueError):
+        compact_forest.CompactForest.from_forest(forest).predict_proba(np.zeros((3, 4)))
@@ -0,0 +1,49 @@
+"""Tests the execution policy (see :mod:`mialab.utilities.concurrency`)."""
+import os
+
+import pytest
+import SimpleITK as sitk
+import threadpoolctl
+
+import mialab.utilities.concurrency as concurrency
+
+
+def _limits():
+    return (sitk.ProcessObject.GetGlobalDefaultNumberOfThreads(),
+            [info['num_threads'] for info in threadpoolctl.threadpool_info()],
+            {variable: os.environ.get(variable) for variable in concurrency.THREAD_ENVIRONMENT_VARIABLES})
+
+
+@pytest.mark.parametrize('n_workers', [1, 2, 3, 8])
+@pytest.mark.parametrize('stage_threads', [1, 2, 3, 16])
+def test_policy_threads(n_workers, stage_threads):
+    policy = concurrency.ExecutionPolicy('process', n_workers, n_cpus=8, stage_threads=stage_threads)
+
+    assert policy.threads_per_worker == 8 // n_workers
+    assert 1 <= policy.stage_threads <= min(stage_threads, policy.threads_per_worker)
+    assert policy.filter_threads >= 1
+    assert policy.n_workers * policy.stage_threads * policy.filter_threads <= 8
+
+
+def test_thread_pool_restores_limits():
+    before = _limits()
+    policy = concurrency.ExecutionPolicy('thread', 2, n_cpus=4)
+    with policy.worker_pool() as pool:
+        assert sitk.ProcessObject.GetGlobalDefaultNumberOfThreads() == policy.filter_threads == 2
+        assert os.environ['OMP_NUM_THREADS'] == '2'
+        assert pool.pool.map(lambda _: sitk.ProcessObject.GetGlobalDefaultNumberOfThreads(), range(2)) == [2, 2]
+    assert _limits() == before
+
+    with pytest.raises(RuntimeError):
+        with policy.worker_pool():
+            raise RuntimeError()
+    assert _limits() == before
+
+
+def test_thread_limits():
+    before = _limits()
+    with concurrency.ThreadLimits(3) as limits:
+        assert sitk.ProcessObject.GetGlobalDefaultNumberOfThreads() == 3
+        limits.restore()
+        assert _limits() == before
+    assert _limits() == before
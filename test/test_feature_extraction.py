@@ -0,0 +1,180 @@
+"""Tests the feature extraction (see :mod:`mialab.filtering.feature_extraction`), i.e. the backends of the
+neighborhood feature extraction against the loop backend and the features of some voxels against the dense ones."""
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+import mialab.filtering.feature_extraction as fltr_feat
+
+KERNELS = [(3, 3, 3), (2, 3, 4)]
+
+
+@pytest.fixture(scope='module')
+def image() -> sitk.Image:
+    rng = np.random.default_rng(0)
+    return sitk.GetImageFromArray(rng.normal(100, 20, (9, 6, 5)).astype(np.float32))
+
+
+def _execute(image: sitk.Image, **kwargs) -> np.ndarray:
+    return sitk.GetArrayFromImage(fltr_feat.NeighborhoodFeatureExtractor(**kwargs).execute(image))
+
+
+def _columns(features: tuple) -> list:
+    return [fltr_feat.FIRST_ORDER_TEXTURE_FEATURES.index(f) for f in features]
+
+
+@pytest.fixture(scope='module')
+def reference(image) -> dict:
+    return {kernel: _execute(image, kernel=kernel, backend='loop') for kernel in KERNELS}
+
+
+@pytest.mark.parametrize('kernel', KERNELS)
+def test_vectorized(image, reference, kernel):
+    np.testing.assert_allclose(_execute(image, kernel=kernel, backend='vectorized'), reference[kernel], rtol=1e-4,
+                               atol=1e-4)
+
+
+@pytest.mark.parametrize('kernel', KERNELS)
+def test_integral(image, reference, kernel):
+    np.testing.assert_allclose(_execute(image, kernel=kernel, backend='integral'),
+                               reference[kernel][..., _columns(fltr_feat.MOMENT_FEATURES)], rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('kernel', KERNELS)
+def test_histogram(image, reference, kernel):
+    bins = 32
+    features = _execute(image, kernel=kernel, backend='histogram', bins=bins)
+
+    exact = fltr_feat.MOMENT_FEATURES + fltr_feat.MIN_MAX_FEATURES
+    np.testing.assert_allclose(features[..., _columns(exact)], reference[kernel][..., _columns(exact)], rtol=1e-4,
+                               atol=1e-4)
+
+    # the percentiles deviate at most half a bin width
+    arr = sitk.GetArrayViewFromImage(image)
+    width = (arr.max() - arr.min()) / bins
+    percentiles = [f for f in fltr_feat.HISTOGRAM_FEATURES if f.startswith('percentile')]
+    error = np.abs(features[..., _columns(percentiles)] - reference[kernel][..., _columns(percentiles)])
+    assert error.max() <= width / 2 + 1e-3
+
+
+@pytest.mark.parametrize('backend', ['loop', 'vectorized', 'integral', 'histogram'])
+@pytest.mark.parametrize('kernel', [(3, 3, 3), (3, 2, 11)])
+def test_tiling(backend, kernel):
+    # float64 intensities, whose sums are rounded differently if the tiles are summed in another order
+    image = sitk.GetImageFromArray(np.random.default_rng(1).normal(100, 20, (25, 6, 5)))
+    single_tile = _execute(image, kernel=kernel, backend=backend, tile_size=None)
+    for tile_size, n_workers in ((3, 1), (7, 2)):
+        np.testing.assert_array_equal(_execute(image, kernel=kernel, backend=backend, tile_size=tile_size,
+                                               n_workers=n_workers), single_tile)
+
+
+def test_glcm_tiling(image):
+    extractor = fltr_feat.GLCMFeatureExtractor((3, 3, 3), levels=4, tile_size=None)
+    single_tile = sitk.GetArrayFromImage(extractor.execute(image))
+    extractor.tile_size = 2
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(extractor.execute(image)), single_tile)
+
+
+@pytest.mark.parametrize('size', [1, 3, 10])
+@pytest.mark.parametrize('origin', [None, 0, 7])
+def test_box_sum(size, origin):
+    arr = np.random.default_rng(0).normal(size=(23, 4, 3))
+    expected = np.lib.stride_tricks.sliding_window_view(arr, size, axis=0).sum(axis=-1)
+    np.testing.assert_allclose(fltr_feat._box_sum(arr, size, 0, direct=False, origin=origin), expected, rtol=1e-12,
+                               atol=1e-12)
+    np.testing.assert_allclose(fltr_feat._box_sum(arr, size, 0, direct=True), expected, rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize('start', [3, 7, 13])
+def test_window_sum_of_slab(start):
+    # the sums of a z-slab are bit for bit the ones of the whole array, which makes the tiling exact
+    arr = np.random.default_rng(0).normal(100, 20, (40, 5, 4)) ** 3
+    window_shape = (11, 3, 3)
+    np.testing.assert_array_equal(fltr_feat._window_sum(arr[start:], window_shape, z_origin=start),
+                                  fltr_feat._window_sum(arr, window_shape)[start:])
+
+
+def _sampled_indices(shape: tuple) -> np.ndarray:
+    """Gets random flat indices and the ones of the corners and of voxels on each face of the image array."""
+    rng = np.random.default_rng(1)
+    corners = np.stack(np.meshgrid(*[(0, s - 1) for s in shape], indexing='ij'), axis=-1).reshape(-1, 3)
+    faces = rng.integers(0, shape, (12, 3))
+    for i, face in enumerate(faces):
+        face[i % 3] = 0 if i % 2 == 0 else shape[i % 3] - 1
+    indices = np.concatenate([np.ravel_multi_index(tuple(np.concatenate([corners, faces]).T), shape),
+                              rng.choice(int(np.prod(shape)), 40, replace=False)])
+    return np.sort(indices)
+
+
+def test_scale_space_at():
+    rng = np.random.default_rng(0)
+    image = sitk.GetImageFromArray(rng.normal(100, 20, (11, 9, 8)).astype(np.float32))
+    image.SetSpacing((0.8, 1.2, 1.5))
+    indices = _sampled_indices((11, 9, 8))
+    extractor = fltr_feat.GaussianScaleSpaceFeatureExtractor(sigmas=(1, 2))
+
+    expected = sitk.GetArrayFromImage(extractor.execute(image)).reshape(-1, extractor._get_number_of_components())
+    np.testing.assert_array_equal(extractor.execute_at(image, indices), expected[indices])
+
+
+def test_atlas_coordinates_at():
+    image = sitk.Image(8, 9, 11, sitk.sitkFloat32)
+    image.SetSpacing((0.8, 1.2, 1.5))
+    image.SetOrigin((-90.5, 120.25, -70))
+    image.SetDirection(sitk.VersorTransform((0.2, 0.3, 0.9), 0.4).GetMatrix())
+    indices = _sampled_indices((11, 9, 8))
+
+    expected = sitk.GetArrayFromImage(fltr_feat.AtlasCoordinates().execute(image)).reshape(-1, 3)
+    np.testing.assert_array_equal(fltr_feat.AtlasCoordinates.execute_at(image, indices).astype(np.float32),
+                                  expected[indices])
+
+
+@pytest.mark.parametrize('pixel_type', [sitk.sitkInt16, sitk.sitkFloat32])
+def test_gradient_magnitude_at(pixel_type):
+    rng = np.random.default_rng(0)
+    image = sitk.Cast(sitk.GetImageFromArray(rng.normal(100, 20, (11, 9, 8))), pixel_type)
+    image.SetSpacing((0.8, 1.2, 1.5))
+    indices = _sampled_indices((11, 9, 8))
+
+    expected = sitk.GetArrayFromImage(sitk.GradientMagnitude(image)).reshape(-1)
+    np.testing.assert_allclose(fltr_feat.gradient_magnitude_at(image, indices), expected[indices], rtol=1e-6)
+
+
+def _glcm_brute_force(img_arr: np.ndarray, kernel: tuple, levels: int) -> np.ndarray:
+    """Calculates the GLCM features voxel by voxel from explicit symmetric co-occurrence matrices."""
+    min_value, max_value = img_arr.min(), img_arr.max()
+    quantized = np.clip(np.floor((img_arr - min_value) / ((max_value - min_value) / levels)), 0, levels - 1)
+    window_shape = kernel[::-1]
+    padded = np.pad(quantized.astype(int), [(0, k + 1) for k in window_shape], 'symmetric')
+    i, j = np.indices((levels, levels))
+
+    features = np.empty(img_arr.shape + (len(fltr_feat.GLCM_FEATURES),))
+    for voxel in np.ndindex(img_arr.shape):
+        glcm = np.zeros((levels, levels))
+        for offset in np.ndindex(window_shape):
+            position = np.add(voxel, offset)
+            for axis in range(3):
+                first, second = padded[tuple(position)], padded[tuple(position + np.eye(3, dtype=int)[axis])]
+                glcm[first, second] += 1
+                glcm[second, first] += 1
+        glcm /= glcm.sum()
+        mean = (i * glcm).sum()
+        variance = ((i - mean) ** 2 * glcm).sum()
+        correlation = ((i - mean) * (j - mean) * glcm).sum() / variance if variance > 1e-12 else 1.0
+        features[voxel] = ((i - j) ** 2 * glcm).sum(), (glcm / (1 + (i - j) ** 2)).sum(), correlation, \
+            (glcm ** 2).sum()
+    return features
+
+
+@pytest.mark.parametrize('kernel', [(3, 3, 3), (2, 3, 4)])
+def test_glcm_brute_force(kernel):
+    rng = np.random.default_rng(0)
+    img_arr = rng.normal(100, 20, (6, 5, 7))
+    img_arr[:5, :4, :4] = 100  # constant neighborhoods of the first voxel
+    image = sitk.GetImageFromArray(img_arr)
+    extractor = fltr_feat.GLCMFeatureExtractor(kernel, levels=4, tile_size=None)
+
+    expected = _glcm_brute_force(img_arr, kernel, 4)
+    np.testing.assert_allclose(sitk.GetArrayFromImage(extractor.execute(image)), expected, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(extractor.execute_at(image, np.arange(img_arr.size)), expected.reshape(-1, 4),
+                               rtol=1e-5, atol=1e-6)
@@ -0,0 +1,49 @@
+"""Tests the feature store (see :mod:`mialab.utilities.feature_store`)."""
+import numpy as np
+import pytest
+
+import mialab.utilities.feature_store as fstore
+
+
+def test_append_finalize_and_reopen(tmp_path):
+    rng = np.random.default_rng(0)
+    subjects = {'a': rng.normal(size=(4, 3)), 'b': rng.normal(size=(0, 3)), 'c': rng.normal(size=(6, 3))}
+    with fstore.FeatureStore(str(tmp_path)) as store:
+        for i, (id_, features) in enumerate(subjects.items()):
+            store.append(id_, features, np.full((len(features), 1), i))
+
+    for store in (store, fstore.FeatureStore.open(str(tmp_path))):
+        assert store.ids() == ['a', 'b', 'c']
+        assert store.data.shape == (10, 3)
+        assert store.data.dtype == np.float32
+        assert store.labels.dtype == np.int16
+        for i, (id_, features) in enumerate(subjects.items()):
+            np.testing.assert_array_equal(store.data[store.rows(id_)], features.astype(np.float32))
+            np.testing.assert_array_equal(store.labels[store.rows(id_)], i)
+
+
+def test_empty_store(tmp_path):
+    with fstore.FeatureStore(str(tmp_path)) as store:
+        pass
+
+    for store in (store, fstore.FeatureStore.open(str(tmp_path))):
+        assert store.ids() == []
+        assert store.data.shape == (0, 0)
+        assert store.labels.shape == (0,)
+
+
+def test_invalid_use(tmp_path):
+    store = fstore.FeatureStore(str(tmp_path))
+    store.append('a', np.zeros((2, 3)), np.zeros(2))
+    with pytest.raises(ValueError):
+        store.data  # not finalized
+    with pytest.raises(ValueError):
+        store.append('a', np.zeros((2, 3)), np.zeros(2))  # existing subject
+    with pytest.raises(ValueError):
+        store.append('b', np.zeros((2, 4)), np.zeros(2))  # other number of features
+    with pytest.raises(ValueError):
+        store.append('b', np.zeros((2, 3)), np.zeros(3))  # other number of labels
+
+    store.finalize()
+    with pytest.raises(ValueError):
+        store.append('b', np.zeros((2, 3)), np.zeros(2))
@@ -0,0 +1,65 @@
+"""Tests the training path of the pipeline (see bin/main.py) on a tiny synthetic dataset."""
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+import mialab.utilities.model_registry as model_registry
+
+SHAPE = (12, 14, 10)  # z, y, x
+
+
+@pytest.fixture(scope='module')
+def main():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'main.py')
+    spec = importlib.util.spec_from_file_location('mialab_main', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.main
+
+
+def _write(array, path, pixel_type):
+    sitk.WriteImage(sitk.Cast(sitk.GetImageFromArray(np.asarray(array, np.float64)), pixel_type), path)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    z, y, x = np.indices(SHAPE)
+    mask = ((z - 5.5) / 5) ** 2 + ((y - 6.5) / 6) ** 2 + ((x - 4.5) / 4) ** 2 <= 1
+
+    atlas_dir = tmp_path / 'atlas'
+    atlas_dir.mkdir()
+    _write(mask * 100.0, str(atlas_dir / 'mni_icbm152_t1_tal_nlin_sym_09a_mask.nii.gz'), sitk.sitkFloat32)
+    _write(mask * 50.0, str(atlas_dir / 'mni_icbm152_t2_tal_nlin_sym_09a.nii.gz'), sitk.sitkFloat32)
+
+    train_dir = tmp_path / 'train'
+    for id_ in ('100001', '100002'):
+        subject_dir = train_dir / id_
+        subject_dir.mkdir(parents=True)
+        labels = np.where(mask, 1 + (z * 5) // SHAPE[0], 0)
+        _write(labels * 100 + rng.normal(0, 10, SHAPE), str(subject_dir / 'T1native.nii.gz'), sitk.sitkInt16)
+        _write(labels * 50 + rng.normal(0, 10, SHAPE), str(subject_dir / 'T2native.nii.gz'), sitk.sitkFloat32)
+        _write(labels, str(subject_dir / 'labels_native.nii.gz'), sitk.sitkFloat32)
+        _write(mask, str(subject_dir / 'Brainmasknative.nii.gz'), sitk.sitkInt32)
+        sitk.WriteTransform(sitk.AffineTransform(3), str(subject_dir / 'affine.txt'))
+    return tmp_path
+
+
+@pytest.mark.parametrize('backend', ['process', 'thread'])
+def test_train_only(main, data_dir, backend):
+    model_dir = str(data_dir / 'models')
+    main(str(data_dir / 'result'), str(data_dir / 'atlas'), str(data_dir / 'train'), str(data_dir / 'train'),
+         backend=backend, model_dir=model_dir, train_only=True)
+
+    registry = model_registry.ModelRegistry(model_dir)
+    entries = registry.entries()
+    assert len(entries) == 1
+    assert entries[0]['subjects'] == 2
+    forest = registry.load(entries[0]['key'])
+    assert forest is not None
+    assert len(forest.estimators_) == forest.n_estimators
+    assert set(forest.classes_) <= set(range(6))  # the sparse training samples a few voxels of each image
+    assert not os.path.exists(str(data_dir / 'result'))  # no testing
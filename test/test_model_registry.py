@@ -0,0 +1,58 @@
+"""Tests the model registry (see :mod:`mialab.utilities.model_registry`)."""
+import numpy as np
+import pytest
+import sklearn.ensemble as sk_ensemble
+
+import mialab.data.structure as structure
+import mialab.utilities.model_registry as model_registry
+
+
+@pytest.fixture
+def data_batch(tmp_path) -> dict:
+    data_batch = {}
+    for id_ in ('a', 'b'):
+        path = tmp_path / (id_ + '.txt')
+        path.write_text(id_)
+        data_batch[id_] = {id_: str(tmp_path), structure.BrainImageTypes.T1w: str(path)}
+    return data_batch
+
+
+def test_key(tmp_path, data_batch):
+    registry = model_registry.ModelRegistry(str(tmp_path / 'models'))
+    params = {'skullstrip_pre': True, 'training': True}
+    hyperparameters = {'n_estimators': 10}
+    key = registry.key(data_batch, params, hyperparameters)
+
+    assert registry.key(dict(data_batch), dict(params), dict(hyperparameters)) == key
+    # the training mode and the execution parameters do not change the model
+    assert registry.key(data_batch, dict(params, training=False, n_threads=4, cache_dir='/tmp'),
+                        hyperparameters) == key
+    assert registry.key(data_batch, {'skullstrip_pre': False}, hyperparameters) != key
+    assert registry.key(data_batch, params, {'n_estimators': 20}) != key
+    assert registry.key({'a': data_batch['a']}, params, hyperparameters) != key
+
+
+def test_store_and_load(tmp_path, data_batch):
+    registry = model_registry.ModelRegistry(str(tmp_path / 'models'))
+    params = {'skullstrip_pre': True}
+    hyperparameters = {'n_estimators': 2}
+    key = registry.key(data_batch, params, hyperparameters)
+    assert registry.load(key) is None
+
+    features = np.random.default_rng(0).normal(size=(50, 3))
+    forest = sk_ensemble.RandomForestClassifier(random_state=0, **hyperparameters).fit(features, features[:, 0] > 0)
+    registry.store(key, forest, data_batch, params, hyperparameters)
+
+    loaded = registry.load(key, params)
+    np.testing.assert_array_equal(loaded.predict_proba(features), forest.predict_proba(features))
+    assert registry.find(key[:8]) == key
+    assert registry.meta(key)['subjects'] == ['a', 'b']
+    assert [entry['key'] for entry in registry.entries()] == [key]
+
+    with pytest.warns(UserWarning):
+        registry.load(key, {'skullstrip_pre': False})
+
+    registry.remove(key)
+    assert registry.load(key) is None
+    with pytest.raises(KeyError):
+        registry.find(key[:8])
@@ -0,0 +1,53 @@
+"""Tests the shared-memory transport (see :mod:`mialab.utilities.multi_processor`)."""
+import pickle
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+import mialab.utilities.multi_processor as mproc
+
+pytestmark = pytest.mark.skipif(not mproc.SHARED_MEMORY, reason='shared memory segments are not persistent')
+
+
+def _exists(name: str) -> bool:
+    try:
+        shared_memory.SharedMemory(name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def test_pickled_as_handle():
+    array = np.arange(1000, dtype=np.float32).reshape(10, 100)
+    shared = mproc.SharedArray(array)
+    try:
+        data = pickle.dumps(shared)
+        assert len(data) < array.nbytes
+
+        received = pickle.loads(data)
+        np.testing.assert_array_equal(received.asarray(), array)
+        received.release()
+        assert _exists(shared.name)
+    finally:
+        shared.release(unlink=True)
+
+
+def test_release_and_unlink():
+    shared = mproc.SharedArray(np.ones(10))
+    received = pickle.loads(pickle.dumps(shared))
+    shared.release()
+    np.testing.assert_array_equal(received.asarray(), 1)  # still mapped by the receiver
+
+    received.release(unlink=True)
+    assert not _exists(shared.name)
+    received.release(unlink=True)  # released arrays are ignored
+
+
+def test_empty_array():
+    shared = mproc.SharedArray(np.zeros((0, 3), np.int16))
+    received = pickle.loads(pickle.dumps(shared))
+    assert received.asarray().shape == (0, 3)
+    received.release()
+    shared.release(unlink=True)
+    assert not _exists(shared.name)
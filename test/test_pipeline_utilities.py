@@ -0,0 +1,87 @@
+"""Tests the feature extraction of the pipeline utilities (see :mod:`mialab.utilities.pipeline_utilities`)."""
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+import mialab.data.structure as structure
+import mialab.utilities.pipeline_utilities as putil
+
+SHAPE = (7, 9, 8)  # z, y, x
+FEATURE_PARAMS = {'coordinates_feature': True, 'intensity_feature': True, 'gradient_intensity_feature': True,
+                  'training': False}
+
+
+def _image(array: np.ndarray) -> sitk.Image:
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing((0.9, 1.1, 1.3))
+    image.SetOrigin((-3, 2, 1))
+    return image
+
+
+@pytest.fixture
+def mask() -> np.ndarray:
+    z, y, x = np.indices(SHAPE)
+    return (((z - 3) / 2.5) ** 2 + ((y - 4) / 3.5) ** 2 + ((x - 3.5) / 3) ** 2 <= 1).astype(np.uint8)
+
+
+def _brain_image(mask: np.ndarray) -> structure.BrainImage:
+    rng = np.random.default_rng(0)
+    images = {structure.BrainImageTypes.T1w: _image(rng.normal(100, 20, SHAPE).astype(np.float32)),
+              structure.BrainImageTypes.T2w: _image(rng.normal(50, 10, SHAPE).astype(np.float32)),
+              structure.BrainImageTypes.GroundTruth: _image(mask * rng.integers(1, 6, SHAPE).astype(np.uint8)),
+              structure.BrainImageTypes.BrainMask: _image(mask)}
+    return structure.BrainImage('0', '', images, sitk.AffineTransform(3))
+
+
+@pytest.mark.parametrize('margin', [0, 1])
+def test_brain_mask_indices(mask, margin):
+    dense = putil.FeatureExtractor(_brain_image(mask), **FEATURE_PARAMS).execute()
+    img = putil.FeatureExtractor(_brain_image(mask), brain_mask_inference=True, brain_mask_margin=margin,
+                                 **FEATURE_PARAMS).execute()
+
+    expected_mask = sitk.GetArrayFromImage(sitk.BinaryDilate(_image(mask), [margin] * 3)) if margin > 0 else mask
+    np.testing.assert_array_equal(img.feature_indices, np.flatnonzero(expected_mask))
+    assert dense.feature_indices is None
+    for sparse, full in zip(img.feature_matrix, dense.feature_matrix):
+        np.testing.assert_allclose(sparse, full[img.feature_indices], rtol=1e-6)
+
+
+def test_predictions_as_images(mask):
+    img = putil.FeatureExtractor(_brain_image(mask), brain_mask_inference=True, **FEATURE_PARAMS).execute()
+    rng = np.random.default_rng(1)
+    probabilities = rng.dirichlet(np.ones(6), img.feature_indices.size).astype(np.float32)
+    predictions = probabilities.argmax(axis=1)
+
+    image_prediction, image_probabilities = putil.predictions_as_images(img, predictions, probabilities)
+
+    assert image_prediction.GetSize() == img.images[structure.BrainImageTypes.T1w].GetSize()
+    assert image_prediction.GetOrigin() == img.images[structure.BrainImageTypes.T1w].GetOrigin()
+    prediction_array = sitk.GetArrayFromImage(image_prediction).reshape(-1)
+    probabilities_array = sitk.GetArrayFromImage(image_probabilities).reshape(-1, 6)
+    np.testing.assert_array_equal(prediction_array[img.feature_indices], predictions)
+    np.testing.assert_array_equal(probabilities_array[img.feature_indices], probabilities)
+
+    background = np.flatnonzero(mask.reshape(-1) == 0)
+    assert background.size > 0
+    np.testing.assert_array_equal(prediction_array[background], 0)
+    np.testing.assert_array_equal(probabilities_array[background], np.eye(6)[np.zeros(background.size, int)])
+
+
+def test_neighborhood_execution_params():
+    extractor = putil.FeatureExtractor(None, neighborhood_feature=True, tile_size=5, neighborhood_n_workers=3)
+    neighborhood = extractor._get_neighborhood_feature_extractor()
+    assert (neighborhood.tile_size, neighborhood.n_workers) == (5, 3)
+
+    neighborhood = putil.FeatureExtractor(None, neighborhood_feature=True)._get_neighborhood_feature_extractor()
+    assert (neighborhood.tile_size, neighborhood.n_workers) == (32, 1)
+
+
+def test_atlas_identity(monkeypatch):
+    identities = []
+    for spacing in ((1.0, 1.0, 1.0), (1.0, 1.0, 2.0)):
+        monkeypatch.setattr(putil, 'atlas_t1', _image(np.zeros(SHAPE, np.float32)))
+        putil.atlas_t1.SetSpacing(spacing)
+        assert putil.atlas_identity({'registration_pre': False}) == ''
+        identities.append(putil.atlas_identity({'registration_pre': True}))
+    assert identities[0] != identities[1]
+    assert '' not in identities
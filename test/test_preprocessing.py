@@ -0,0 +1,33 @@
+"""Tests the pre-processing filters (see :mod:`mialab.filtering.preprocessing`)."""
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+import mialab.filtering.preprocessing as fltr_prep
+
+
+@pytest.mark.parametrize('pixel_type', [sitk.sitkInt16, sitk.sitkFloat32])
+def test_register_multi_component(pixel_type):
+    rng = np.random.default_rng(0)
+    images = []
+    for scale in (1000, 300):
+        image = sitk.Cast(sitk.GetImageFromArray(rng.normal(0, scale, (14, 17, 15))), pixel_type)
+        image.SetSpacing((0.9, 1.1, 1.3))
+        image.SetOrigin((-2, 1, 0.5))
+        images.append(image)
+    atlas = sitk.Image(18, 16, 13, sitk.sitkFloat32)
+    atlas.SetOrigin((-4, -1, -2))
+    transform = sitk.AffineTransform(3)
+    transform.SetMatrix((0.95, 0.05, -0.02, -0.03, 1.04, 0.01, 0.02, -0.04, 0.97))
+    transform.SetTranslation((0.7, -0.3, 1.2))
+
+    registered = fltr_prep.register_multi_component(images, atlas, transform)
+
+    registration = fltr_prep.ImageRegistration()
+    params = fltr_prep.ImageRegistrationParameters(atlas, transform)
+    for image, actual in zip(images, registered):
+        expected = registration.execute(image, params)
+        assert actual.GetPixelID() == image.GetPixelID()
+        assert actual.GetSize() == atlas.GetSize()
+        np.testing.assert_array_equal(actual.GetOrigin(), expected.GetOrigin())
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(actual), sitk.GetArrayViewFromImage(expected))
@@ -0,0 +1,61 @@
+"""Tests the task graph (see :mod:`mialab.utilities.task_graph`)."""
+import threading
+import time
+
+import pytest
+
+import mialab.utilities.task_graph as task_graph
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_dependencies_finish_first(n_workers):
+    graph = task_graph.TaskGraph()
+    order = []
+    lock = threading.Lock()
+
+    def task(name: str, duration: float = 0.0):
+        def fn():
+            time.sleep(duration)
+            with lock:
+                order.append(name)
+            return name
+        return fn
+
+    graph.add('a', task('a', 0.05))
+    graph.add('b', task('b'), ['a'])
+    graph.add('c', task('c'))
+    graph.add('d', task('d'), ['b', 'c'])
+    graph.execute(n_workers)
+
+    assert sorted(order) == ['a', 'b', 'c', 'd']
+    assert order.index('a') < order.index('b') < order.index('d')
+    assert order.index('c') < order.index('d')
+    assert graph.result('d') == 'd'
+    for task_ in graph.tasks.values():
+        for dependency in task_.dependencies:
+            assert graph.tasks[dependency].stop <= task_.start
+    assert [task_.name for task_ in graph.critical_path()] == ['a', 'b', 'd']
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_error_propagates_and_stops_dependents(n_workers):
+    graph = task_graph.TaskGraph()
+    started = []
+
+    def fail():
+        raise RuntimeError('failed')
+
+    graph.add('a', fail)
+    graph.add('b', lambda: started.append('b'), ['a'])
+    with pytest.raises(RuntimeError, match='failed'):
+        graph.execute(n_workers)
+    assert started == []
+
+
+def test_invalid_tasks():
+    graph = task_graph.TaskGraph()
+    graph.add('a', lambda: None)
+    with pytest.raises(ValueError):
+        graph.add('a', lambda: None)
+    with pytest.raises(ValueError):
+        graph.add('b', lambda: None, ['missing'])
@@ -0,0 +1,46 @@
+"""Tests the incremental training (see :mod:`mialab.utilities.training`)."""
+import numpy as np
+import pytest
+import sklearn.ensemble as sk_ensemble
+
+import mialab.utilities.feature_store as fstore
+import mialab.utilities.training as training
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    with fstore.FeatureStore(str(tmp_path)) as store:
+        for id_ in ('a', 'b', 'c', 'd', 'e'):
+            features = rng.normal(size=(40, 3))
+            store.append(id_, features, (features[:, 0] > 0).astype(int) + (features[:, 1] > 1))
+        store.append('f', rng.normal(size=(10, 3)), np.zeros(10))  # without all classes
+    return store
+
+
+def test_chunk_subjects(store):
+    chunks = training.chunk_subjects(store, 2)
+    assert [id_ for chunk in chunks for id_ in chunk] == store.ids()
+    assert all(len(chunk) >= 2 for chunk in chunks)
+    for chunk in chunks:
+        labels = np.concatenate([store.labels[store.rows(id_)] for id_ in chunk])
+        assert set(np.unique(labels)) == set(np.unique(store.labels))
+    with pytest.raises(ValueError):
+        training.chunk_subjects(store, 0)
+
+
+@pytest.mark.parametrize('subjects_per_chunk', [1, 2, 10])
+def test_fit_incremental_tree_count(store, subjects_per_chunk):
+    forest = sk_ensemble.RandomForestClassifier(n_estimators=7, random_state=0)
+    training.fit_incremental(forest, store, subjects_per_chunk)
+
+    assert forest.n_estimators == 7
+    assert len(forest.estimators_) == 7
+    assert not forest.warm_start
+    np.testing.assert_array_equal(forest.classes_, np.unique(store.labels))
+    assert forest.predict_proba(store.data[:5]).shape == (5, len(forest.classes_))
+
+
+def test_fit_incremental_too_few_trees(store):
+    with pytest.raises(ValueError):
+        training.fit_incremental(sk_ensemble.RandomForestClassifier(n_estimators=2), store, 1)